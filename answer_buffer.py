@@ -0,0 +1,229 @@
+"""Réponses tapées dans le navigateur, envoyées au serveur par lots.
+
+Avec `st.text_area(on_change=save_answers)`, chaque réponse modifiée coûte un aller-retour
+websocket, un rerun complet et un `save_answers` ; si le websocket tombe (Wi-Fi du
+lycée), le texte tapé entre-temps est perdu. Ici chaque réponse est un petit éditeur
+(composant `st.components.v2`) qui écrit dans le `localStorage` du navigateur, avec
+un numéro de version par réponse incrémenté à chaque frappe. Un composant invisible
+par examen (`answer_sync`) envoie les réponses modifiées en un seul lot toutes les
+`ANSWER_SYNC_INTERVAL` secondes, quand une réponse perd le focus, quand l'onglet passe
+en arrière-plan et au retour du réseau : un rerun par lot au lieu d'un par réponse.
+
+Le serveur garde la version de chaque réponse (`answer_versions`, persistée par
+session_store.py) et n'accepte que les versions plus récentes ; il renvoie ses
+versions au navigateur, qui marque ces réponses comme enregistrées. Une réponse non
+enregistrée reste dans le `localStorage` : elle est renvoyée au lot suivant, après
+une reconnexion ou un rechargement de la page. Une version serveur plus récente
+(autre onglet) remplace le brouillon local.
+
+Sans le composant (AppTest, ancien frontend) ou avec `ANSWER_BUFFER=0`, les réponses
+redeviennent des `st.text_area` enregistrées à chaque modification, comme avant.
+"""
+import logging
+import os
+from functools import partial
+
+from metrics import REGISTRY
+from session_store import ANSWER_PREFIXES
+
+logger = logging.getLogger(__name__)
+
+ANSWER_BUFFER = os.getenv("ANSWER_BUFFER", "1") not in ("0", "false", "no")
+ANSWER_SYNC_INTERVAL = float(os.getenv("ANSWER_SYNC_INTERVAL", "15"))
+# Sent by an editor losing focus (and by exam_timer.py before "time is up") to flush the buffer now
+FLUSH_EVENT = "examaroc:answers-flush"
+
+# Browser buffer shared by the editors and the sync component of one page:
+# localStorage["examaroc:answers:<exam>"] = {key: {text, v, dirty}}
+_BUFFER_JS = """
+const FLUSH_EVENT = "%s";
+const memory = (window.__examarocAnswers = window.__examarocAnswers || {});
+const storageKey = (exam) => `examaroc:answers:${exam}`;
+const readBuffer = (exam) => {
+    try {
+        return JSON.parse(window.localStorage.getItem(storageKey(exam)) || "{}");
+    } catch (e) {
+        // Private browsing or storage disabled: keep the buffer in the page
+        return memory[exam] || {};
+    }
+};
+const writeBuffer = (exam, buffer) => {
+    memory[exam] = buffer;
+    try {
+        window.localStorage.setItem(storageKey(exam), JSON.stringify(buffer));
+    } catch (e) {}
+};
+""" % FLUSH_EVENT
+
+_EDITOR_CSS = """
+.answer-editor { width: 100%; box-sizing: border-box; padding: 0.5rem 0.75rem; font: inherit; line-height: 1.5;
+                 border: 1px solid rgba(49, 51, 63, 0.2); border-radius: 0.5rem; resize: vertical; }
+.answer-editor:focus { outline: none; border-color: #ff4b4b; }
+"""
+
+_EDITOR_JS = _BUFFER_JS + """
+export default function (component) {
+    const { data, parentElement } = component;
+    const buffer = readBuffer(data.exam);
+    let entry = buffer[data.key];
+    // The server copy wins unless this browser holds newer text it has not synced yet
+    if (!entry || !entry.dirty || entry.v <= data.v) {
+        entry = { text: data.text, v: data.v, dirty: false };
+        buffer[data.key] = entry;
+        writeBuffer(data.exam, buffer);
+    }
+    // Called again on every rerun that changes `data`: keep the textarea (focus, caret)
+    let area = parentElement.querySelector("textarea");
+    if (!area) {
+        area = document.createElement("textarea");
+        area.className = "answer-editor";
+        area.setAttribute("aria-label", data.label);
+        parentElement.appendChild(area);
+    }
+    area.style.height = `${data.height}px`;
+    if (area.value !== entry.text) {
+        area.value = entry.text;
+    }
+    const listeners = new AbortController();
+    area.addEventListener("input", () => {
+        const current = readBuffer(data.exam);
+        const v = Math.max((current[data.key] || {}).v || 0, data.v) + 1;
+        current[data.key] = { text: area.value, v, dirty: true };
+        writeBuffer(data.exam, current);
+    }, { signal: listeners.signal });
+    area.addEventListener("blur", () => window.dispatchEvent(new Event(FLUSH_EVENT)), { signal: listeners.signal });
+    return () => listeners.abort();
+}
+"""
+
+_SYNC_JS = _BUFFER_JS + """
+export default function (component) {
+    const { data, parentElement, setStateValue } = component;
+    // Versions the server holds: those answers are saved, stop resending them
+    const buffer = readBuffer(data.exam);
+    for (const [key, v] of Object.entries(data.versions)) {
+        if (buffer[key] && buffer[key].dirty && buffer[key].v <= v) {
+            buffer[key].dirty = false;
+        }
+    }
+    writeBuffer(data.exam, buffer);
+    const flush = () => {
+        if (navigator.onLine === false) {
+            return;
+        }
+        const answers = {};
+        for (const [key, entry] of Object.entries(readBuffer(data.exam))) {
+            if (entry.dirty) {
+                answers[key] = { text: entry.text, v: entry.v };
+            }
+        }
+        if (Object.keys(answers).length) {
+            // State, not a trigger: it survives being merged with a button click's rerun
+            setStateValue("batch", { sent_at: Date.now(), answers });
+        }
+    };
+    const timer = setInterval(flush, data.interval_ms);
+    const listeners = new AbortController();
+    window.addEventListener(FLUSH_EVENT, flush, { signal: listeners.signal });
+    window.addEventListener("online", flush, { signal: listeners.signal });
+    document.addEventListener("visibilitychange", () => {
+        if (document.visibilityState === "hidden") {
+            flush();
+        }
+    }, { signal: listeners.signal });
+    if (!parentElement.__examarocMounted) {
+        // First mount of the page (reload, reconnect): resend what the last page left unsynced
+        parentElement.__examarocMounted = true;
+        flush();
+    }
+    return () => {
+        clearInterval(timer);
+        listeners.abort();
+    };
+}
+"""
+
+_components = {}
+
+
+def _mount(name):
+    if name not in _components:
+        import streamlit as st
+
+        if name == "answer_editor":
+            _components[name] = st.components.v2.component(name, css=_EDITOR_CSS, js=_EDITOR_JS)
+        else:
+            _components[name] = st.components.v2.component(name, js=_SYNC_JS)
+    return _components[name]
+
+
+def _exam_slot(state):
+    # Unsaved generated exams have no id; their answers are never written to Supabase
+    return str(state.get("current_exam_id") or "unsaved")
+
+
+def answer_sync(save, key="answer_sync"):
+    """Mount the batch sync of the open exam; `save()` writes the answers after a batch.
+
+    Returns False when the browser component is unavailable: `answer_editor` then
+    falls back to plain text areas.
+    """
+    import streamlit as st
+
+    if not ANSWER_BUFFER:
+        return False
+    try:
+        _mount("answer_sync")(key=key, data={"exam": _exam_slot(st.session_state),
+                                             "versions": st.session_state.get("answer_versions") or {},
+                                             "interval_ms": int(ANSWER_SYNC_INTERVAL * 1000)},
+                              on_batch_change=partial(_apply_batch, key, save))
+    except Exception as e:
+        logger.debug("answer_buffer: composant indisponible (%s)", e)
+        return False
+    return True
+
+
+def _apply_batch(key, save):
+    """Callback of the sync component: keep the newer versions, then save once."""
+    import streamlit as st
+
+    batch = (st.session_state.get(key) or {}).get("batch") or {}
+    versions = dict(st.session_state.get("answer_versions") or {})
+    accepted = 0
+    for answer_key, item in (batch.get("answers") or {}).items():
+        # The browser only gets to write answers, never other session keys
+        if not isinstance(answer_key, str) or not answer_key.startswith(ANSWER_PREFIXES) or not isinstance(item, dict):
+            continue
+        try:
+            version = int(item.get("v") or 0)
+        except (TypeError, ValueError):
+            continue
+        if version <= versions.get(answer_key, 0):
+            REGISTRY.inc("answer_sync_answers_total", outcome="stale")
+            continue
+        st.session_state[answer_key] = str(item.get("text") or "")
+        versions[answer_key] = version
+        accepted += 1
+    st.session_state.answer_versions = versions
+    if accepted:
+        REGISTRY.inc("answer_sync_answers_total", amount=accepted, outcome="accepted")
+        save()
+
+
+def answer_editor(answer_key, label, height, buffered, on_change=None, read_only=False):
+    """One answer field: the buffered browser editor, or a text area saved on each change."""
+    import streamlit as st
+
+    if read_only:
+        st.text_area(label, key=answer_key, height=height, disabled=True, label_visibility="collapsed")
+        return
+    if buffered:
+        try:
+            _mount("answer_editor")(key=f"editor_{answer_key}",
+                                    data={"exam": _exam_slot(st.session_state), "key": answer_key, "label": label,
+                                          "height": height, "text": str(st.session_state.get(answer_key) or ""),
+                                          "v": (st.session_state.get("answer_versions") or {}).get(answer_key, 0)})
+            return
+        except Exception as e:
+            logger.debug("answer_buffer: éditeur indisponible (%s)", e)
+    st.text_area(label, key=answer_key, height=height, on_change=on_change, label_visibility="collapsed")
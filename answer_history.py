@@ -0,0 +1,161 @@
+"""Historique des réponses d'un examen : journal append-only de deltas.
+
+`student_responses` ne garde que l'état courant. Chaque enregistrement ajoute en plus
+une ligne à `answer_log` (migrations/0008_answer_log.sql) avec un numéro de séquence
+par examen et, pour chaque réponse modifiée, un seul remplacement de texte
+`[début, caractères supprimés, texte inséré]` : une frappe coûte quelques octets, pas
+une copie de toutes les réponses. Toutes les `ANSWER_CHECKPOINT_EVERY` versions, la
+ligne est un point de reprise avec toutes les réponses, si bien qu'une version se
+reconstruit avec au plus ce nombre de deltas (deux requêtes).
+
+Le dernier état enregistré de chaque examen est gardé en mémoire (`ANSWER_HISTORY_HEADS`
+examens) pour calculer le delta suivant sans relire le journal ; une autre réplique
+le reconstruit depuis la base. Deux écritures concurrentes du même numéro sont
+départagées par la clé primaire `(exam_id, seq)`.
+
+L'annulation et la restauration d'une version n'effacent rien : elles enregistrent
+une nouvelle version égale à l'ancienne.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CHECKPOINT_EVERY = max(1, int(os.getenv("ANSWER_CHECKPOINT_EVERY", "50")))
+ANSWER_HISTORY_HEADS = int(os.getenv("ANSWER_HISTORY_HEADS", "2000"))
+
+
+# --- HELPER: deltas de texte ---
+def text_delta(old, new):
+    """Single splice turning `old` into `new`: [start, removed, inserted], or None if equal."""
+    if old == new:
+        return None
+    n = min(len(old), len(new))
+    start = 0
+    while start < n and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < n - start and old[-1 - end] == new[-1 - end]:
+        end += 1
+    return [start, len(old) - start - end, new[start:len(new) - end]]
+
+
+def apply_text_delta(text, delta):
+    start, removed, inserted = delta
+    return text[:start] + inserted + text[start + removed:]
+
+
+def diff_answers(old, new):
+    """Changes from one answers dict to the next: text deltas, {"value": v} for non-text, None for removed keys."""
+    changes = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if previous == value:
+            continue
+        if isinstance(previous, str) and isinstance(value, str):
+            changes[key] = text_delta(previous, value)
+        elif isinstance(value, str):
+            changes[key] = text_delta("", value)
+        else:
+            changes[key] = {"value": value}
+    for key in old:
+        if key not in new:
+            changes[key] = None
+    return changes
+
+
+def apply_changes(answers, changes):
+    answers = dict(answers)
+    for key, change in changes.items():
+        if change is None:
+            answers.pop(key, None)
+        elif isinstance(change, dict):
+            answers[key] = change.get("value")
+        else:
+            previous = answers.get(key)
+            answers[key] = apply_text_delta(previous if isinstance(previous, str) else "", change)
+    return answers
+
+
+# --- Derniers états enregistrés, partagés par les sessions du processus ---
+_heads = OrderedDict()
+_heads_lock = threading.Lock()
+
+
+def _get_head(exam_id):
+    with _heads_lock:
+        head = _heads.get(exam_id)
+        if head is not None:
+            _heads.move_to_end(exam_id)
+        return head
+
+
+def _set_head(exam_id, seq, answers):
+    with _heads_lock:
+        _heads[exam_id] = (seq, dict(answers))
+        _heads.move_to_end(exam_id)
+        while len(_heads) > ANSWER_HISTORY_HEADS:
+            _heads.popitem(last=False)
+
+
+def _forget_head(exam_id):
+    with _heads_lock:
+        _heads.pop(exam_id, None)
+
+
+def _is_conflict(error):
+    # PostgREST reports unique violations with the Postgres error code
+    return str(getattr(error, "code", "")) == "23505" or "duplicate key" in str(error)
+
+
+class AnswerHistory:
+    """Versions of the answers of an exam, stored in `answer_log` through the repository."""
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    def head(self, exam_id):
+        """(seq, answers) of the newest version; (0, {}) before the first one."""
+        head = _get_head(exam_id)
+        if head is None:
+            head = self.state_at(exam_id)
+            _set_head(exam_id, *head)
+        return head
+
+    def record(self, exam_id, answers):
+        """Append the changes since the newest version; returns its seq (unchanged if nothing changed)."""
+        for attempt in range(2):
+            seq, previous = self.head(exam_id)
+            changes = diff_answers(previous, answers)
+            if not changes:
+                return seq
+            seq += 1
+            checkpoint = (seq - 1) % ANSWER_CHECKPOINT_EVERY == 0
+            try:
+                self.repo.append_answer_log(exam_id, seq, "checkpoint" if checkpoint else "delta",
+                                            answers if checkpoint else changes)
+            except Exception as e:
+                if attempt or not _is_conflict(e):
+                    raise
+                # Another tab or replica wrote this seq first: rebuild from the log and diff again
+                logger.info("answer_history: version %s de %s déjà écrite, nouvel essai", seq, exam_id)
+                _forget_head(exam_id)
+                continue
+            _set_head(exam_id, seq, answers)
+            return seq
+
+    def state_at(self, exam_id, seq=None):
+        """(seq, answers) of version `seq` (newest if None): nearest checkpoint plus the deltas after it."""
+        checkpoint = self.repo.get_answer_checkpoint(exam_id, until_seq=seq)
+        answers, current = ({}, 0) if checkpoint is None else (dict(checkpoint["changes"]), checkpoint["seq"])
+        for row in self.repo.get_answer_log(exam_id, after_seq=current, until_seq=seq):
+            answers = apply_changes(answers, row["changes"])
+            current = row["seq"]
+        return current, answers
+
+    def versions(self, exam_id, limit=30):
+        """Newest versions first, for the history view: seq, time, kind and the answers they touch."""
+        return [{"seq": row["seq"], "kind": row["kind"], "created_at": row["created_at"], "keys": sorted(row["changes"])}
+                for row in self.repo.list_answer_log(exam_id, limit=limit)]
@@ -0,0 +1,128 @@
+"""Clés canoniques des réponses enregistrées (`student_responses`).
+
+La réponse d'un exercice d'association (« matching ») a été enregistrée sous plusieurs
+clés : `lang_match_{position}_0` (app_new.py, exercice numéroté par sa position) et
+`lang_{ex}_0` (app.py, puis les deux apps). Cette dernière partage l'espace des questions
+de langue : `lang_{id}_{question}` dans app.py, `lang_{position}_{question}` dans
+app_new.py pour les questions sans id. L'association d'id "1" et la première question de
+l'exercice en position 1 avaient la même clé. Dans les apps et dans les lignes
+enregistrées, la clé canonique est donc `lang_match_{ex}`, `ex` étant l'id de
+l'exercice.
+
+`lang_{ex}_0` n'est une ancienne clé d'association que si l'examen a un exercice
+d'association d'id `ex` et qu'aucune question ne peut porter cette clé : ni l'exercice
+d'id `ex` (clés d'app.py), ni l'exercice en position `ex` s'il a des questions sans id
+(clés d'app_new.py). Dans le cas contraire la clé est laissée telle quelle plutôt que de
+deviner.
+
+Le workflow n8n de correction lit les réponses dans `exams_streamlit` et y trouve
+l'association sous `lang_{ex}_0` depuis la migration de l'ancienne app.
+`workflow_answers` y recopie donc chaque réponse d'association à la soumission, quand
+cette clé n'est pas ambiguë ; la lecture (`canonical_answers`) replie la copie sur la clé
+canonique.
+
+migrate_answer_keys.py réécrit les lignes existantes par lots. Pour les lignes qu'il
+n'a pas encore atteintes (ou les tables d'archive), `canonical_answers` applique la
+même règle à la lecture : les pages n'ont plus à connaître les anciennes clés.
+"""
+
+MATCH_PREFIX = "lang_match_"
+
+
+def matching_key(exercise_id):
+    """Canonical answer key of a matching exercise."""
+    return f"{MATCH_PREFIX}{exercise_id}"
+
+
+def _positional_match(key):
+    # app_new.py wrote lang_match_{position}_0
+    rest = key[len(MATCH_PREFIX):]
+    return rest[:-len("_0")] if rest.endswith("_0") and rest[:-len("_0")].isdigit() else None
+
+
+def has_legacy_keys(answers):
+    """Whether `answers` may hold old matching keys (telling for sure needs the exam)."""
+    if not isinstance(answers, dict):
+        return False
+    for key in answers:
+        if not isinstance(key, str):
+            continue
+        if key.startswith(MATCH_PREFIX):
+            if _positional_match(key) is not None:
+                return True
+        elif key.startswith("lang_") and key.endswith("_0"):
+            return True
+    return False
+
+
+def language_exercises(exam):
+    """Language exercises of a stored or normalized exam body, by position."""
+    if isinstance(exam, dict) and isinstance(exam.get("exam_content"), dict):
+        exam = exam["exam_content"]
+    lang = exam.get("language") if isinstance(exam, dict) else None
+    exercices = (lang.get("exercices") or lang.get("questions") or []) if isinstance(lang, dict) else []
+    return [ex if isinstance(ex, dict) else {} for ex in exercices]
+
+
+def canonical_key(key, exercises=()):
+    if not isinstance(key, str):
+        return key
+    if key.startswith(MATCH_PREFIX):
+        position = _positional_match(key)
+        if position is None:
+            return key
+        position = int(position)
+        ex = exercises[position] if position < len(exercises) else {}
+        return matching_key(ex.get("id", position) if ex.get("matching") else position)
+    if key.startswith("lang_") and key.endswith("_0"):
+        ex_id = key[len("lang_"):-len("_0")]
+        if _is_legacy_matching(ex_id, exercises):
+            return matching_key(ex_id)
+    return key
+
+
+def _is_legacy_matching(ex_id, exercises):
+    # lang_{ex}_0 is also the first question of an exercise: only a matching answer when no question can own it
+    matching = False
+    for pos, ex in enumerate(exercises):
+        questions = ex.get("details") or ex.get("questions")
+        if str(ex.get("id", pos)) == ex_id:
+            if questions:
+                return False  # app.py key of the first question of exercise `ex`
+            matching = matching or bool(ex.get("matching"))
+        if str(pos) == ex_id and questions and not (isinstance(questions[0], dict) and "id" in questions[0]):
+            return False  # app_new.py key of the first id-less question at position `ex`
+    return matching
+
+
+def workflow_answers(answers, exam=None):
+    """`answers` plus each matching answer under `lang_{ex}_0`, the key the n8n workflow reads, when unambiguous."""
+    exercises = language_exercises(exam)
+    result = dict(answers)
+    for key, value in answers.items():
+        if isinstance(key, str) and key.startswith(MATCH_PREFIX) and _positional_match(key) is None:
+            ex_id = key[len(MATCH_PREFIX):]
+            if f"lang_{ex_id}_0" not in answers and _is_legacy_matching(ex_id, exercises):
+                result[f"lang_{ex_id}_0"] = value
+    return result
+
+
+def canonical_answers(answers, exam=None):
+    """`answers` under the canonical keys (the same dict if nothing to rewrite).
+
+    `exam` (stored or normalized body, or a function loading it, called only when
+    there may be something to rewrite) tells matching exercises from questions.
+    """
+    if not has_legacy_keys(answers):
+        return answers
+    exercises = language_exercises(exam() if callable(exam) else exam)
+    renamed = {key: canonical_key(key, exercises) for key in answers}
+    if all(new_key == key for key, new_key in renamed.items()):
+        return answers
+    result = {k: v for k, v in answers.items() if renamed[k] == k}
+    for key, value in answers.items():
+        new_key = renamed[key]
+        # A non-empty value already under the canonical key was written by the newer code
+        if new_key != key and not result.get(new_key):
+            result[new_key] = value
+    return result
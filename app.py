@@ -1,10 +1,23 @@
 import streamlit as st
-import requests
 import time
 from supabase import create_client
 import os
 from dotenv import load_dotenv
 import json
+import uuid
+from functools import partial
+from grading_cache import KEYS_BY_ID, get_grading_cache, index_questions
+from answer_keys import canonical_answers, matching_key
+from auth import forget_session, get_access_code_cache, remember_session, resume_session
+from exam_repository import ExamRepository
+from correction_outbox import enqueue_correction, get_outbox_status, start_dispatcher
+from work_queue import QueueFull, format_wait, get_queue
+from tracing import Trace, finish_correction_trace, show_timeline
+from profiler import operator_profile_panel, profile_rerun
+from session_store import (current_exam, current_exam_shown, current_result, preload_current, show_exam, show_result,
+                           sync_session)
+from metrics import (done_waiting, instrument_supabase, mark_waiting, operator_debug, operator_panel,
+                     start_metrics_server, track_rerun, webhook_post)
 
 # --- Load environment variables ---
 load_dotenv()
@@ -13,12 +26,22 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 N8N_WEBHOOK = os.getenv("N8N_WEBHOOK")
+GENERATION_TIMEOUT = float(os.getenv("GENERATION_TIMEOUT", "180"))
 
 if not SUPABASE_URL or not SUPABASE_KEY:
     st.error("❌ Erreur: SUPABASE_URL ou SUPABASE_KEY manquants. Vérifiez le fichier .env")
     st.stop()
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Chaque requête est chronométrée par table / opération (voir metrics.py)
+supabase = instrument_supabase(create_client(SUPABASE_URL, SUPABASE_KEY))
+# Requêtes des pages, avec uniquement les colonnes utiles (voir exam_repository.py)
+repo = ExamRepository(supabase)
+# Livraison des demandes de correction à n8n en arrière-plan (une seule fois par processus)
+start_dispatcher(supabase)
+# Endpoint Prometheus à côté de Streamlit + durée de ce rerun (+ profilage si activé)
+start_metrics_server()
+track_rerun("app.py")
+profile_rerun("app.py")
 
 st.set_page_config(page_title="Plateforme d'Examens - Bac National", layout="wide", initial_sidebar_state="collapsed")
 
@@ -64,15 +87,9 @@ def _resolve_student_answer(item):
         if item_id and item_id in st.session_state:
             return st.session_state.get(item_id)
 
-        # special fallback for language matching legacy keys
-        if item_id and item_id.startswith('lang_'):
-            ex = item_id[len('lang_'):]
-            # try new-style key
-            k_new = f"lang_{ex}_0"
-            k_old = f"lang_match_{ex}"
-            for k in (k_new, k_old):
-                if k in st.session_state:
-                    return st.session_state.get(k)
+        # a matching item `lang_{ex}` is answered under `lang_match_{ex}` (answers are loaded with canonical keys)
+        if item_id and item_id.startswith('lang_') and matching_key(item_id[len('lang_'):]) in st.session_state:
+            return st.session_state.get(matching_key(item_id[len('lang_'):]))
 
     except Exception:
         pass
@@ -116,14 +133,28 @@ def _get_question_and_text(item_id, exam_json):
                 return sujet.get('sujet', 'Sujet non disponible'), None
     return 'Question non disponible', 'Texte non disponible'
 
+# --- Helper: alimenter le cache de correction partagé avec un résultat reçu ---
+def _remember_corrections(result_row):
+    try:
+        corrections = result_row.get('detailed_correction') or []
+        if isinstance(corrections, str):
+            corrections = json.loads(corrections)
+        exam_data = current_exam(repo)
+        if isinstance(exam_data, str):
+            exam_data = json.loads(exam_data.strip("`json\n"))
+        answers = st.session_state.get('submitted_answers') or result_row.get('student_responses') or {}
+        get_grading_cache().remember(corrections, canonical_answers(answers, exam_data), index_questions(exam_data, KEYS_BY_ID))
+    except Exception:
+        pass
+
 # --- FONCTION D'AUTHENTIFICATION ---
 def verify_access_code(full_name, access_code):
     """Vérifier le code d'accès auprès de Supabase."""
     try:
         # Chercher dans une table 'access_codes' ou stocker une liste autorisée
         # Pour maintenant, utiliser une liste simple ou interroger la DB
-        res = supabase.table("access_codes").select("*").eq("code", access_code).eq("active", True).execute()
-        if res.data:
+        # Codes actifs gardés en mémoire pour tout le processus (voir auth.py)
+        if get_access_code_cache(repo).is_active(access_code):
             st.session_state.authenticated = True
             st.session_state.user_name = full_name
             st.session_state.user_email = f"{full_name.lower().replace(' ', '.')}@exam.local"
@@ -161,6 +192,8 @@ def login_page():
                 if not full_name or not access_code:
                     st.error("❌ Veuillez remplir tous les champs")
                 elif verify_access_code(full_name, access_code):
+                    # Jeton signé dans l'URL : un rafraîchissement de la page garde la session
+                    remember_session(st.session_state.user_name, st.session_state.user_email)
                     st.success(f"✅ Bienvenue {full_name}!")
                     st.balloons()
                     time.sleep(1)
@@ -169,15 +202,14 @@ def login_page():
                     st.error("❌ Code d'accès invalide. Veuillez réessayer.")
 
 # --- PAGE PRINCIPALE ---
-if not st.session_state.authenticated:
+if not st.session_state.authenticated and not resume_session():
     login_page()
     st.stop()
-
-    except Exception:
-        pass
-    return 'N/A'
+sync_session()
 
 # --- UI SIDEBAR ---
+operator_panel()
+operator_profile_panel()
 with st.sidebar:
     st.image("https://blogger.googleusercontent.com/img/a/AVvXsEiBCmVLoZVRiG934gD1HPA0zumw8Ul6ZIvR7OU6V-Du18tpBVNfGZg1pGnKRCPUCi5YrVPRBs7CM5aqu_IxK-AYa5ijLSQ1K58aOTXocRTP5NuJ8HzceZNhk6NuxGVX8spFn05pdcGjQAiJ5uCeLIdWlDRPYl2mwLWDFQF4o2dJ1r6U009QtbY94ESL=s16000", width=100)
     st.title("Générateur d'Examens")
@@ -188,10 +220,11 @@ with st.sidebar:
     st.divider()
     st.subheader("📋 Examens Existants")
     
-    # Charger les examens existants pour cet étudiant
+    # Charger les examens existants pour cet étudiant, en même temps que l'examen et le résultat affichés
+    page = preload_current(repo, exams=partial(repo.list_exams, student_id))
     try:
-        res = supabase.table("exams_streamlit").select("id, created_at, status").eq("student_id", student_id).order("created_at", desc=True).execute()
-        exams = res.data if res.data else []
+        page.raise_for("exams")
+        exams = page["exams"]
         
         if exams:
             # Créer une liste d'affichage pour le selectbox
@@ -200,40 +233,31 @@ with st.sidebar:
             
             if st.button("✅ Charger cet examen"):
                 # Charger l'examen complet avec son contenu
-                full_exam = supabase.table("exams_streamlit").select("*").eq("id", exams[selected_exam_idx]['id']).execute()
-                if full_exam.data:
-                    st.session_state.exam_json = full_exam.data[0].get('exam_content')
+                full_exam = repo.get_exam(exams[selected_exam_idx]['id'])
+                if full_exam:
+                    show_exam(exams[selected_exam_idx]['id'])
                     st.session_state.current_exam_id = exams[selected_exam_idx]['id']
                     # S'assurer que l'ID étudiant est stocké pour l'envoi des webhooks
                     # Utiliser l'ID stocké dans la ligne d'examen si présent (plus fiable)
-                    exam_row_student_id = full_exam.data[0].get('student_id') if full_exam.data and isinstance(full_exam.data[0], dict) else None
+                    exam_row_student_id = full_exam.get('student_id')
                     st.session_state.current_user = exam_row_student_id or student_id
                     # Si des réponses étudiantes sont déjà enregistrées, les charger dans la session
-                    saved_answers = full_exam.data[0].get('student_responses') or full_exam.data[0].get('student_answers') or {}
+                    saved_answers = full_exam.get('student_responses') or {}
                     if isinstance(saved_answers, dict) and saved_answers:
-                        # Charger les réponses dans session_state. Migrer d'anciennes clés 'lang_match_...' vers 'lang_{id}_0'
-                        for k, v in saved_answers.items():
-                            if isinstance(k, str) and k.startswith('lang_match_'):
-                                ex = k[len('lang_match_'):]
-                                new_k = f"lang_{ex}_0"
-                                st.session_state[new_k] = v
-                            else:
-                                st.session_state[k] = v
+                        # Charger les réponses dans session_state (lignes pas encore migrées : clés canoniques, voir answer_keys.py)
+                        for k, v in canonical_answers(saved_answers, full_exam).items():
+                            st.session_state[k] = v
 
                         st.info(f"✅ {len(saved_answers)} réponses précédemment enregistrées chargées.")
                     # Vérifier si une correction existe déjà dans la table `exam_results`
                     try:
-                        res_corr = supabase.table("exam_results")\
-                            .select("*")\
-                            .eq("exam_id", st.session_state.current_exam_id)\
-                            .eq("student_id", st.session_state.current_user)\
-                            .order("created_at", desc=True).limit(1).execute()
-                        if res_corr.data:
-                            st.session_state.correction_data = res_corr.data[0]
+                        result = repo.get_latest_result(st.session_state.current_user, st.session_state.current_exam_id)
+                        if result:
+                            show_result(result)
                             # Si la ligne de résultat contient les réponses de l'étudiant, les charger pour permettre modification
-                            saved_from_result = res_corr.data[0].get('student_responses') or res_corr.data[0].get('student_answers')
+                            saved_from_result = result.get('student_responses') or result.get('student_answers')
                             if isinstance(saved_from_result, dict) and saved_from_result:
-                                for k, v in saved_from_result.items():
+                                for k, v in canonical_answers(saved_from_result, partial(repo.get_exam_content, st.session_state.current_exam_id)).items():
                                     st.session_state[k] = v
                                 st.info(f"✅ {len(saved_from_result)} réponses (de la dernière correction) chargées pour modification.")
                             st.success("✅ Une correction existe déjà pour cet examen. Affichage des résultats.")
@@ -250,42 +274,38 @@ with st.sidebar:
     st.divider()
     
     if st.button("🚀 Générer un nouvel Examen"):
-        payload = {"student_id": student_id, "filiere": filiere}
-        requests.post(N8N_WEBHOOK, json=payload)
-        st.session_state.is_waiting = True
-        st.session_state.current_user = student_id
+        trace = Trace("generate", student_id=student_id)
+        # Le workflow n8n enregistre l'examen avec cet id : une seule ligne par demande (migrations/0012)
+        st.session_state.generation_request_id = st.session_state.get('generation_request_id') or str(uuid.uuid4())
+        payload = {"student_id": student_id, "filiere": filiere, "request_id": st.session_state.generation_request_id,
+                   "trace": trace.context()}
+        try:
+            # File bornée devant le webhook de génération (une demande en cours par étudiant)
+            ticket = get_queue("generation").submit(student_id, webhook_post, "generation", N8N_WEBHOOK, json=payload, timeout=GENERATION_TIMEOUT,
+                                                    headers=trace.headers(), key=f"generation:{student_id}", reuse=True)
+            st.session_state.generation_ticket = ticket.id
+            st.session_state.generation_trace = trace.context()
+            st.session_state.is_waiting = True
+            st.session_state.current_user = student_id
+        except QueueFull as e:
+            st.warning(f"⏳ Serveur de génération saturé. Réessayez dans {format_wait(e.retry_after)}.")
 
     # Bouton manuel pour vérifier/afficher une correction déjà enregistrée
     if st.button("🔍 Voir la correction enregistrée"):
         if not st.session_state.get('current_exam_id'):
             st.warning("Aucun examen sélectionné. Chargez d'abord un examen.")
         else:
-            # Debug: afficher les IDs utilisés
-            st.info(f"Debug: recherche de correction pour exam_id={st.session_state.get('current_exam_id')} student_id={st.session_state.get('current_user')}")
+            operator_debug("Recherche de correction", {"exam_id": st.session_state.get('current_exam_id'), "student_id": st.session_state.get('current_user')})
             try:
-                res_corr = supabase.table("exam_results")\
-                    .select("*")\
-                    .eq("exam_id", st.session_state.current_exam_id)\
-                    .eq("student_id", st.session_state.current_user)\
-                    .order("created_at", desc=True).limit(1).execute()
-                # Afficher le résultat brut pour debug
-                st.write("Debug: réponse brute de la requête:")
-                st.write(res_corr)
-                if res_corr.data:
-                    # montrer le contenu de la ligne
-                    st.write("Debug: contenu de res_corr.data[0]:")
-                    st.json(res_corr.data[0])
-                    st.session_state.correction_data = res_corr.data[0]
+                result = repo.get_latest_result(st.session_state.current_user, st.session_state.current_exam_id)
+                operator_debug("Réponse brute de exam_results", result)
+                if result:
+                    show_result(result)
                     # Charger les réponses contenues dans la correction (si présentes)
-                    saved_from_result = res_corr.data[0].get('student_responses') or res_corr.data[0].get('student_answers')
+                    saved_from_result = result.get('student_responses') or result.get('student_answers')
                     if isinstance(saved_from_result, dict) and saved_from_result:
-                        for k, v in saved_from_result.items():
-                            if isinstance(k, str) and k.startswith('lang_match_'):
-                                ex = k[len('lang_match_'):]
-                                new_k = f"lang_{ex}_0"
-                                st.session_state[new_k] = v
-                            else:
-                                st.session_state[k] = v
+                        for k, v in canonical_answers(saved_from_result, partial(repo.get_exam_content, st.session_state.current_exam_id)).items():
+                            st.session_state[k] = v
                         st.info(f"✅ {len(saved_from_result)} réponses (de la dernière correction) chargées pour modification.")
                     st.success("✅ Correction trouvée et chargée.")
                     st.rerun()
@@ -297,40 +317,66 @@ with st.sidebar:
 # --- LOGIQUE D'ATTENTE ---
 if st.session_state.get("is_waiting"):
     with st.status("Génération de l'examen en cours par l'IA...", expanded=True) as status:
+        queue_status = st.empty()
+        generation_queue = get_queue("generation")
         while True:
+            mark_waiting("generation")
+            # Afficher la position dans la file tant que la demande n'est pas partie vers n8n
+            ticket = generation_queue.get(st.session_state.get('generation_ticket'))
+            if ticket is not None and not ticket.done() and generation_queue.position(ticket):
+                queue_status.info(f"Position dans la file : {generation_queue.position(ticket)} • attente estimée {format_wait(generation_queue.estimated_wait(ticket))}")
+                time.sleep(2)
+                continue
+            if ticket is not None and ticket.state == "failed":
+                status.update(label="Échec de la demande de génération", state="error")
+                st.error(f"Erreur lors de l'appel à n8n: {ticket.error}")
+                st.session_state.is_waiting = False
+                st.session_state.pop('generation_request_id', None)
+                done_waiting("generation")
+                st.stop()
+            queue_status.empty()
             # On cherche l'examen le plus récent pour cet étudiant
-            res = supabase.table("exams_streamlit").select("*").eq("student_id", st.session_state.current_user).order("created_at", desc=True).limit(1).execute()
+            # Statut seulement : le contenu n'est lu qu'une fois l'examen prêt
+            latest = repo.get_latest_exam_status(st.session_state.current_user)
             
-            if res.data and res.data[0]['status'] == 'ready':
-                st.session_state.exam_json = res.data[0]['exam_content']
+            if latest and latest['status'] == 'ready':
+                show_exam(latest['id'])
                 st.session_state.is_waiting = False
+                st.session_state.pop('generation_request_id', None)
+                trace = Trace.from_context(st.session_state.pop('generation_trace', None))
+                if trace is not None:
+                    trace.add_span("total", trace.started_at, time.time())
+                    trace.flush(supabase, latest['id'])
                 status.update(label="Examen prêt !", state="complete", expanded=False)
                 break
             time.sleep(3) # On vérifie toutes les 3 secondes
+        done_waiting("generation")
         st.rerun()
 
 # --- AFFICHAGE DE L'EXAMEN ---
-if st.session_state.get("exam_json"):
+exam_data = None # Corps de l'examen affiché, réutilisé par la page des résultats
+if current_exam_shown():
     # Nettoyage automatique du JSON si nécessaire
     import json
-    data = st.session_state.exam_json
+    data = current_exam(repo)
     if isinstance(data, str):
         try:
             data = json.loads(data.strip("`json\n"))
         except json.JSONDecodeError as e:
             st.error(f"❌ Erreur JSON: {str(e)}")
-            st.json({"raw_data": data})
+            operator_debug("Données brutes reçues", data)
             st.stop()
 
     # Vérification de la structure des données
     if not isinstance(data, dict):
         st.error("❌ Les données ne sont pas un dictionnaire valide")
-        st.write("Type reçu:", type(data))
+        operator_debug("Type reçu", type(data).__name__, data)
         st.stop()
     
+    exam_data = data
+
     # Affichage diagnostic des données
-    with st.expander("📊 Afficher les données brutes"):
-        st.json(data)
+    operator_debug("📊 Données brutes de l'examen", data)
     
     # Essayer d'afficher le titre
     if 'info' in data and 'title' in data['info']:
@@ -385,7 +431,7 @@ if st.session_state.get("exam_json"):
                     st.markdown(f"**{exercice.get('consigne', '')}**")
                     
                     # Si c'est un matching exercise
-                    if 'matching' in exercice:
+                    if exercice.get('matching'):
                         st.write("**Matching Exercise:**")
                         col1, col2 = st.columns(2)
                         with col1:
@@ -396,8 +442,8 @@ if st.session_state.get("exam_json"):
                             st.write("**Fonctions:**")
                             for func in exercice['matching'].get('fonctions', []):
                                 st.write(f"- {func['id']}. {func['text']}")
-                        # Use unified lang key format for matching exercises
-                        st.text_input("Réponses (ex: 1-a, 2-b...)", key=f"lang_{ex_id}_0")
+                        # Canonical key of a matching answer (answer_keys.py)
+                        st.text_input("Réponses (ex: 1-a, 2-b...)", key=matching_key(ex_id))
                     
                     # Si c'est des questions normales
                     if 'details' in exercice:
@@ -444,7 +490,6 @@ if st.session_state.get("exam_json"):
                 # 1. Collecte dynamique des réponses
                 user_answers = {}
                 for key in st.session_state.keys():
-                    # On récupère toutes les clés de réponses (y compris lang_match_ pour compatibilité arrière)
                     if any(key.startswith(prefix) for prefix in ["ans_", "lang_", "writing_", "comp_"]):
                         user_answers[key] = st.session_state[key]
                 
@@ -452,30 +497,28 @@ if st.session_state.get("exam_json"):
                     st.warning("⚠️ Vous n'avez répondu à aucune question.")
                 else:
                     try:
-                        # Debug: afficher les IDs pour troubleshooting
-                        st.info(f"Debug: Soumission avec exam_id={st.session_state.current_exam_id} student_id={st.session_state.current_user}")
-                        
-                        # 2. Enregistrement des réponses dans Supabase
-                        supabase.table("exams_streamlit").update({
-                            "student_responses": user_answers,
-                            "status": "submitted"
-                        }).eq("id", st.session_state.current_exam_id).execute()
-                        
-                        # 3. Appel du Webhook n8n de correction
-                        webhook_correction = os.getenv("N8N_CORRECTION_WEBHOOK", "http://localhost:5678/webhook-test/correction")
-                        requests.post(webhook_correction, json={
-                            "student_id": st.session_state.current_user,
-                            "exam_id": st.session_state.current_exam_id,
-                            "action": "start_correction"
-                        })
+                        operator_debug("Soumission", {"exam_id": st.session_state.current_exam_id, "student_id": st.session_state.current_user})
+
+                        trace = Trace("submit", st.session_state.current_exam_id, st.session_state.current_user)
+                        # 2. Les réponses déjà corrigées pour un autre étudiant sont résolues localement
+                        grading = get_grading_cache().correction_payload(user_answers, index_questions(data, KEYS_BY_ID))
+                        st.session_state.submitted_answers = user_answers
+
+                        # 3. Enregistrement des réponses + demande de correction (outbox, même transaction).
+                        #    Le webhook n8n est appelé en arrière-plan par le dispatcher.
+                        enqueue_correction(supabase, st.session_state.current_exam_id, st.session_state.current_user, user_answers,
+                                           status="submitted", payload={**grading, "trace": trace.context()},
+                                           priority="final_submit", exam=data)
+                        trace.mark("submit", cached=len(grading["cached_corrections"]), to_grade=len(grading["to_grade"]))
+                        trace.flush(supabase)
+                        st.session_state.correction_trace = trace.context()
                         
                         st.session_state.waiting_for_correction = True
                         st.info("⏳ Correction en cours par l'IA... Veuillez patienter quelques secondes.")
                         st.rerun()
                     except Exception as e:
                         st.error(f"❌ Erreur lors de l'envoi : {str(e)}")
-                        st.write(f"Debug - exam_id: {st.session_state.current_exam_id}")
-                        st.write(f"Debug - student_id: {st.session_state.current_user}")
+                        operator_debug("Échec de la soumission", {"exam_id": st.session_state.current_exam_id, "student_id": st.session_state.current_user})
     
     with col_info:
         st.info("💡 Cliquez sur 'Terminer' pour soumettre vos réponses et obtenir votre note.")
@@ -488,60 +531,78 @@ if st.session_state.get("waiting_for_correction"):
     with placeholder.container():
         st.warning("⏳ Votre copie est entre les mains du prof IA... Analyse du Writing en cours.")
         # On peut ajouter un spinner ou une barre de progression
+        queue_status = st.empty()
+        correction_queue = get_queue("correction")
         with st.spinner("Vérification des résultats dans Supabase..."):
             
             found = False
             # On tente de vérifier pendant 90 secondes (30 itérations de 3s)
             for i in range(30):
-                # Requête vers la table des résultats
-                res = supabase.table("exam_results") \
-                    .select("*") \
-                    .eq("student_id", st.session_state.current_user) \
-                    .eq("exam_id", st.session_state.current_exam_id) \
-                    .order("created_at", desc=True) \
-                    .limit(1) \
-                    .execute()
+                mark_waiting("correction")
+                # Position dans la file de correction (tant que la copie n'est pas partie vers n8n)
+                ticket = correction_queue.get(key=st.session_state.current_exam_id)
+                if ticket is not None and not ticket.done() and correction_queue.position(ticket):
+                    queue_status.info(f"📋 Position dans la file de correction : {correction_queue.position(ticket)} • attente estimée {format_wait(correction_queue.estimated_wait(ticket))}")
+                else:
+                    queue_status.empty()
+                # Requête légère vers la table des résultats ; la correction détaillée n'est lue qu'une fois trouvée
+                result = repo.get_latest_result(st.session_state.current_user, st.session_state.current_exam_id)
                 
-                if res.data:
+                if result:
                     # On a trouvé le résultat !
-                    st.session_state.correction_data = res.data[0]
+                    show_result(result)
                     st.session_state.waiting_for_correction = False
+                    _remember_corrections(result)
+                    finish_correction_trace(supabase, st.session_state.pop('correction_trace', None), result)
                     found = True
                     break
                 
                 # Attendre 3 secondes avant la prochaine vérification
                 time.sleep(3)
+            done_waiting("correction")
             
             if found:
                 placeholder.empty() # On efface le message d'attente
                 st.balloons()
                 st.rerun() # On recharge pour afficher les résultats
             else:
-                st.error("Délai de correction dépassé. Veuillez rafraîchir la page ou vérifier n8n.")
+                outbox = None
+                try:
+                    outbox = get_outbox_status(supabase, st.session_state.current_exam_id)
+                except Exception:
+                    pass
+                if outbox and outbox.get('status') == 'dead':
+                    st.error(f"La demande de correction n'a pas pu être transmise à n8n ({outbox.get('attempts')} tentatives) : {outbox.get('last_error')}")
+                elif outbox and outbox.get('status') in ('pending', 'delivering'):
+                    # Toujours en file derrière d'autres copies : on continue d'attendre au lieu d'abandonner
+                    st.rerun()
+                else:
+                    st.error("Délai de correction dépassé. Veuillez rafraîchir la page ou vérifier n8n.")
                 st.session_state.waiting_for_correction = False
 
     progress_placeholder = st.empty()
 # --- AFFICHAGE DES RÉSULTATS (POLLING) OR READY ---
-if st.session_state.get("waiting_for_correction") or st.session_state.get('correction_data'):
+if st.session_state.get("waiting_for_correction") or st.session_state.get('result_ref'):
     # Si on attend la correction, afficher le message d'attente
     if st.session_state.get("waiting_for_correction"):
         st.divider()
         st.subheader("⏳ Correction en cours...")
 
     progress_placeholder = st.empty()
+    if exam_data is None:
+        exam_data = current_exam(repo) or {}
+        if isinstance(exam_data, str):
+            try:
+                exam_data = json.loads(exam_data.strip("`json\n"))
+            except json.JSONDecodeError:
+                exam_data = {}
     
     # On récupère les résultats prêts (soit depuis la session, soit depuis la table)
     try:
         # Si la correction a déjà été récupérée par le polling, on l'utilise
-        resultat = st.session_state.get('correction_data')
-        res = None
+        resultat = current_result(repo)
         if not resultat:
-            res = supabase.table("exam_results")\
-                    .select("*")\
-                    .eq("student_id", st.session_state.current_user)\
-                    .order("created_at", desc=True).limit(1).execute()
-            if res.data:
-                resultat = res.data[0]
+            resultat = repo.get_latest_result(st.session_state.current_user)
         
         if resultat:
             # Si Supabase a renvoyé une chaîne JSON, la parser en dict
@@ -615,7 +676,7 @@ if st.session_state.get("waiting_for_correction") or st.session_state.get('corre
                     saved_rs = resultat.get('student_responses') or resultat.get('student_answers')
                     if isinstance(saved_rs, dict) and saved_rs:
                         if st.button("✏️ Charger les dernières réponses pour modification"):
-                            for k, v in saved_rs.items():
+                            for k, v in canonical_answers(saved_rs, partial(repo.get_exam_content, st.session_state.current_exam_id)).items():
                                 st.session_state[k] = v
                             st.success("✅ Réponses chargées. Modifiez-les puis cliquez sur 'Terminer l'examen...' pour relancer la correction.")
                             st.rerun()
@@ -628,34 +689,34 @@ if st.session_state.get("waiting_for_correction") or st.session_state.get('corre
                             # Collecter les réponses actuelles dans la session
                             user_answers = {}
                             for key in st.session_state.keys():
-                                if any(key.startswith(prefix) for prefix in ["ans_", "lang_", "writing_", "comp_", "lang_match_"]):
+                                if any(key.startswith(prefix) for prefix in ["ans_", "lang_", "writing_", "comp_"]):
                                     user_answers[key] = st.session_state[key]
 
                             if len(user_answers) == 0:
                                 st.warning("⚠️ Vous n'avez répondu à aucune question. Impossible de relancer la correction.")
                             else:
                                 try:
-                                    st.info(f"Debug: Relance avec exam_id={st.session_state.current_exam_id} student_id={st.session_state.current_user}")
-                                    
-                                    supabase.table("exams_streamlit").update({
-                                        "student_responses": user_answers,
-                                        "status": "resubmitted"
-                                    }).eq("id", st.session_state.current_exam_id).execute()
-
-                                    webhook_correction = os.getenv("N8N_CORRECTION_WEBHOOK", "http://localhost:5678/webhook-test/correction")
-                                    requests.post(webhook_correction, json={
-                                        "student_id": st.session_state.current_user,
-                                        "exam_id": st.session_state.current_exam_id,
-                                        "action": "start_correction"
-                                    })
+                                    operator_debug("Relance", {"exam_id": st.session_state.current_exam_id, "student_id": st.session_state.current_user})
+
+                                    trace = Trace("resubmit", st.session_state.current_exam_id, st.session_state.current_user)
+                                    grading = get_grading_cache().correction_payload(user_answers, index_questions(exam_data, KEYS_BY_ID))
+                                    st.session_state.submitted_answers = user_answers
+
+                                    enqueue_correction(supabase, st.session_state.current_exam_id, st.session_state.current_user, user_answers,
+                                                       status="resubmitted", payload={**grading, "trace": trace.context()},
+                                                       priority="regrade", exam=exam_data)
+                                    trace.mark("submit", cached=len(grading["cached_corrections"]), to_grade=len(grading["to_grade"]))
+                                    trace.flush(supabase)
+                                    st.session_state.correction_trace = trace.context()
 
                                     st.session_state.waiting_for_correction = True
                                     st.info("⏳ Relance de la correction demandée. Veuillez patienter...")
                                     st.rerun()
                                 except Exception as e:
                                     st.error(f"Erreur lors de la relance: {e}")
-                                    st.write(f"Debug - exam_id: {st.session_state.current_exam_id}")
-                                    st.write(f"Debug - student_id: {st.session_state.current_user}")
+                                    operator_debug("Échec de la relance", {"exam_id": st.session_state.current_exam_id, "student_id": st.session_state.current_user})
+
+                show_timeline(supabase, st.session_state.get('current_exam_id'))
 
                 # === FEEDBACK GÉNÉRAL ===
                 feedback = resultat.get('feedback_general', 'Pas de feedback')
@@ -745,7 +806,7 @@ if st.session_state.get("waiting_for_correction") or st.session_state.get('corre
                                 left, right = st.columns([2, 3])
                                 with left:
                                     # Afficher la question et le texte associé
-                                    question, texte = _get_question_and_text(item['id'], data if 'data' in locals() else st.session_state.get('exam_json', {}))
+                                    question, texte = _get_question_and_text(item['id'], exam_data)
                                     st.markdown("**Question :**")
                                     st.info(question)
                                     if texte and texte != 'Texte non disponible':
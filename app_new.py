@@ -1,11 +1,29 @@
 import streamlit as st
-import requests
 import time
 from supabase import create_client
 import os
 from dotenv import load_dotenv
 import json
+import uuid
 from datetime import datetime, timezone
+from functools import partial
+from grading_cache import KEYS_BY_POSITION, get_grading_cache, index_questions
+from auth import forget_session, get_access_code_cache, remember_session, resume_session
+from exam_repository import ExamRepository, get_payload_cache
+from exam_schema import ExamPayloadError, parse_payload, validate_exam
+from correction_outbox import enqueue_correction, get_outbox_status, start_dispatcher
+from work_queue import QueueFull, format_wait, get_queue
+from tracing import Trace, finish_correction_trace, show_timeline
+from profiler import operator_profile_panel, profile_rerun
+from page_loader import fetch_all
+from answer_buffer import answer_editor, answer_sync
+from answer_keys import canonical_answers, matching_key
+from answer_history import AnswerHistory
+from exam_timer import EXAM_DURATION_MINUTES, countdown, deadline_for, time_is_up
+from session_store import (close_exam, current_exam, current_exam_shown, current_result, drop_session, preload_current,
+                           show_exam, show_result, show_unsaved_exam, sync_session)
+from metrics import (done_waiting, instrument_supabase, mark_waiting, operator_debug, operator_panel,
+                     start_metrics_server, track_rerun, webhook_post)
 
 # --- Load environment variables ---
 load_dotenv()
@@ -14,12 +32,24 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 N8N_WEBHOOK = os.getenv("N8N_WEBHOOK")
+GENERATION_TIMEOUT = float(os.getenv("GENERATION_TIMEOUT", "180"))
 
 if not SUPABASE_URL or not SUPABASE_KEY:
     st.error("❌ Erreur: SUPABASE_URL ou SUPABASE_KEY manquants. Vérifiez le fichier .env")
     st.stop()
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Chaque requête est chronométrée par table / opération (voir metrics.py)
+supabase = instrument_supabase(create_client(SUPABASE_URL, SUPABASE_KEY))
+# Requêtes des pages, avec uniquement les colonnes utiles (voir exam_repository.py)
+repo = ExamRepository(supabase)
+# Versions des réponses en deltas append-only, pour annuler / restaurer (voir answer_history.py)
+history = AnswerHistory(repo)
+# Livraison des demandes de correction à n8n en arrière-plan (une seule fois par processus)
+start_dispatcher(supabase)
+# Endpoint Prometheus à côté de Streamlit + durée de ce rerun (+ profilage si activé)
+start_metrics_server()
+track_rerun("app_new.py")
+profile_rerun("app_new.py")
 
 st.set_page_config(page_title="Plateforme d'Examens - Bac National", layout="wide", initial_sidebar_state="collapsed")
 
@@ -51,12 +81,17 @@ if 'current_user' not in st.session_state:
     st.session_state.current_user = None
 if 'is_waiting' not in st.session_state:
     st.session_state.is_waiting = False
-if 'correction_data' not in st.session_state:
-    st.session_state.correction_data = None
-if 'exam_json' not in st.session_state:
-    st.session_state.exam_json = None
+# Ids only: exam and result bodies live in the shared cache of exam_repository.py
+if 'result_ref' not in st.session_state:
+    st.session_state.result_ref = None
+if 'exam_ref' not in st.session_state:
+    st.session_state.exam_ref = None
 if 'generation_start_time' not in st.session_state:
     st.session_state.generation_start_time = None
+if 'generation_ticket' not in st.session_state:
+    st.session_state.generation_ticket = None
+if 'current_exam_archived' not in st.session_state:
+    st.session_state.current_exam_archived = False
 
 # --- HELPER: Normalize exam data structure from n8n ---
 def normalize_exam_data(data):
@@ -89,7 +124,7 @@ def normalize_exam_data(data):
                     current_group = None
                     for q in comp['questions']:
                         # Ensure question has a stable ID with comp_ prefix
-                        q_id = q.get('id', '')
+                        q_id = str(q.get('id') or '')
                         if not q_id.startswith('comp_'):
                              q_id = f"comp_gen_{len(groups)}_{q_id or len(groups)}"
                         q['id'] = q_id
@@ -124,7 +159,7 @@ def normalize_exam_data(data):
                     current_group = None
                     for q in lang['questions']:
                         # Ensure question has a stable ID with lang_ prefix
-                        q_id = q.get('id', '')
+                        q_id = str(q.get('id') or '')
                         if not q_id.startswith('lang_'):
                             q_id = f"lang_gen_{len(groups)}_{q_id or len(groups)}"
                         q['id'] = q_id
@@ -156,7 +191,7 @@ def normalize_exam_data(data):
         if 'sujets' in writ:
             for sujet in writ['sujets']:
                 # Ensure prefixed ID
-                s_id = sujet.get('id', '')
+                s_id = str(sujet.get('id') or '')
                 if not s_id.startswith('writing_'):
                     sujet['id'] = f"writing_{s_id or '1'}"
                 # question_text vs sujet
@@ -181,14 +216,9 @@ def _resolve_student_answer(item):
             if item_id and item_id in st.session_state:
                 return st.session_state.get(item_id)
 
-            # Handle legacy keys for language exercises
-            if item_id and item_id.startswith('lang_'):
-                ex = item_id[len('lang_'):]
-                k_new = f"lang_{ex}_0"
-                k_old = f"lang_match_{ex}"
-                for k in (k_new, k_old):
-                    if k in st.session_state:
-                        return st.session_state.get(k)
+            # A matching item `lang_{ex}` is answered under `lang_match_{ex}` (answers are loaded with canonical keys)
+            if item_id and item_id.startswith('lang_') and matching_key(item_id[len('lang_'):]) in st.session_state:
+                return st.session_state.get(matching_key(item_id[len('lang_'):]))
 
     except Exception as e:
         st.error(f"Erreur lors de la récupération de la réponse: {str(e)}")
@@ -243,13 +273,64 @@ def render_correction_item(item):
         
         st.divider()
 
+# --- HELPER: feed the shared grading cache with a finished correction ---
+def remember_corrections(result_row):
+    """Store the graded answers of a correction so identical answers are not re-sent to the LLM."""
+    try:
+        corrections = result_row.get('results') or result_row.get('detailed_correction') or []
+        if isinstance(corrections, str):
+            corrections = json.loads(corrections)
+        exam_data = normalize_exam_data(current_exam(repo))
+        answers = st.session_state.get('submitted_answers') or result_row.get('student_responses') or {}
+        get_grading_cache().remember(corrections, canonical_answers(answers, exam_data), index_questions(exam_data, KEYS_BY_POSITION))
+    except Exception:
+        pass # The cache is an optimisation, never block the results page
+
+# --- HELPER: generation webhook call, run by the generation queue workers ---
+def request_generation(payload):
+    """Call the n8n generation webhook and return (validated exam, trace, request id); ExamPayloadError if malformed."""
+    trace = Trace.from_context(payload.get('trace')) or Trace("generate", student_id=payload.get('student_id'))
+    trace.mark("queue_wait")
+    response = webhook_post("generation", N8N_WEBHOOK, json=payload, timeout=GENERATION_TIMEOUT, headers=trace.headers())
+    trace.mark("webhook_post", status=response.status_code)
+    if response.status_code != 200:
+        raise RuntimeError(f"Erreur n8n ({response.status_code}): {response.text}")
+    # Validated once here: a malformed exam fails the ticket and is never saved (exam_schema.py)
+    return validate_exam(normalize_exam_data(parse_payload(response.json()))), trace, payload.get('request_id')
+
+# --- HELPER: the open exam, as the exam page reads it ---
+def load_exam_view():
+    """Validated body of the open exam; stored exams are validated (leniently) once per process and kept in the payload cache."""
+    exam_id = st.session_state.get('exam_ref')
+    if not exam_id:
+        return current_exam(repo) # Validated by request_generation
+    cache = get_payload_cache()
+    data = cache.get("exam_view", exam_id)
+    if data is None:
+        # Stored before the schema existed: a missing section opens empty instead of rejecting the exam
+        data = validate_exam(normalize_exam_data(parse_payload(current_exam(repo))), strict=False)
+        cache.put("exam_view", exam_id, data)
+    return data
+
+# --- HELPER: where is this exam's correction in the pipeline? ---
+def correction_queue_message(exam_id):
+    """Queue position / wait estimate of a correction, or None once it has been sent to n8n."""
+    correction_queue = get_queue("correction")
+    ticket = correction_queue.get(key=exam_id)
+    if ticket is None or ticket.done():
+        return None
+    position = correction_queue.position(ticket)
+    if position:
+        return f"📋 Position dans la file de correction : **{position}** • attente estimée {format_wait(correction_queue.estimated_wait(ticket))}"
+    return "📨 Copie en cours de transmission au correcteur..."
+
 # --- FONCTION D'AUTHENTIFICATION ---
 def verify_access_code(full_name, access_code):
     """Vérifier le code d'accès."""
     try:
         # Chercher dans une table 'access_codes'
-        res = supabase.table("access_codes").select("*").eq("code", access_code).eq("active", True).execute()
-        if res.data:
+        # Codes actifs gardés en mémoire pour tout le processus (voir auth.py)
+        if get_access_code_cache(repo).is_active(access_code):
             st.session_state.authenticated = True
             st.session_state.user_name = full_name
             st.session_state.user_email = f"{full_name.lower().replace(' ', '.')}@exam.local"
@@ -288,6 +369,8 @@ def login_page():
                 if not full_name or not access_code:
                     st.error("❌ Veuillez remplir tous les champs")
                 elif verify_access_code(full_name, access_code):
+                    # Jeton signé dans l'URL : un rafraîchissement de la page garde la session
+                    remember_session(st.session_state.user_name, st.session_state.user_email)
                     st.success(f"✅ Bienvenue {full_name}!")
                     st.balloons()
                     time.sleep(1)
@@ -341,16 +424,49 @@ def save_answers():
         
         if user_answers:
             try:
-                supabase.table("exams_streamlit").update({
-                    "student_responses": user_answers
-                }).eq("id", st.session_state.current_exam_id).execute()
+                repo.save_answers(st.session_state.current_exam_id, user_answers)
+                history.record(st.session_state.current_exam_id, user_answers)
+                st.session_state.pop('answer_undo_seq', None)
             except Exception:
                 pass # Silent fail during typing to avoid interrupting the user
 
+def record_submitted_answers(user_answers):
+    """Version the answers sent for correction, so the history ends with what was graded."""
+    try:
+        history.record(st.session_state.current_exam_id, user_answers)
+        st.session_state.pop('answer_undo_seq', None)
+    except Exception:
+        pass # The history is secondary: never block a submission on it
+
+def restore_answers(seq):
+    """Put the answers of version `seq` back in the form; this records a new version (button callback)."""
+    _, answers = history.state_at(st.session_state.current_exam_id, seq)
+    # Bump the versions so buffered browser editors (answer_buffer.py) take the restored text
+    versions = dict(st.session_state.get('answer_versions') or {})
+    for key in list(st.session_state.keys()):
+        if any(key.startswith(prefix) for prefix in ["ans_", "lang_", "writing_", "comp_"]) and key not in answers:
+            answers[key] = ""
+    for key, value in answers.items():
+        st.session_state[key] = value
+        versions[key] = versions.get(key, 0) + 1
+    st.session_state.answer_versions = versions
+    save_answers()
+
+def undo_answers():
+    """Step back one version per click; typing again ends the undo sequence."""
+    exam_id = st.session_state.current_exam_id
+    target = (st.session_state.get('answer_undo_seq') or history.head(exam_id)[0]) - 1
+    if target < 1:
+        st.toast("Rien à annuler.")
+        return
+    restore_answers(target)
+    st.session_state.answer_undo_seq = target
+
 # --- PAGE PRINCIPALE ---
-if not st.session_state.authenticated:
+if not st.session_state.authenticated and not resume_session():
     login_page()
     st.stop()
+sync_session()
 
 # --- UI HEADER PROFESSIONNELLE ---
 col_header1, col_header2, col_header3 = st.columns([3, 2, 1])
@@ -360,6 +476,8 @@ with col_header2:
     st.markdown(f"**Utilisateur:** {st.session_state.user_name}")
 with col_header3:
     if st.button("🚪 Déconnexion", key="logout_btn"):
+        forget_session()
+        drop_session(st.session_state.get('session_sid'))
         st.session_state.authenticated = False
         st.session_state.user_name = None
         st.session_state.user_email = None
@@ -367,20 +485,69 @@ with col_header3:
         st.rerun()
 
 st.divider()
+operator_panel()
+operator_profile_panel()
 
 # --- INITIALISER LES PARAMÈTRES ---
 student_id = st.session_state.user_email
 
+# --- LOGIQUE D'ATTENTE DE GÉNÉRATION ---
+if st.session_state.get('generation_ticket'):
+    generation_queue = get_queue("generation")
+    ticket = generation_queue.get(st.session_state.generation_ticket)
+    if ticket is None:
+        st.session_state.generation_ticket = None
+        st.error("La demande de génération a été perdue (redémarrage du serveur ?). Veuillez relancer la génération.")
+    elif not ticket.done():
+        mark_waiting("generation")
+        position = generation_queue.position(ticket)
+        wait = format_wait(generation_queue.estimated_wait(ticket))
+        if position:
+            st.info(f"⏳ Votre demande est en file d'attente : position **{position}** • attente estimée {wait}")
+        else:
+            st.info(f"🤖 Génération de votre examen en cours... (encore {wait} environ)")
+        time.sleep(2)
+        st.rerun()
+    else:
+        st.session_state.generation_ticket = None
+        st.session_state.pop('generation_request_id', None)
+        done_waiting("generation")
+        if isinstance(ticket.error, ExamPayloadError):
+            st.error("L'examen généré est incomplet ou mal formé, il n'a pas été enregistré. Veuillez relancer la génération.")
+            operator_debug("Erreurs de validation", ticket.error.errors)
+        elif ticket.error is not None:
+            st.error(f"Erreur lors de la génération: {ticket.error}")
+        else:
+            exam_data, trace, request_id = ticket.result
+            show_unsaved_exam(exam_data)
+            # Persist to Supabase immediately; every session sharing the ticket gets the same row
+            try:
+                exam_id = repo.insert_exam(student_id, exam_data, request_id=request_id)
+                if exam_id:
+                    get_payload_cache().put("exam_view", exam_id, exam_data) # Already validated
+                    st.session_state.current_exam_id = exam_id
+                    show_exam(exam_id)
+                    st.session_state.exam_deadline = deadline_for(repo.start_exam(exam_id))
+                    trace.mark("save")
+                    trace.add_span("total", trace.started_at, time.time())
+                    trace.flush(supabase, st.session_state.current_exam_id)
+                st.success("✅ Examen généré et sauvegardé!")
+            except Exception as e_supa:
+                st.error(f"Examen généré mais erreur de sauvegarde: {e_supa}")
+                # Still show the exam even if save failed
+            st.rerun()
+
 # --- INTERFACE PRINCIPALE ---
-if not st.session_state.get('exam_json') and not st.session_state.get('correction_data'):
+if not current_exam_shown() and not st.session_state.get('result_ref'):
     tab_exams, tab_create = st.tabs(["📋 Mes Examens", "🆕 Générer un Examen"])
 
     with tab_exams:
         st.subheader("Vos Examens Disponibles")
         
         try:
-            res = supabase.table("exams_streamlit").select("id, created_at, status").eq("student_id", student_id).order("created_at", desc=True).execute()
-            exams = res.data if res.data else []
+            exams = repo.list_exams(student_id)
+            # Warm the newest exams in the background: "Ouvrir" / "Voir" then render from memory
+            repo.prefetch_dashboard(student_id, exams)
             
             if not exams:
                 st.info("📭 Aucun examen trouvé. Générez-en un nouveau pour commencer!")
@@ -395,28 +562,31 @@ if not st.session_state.get('exam_json') and not st.session_state.get('correctio
                     
                     with col2:
                         if exam['status'] == 'ready' and st.button("📖 Ouvrir", key=f"load_{idx}"):
-                            full_exam = supabase.table("exams_streamlit").select("*").eq("id", exam['id']).execute()
-                            if full_exam.data:
-                                st.session_state.exam_json = full_exam.data[0].get('exam_content')
+                            # Exam row and latest result are independent: read them together
+                            page = fetch_all({"exam": partial(repo.get_exam, exam['id']),
+                                              "result": partial(repo.get_latest_result, student_id, exam['id'], prefetched=True)})
+                            page.raise_for("exam")
+                            full_exam = page["exam"]
+                            if full_exam:
+                                show_exam(exam['id'])
+                                deadline = deadline_for(full_exam.get('started_at') or repo.start_exam(exam['id']))
+                                if time_is_up(deadline):
+                                    # Time ran out while the exam was closed: read-only, sent only on request
+                                    st.session_state.exam_expired = True
+                                else:
+                                    st.session_state.exam_deadline = deadline
                                 st.session_state.current_exam_id = exam['id']
+                                st.session_state.current_exam_archived = False
                                 st.session_state.current_user = student_id
                                 
-                                saved_answers = full_exam.data[0].get('student_responses') or {}
+                                saved_answers = full_exam.get('student_responses') or {}
                                 if isinstance(saved_answers, dict) and saved_answers:
-                                    for k, v in saved_answers.items():
-                                        if isinstance(k, str) and k.startswith('lang_match_'):
-                                            ex = k[len('lang_match_'):]
-                                            new_k = f"lang_{ex}_0"
-                                            st.session_state[new_k] = v
-                                        else:
-                                            st.session_state[k] = v
+                                    # Rows not migrated yet get the canonical keys here (answer_keys.py)
+                                    for k, v in canonical_answers(saved_answers, full_exam).items():
+                                        st.session_state[k] = v
                                 
-                                try:
-                                    res_corr = supabase.table("exam_results").select("*").eq("exam_id", exam['id']).eq("student_id", student_id).order("created_at", desc=True).limit(1).execute()
-                                    if res_corr.data:
-                                        st.session_state.correction_data = res_corr.data[0]
-                                except:
-                                    pass
+                                if page["result"]:
+                                    show_result(page["result"])
                                 
                                 st.success("✅ Examen chargé!")
                                 st.rerun()
@@ -425,10 +595,15 @@ if not st.session_state.get('exam_json') and not st.session_state.get('correctio
                         sub_col1, sub_col2 = st.columns(2)
                         with sub_col1:
                             if exam['status'] in ['submitted', 'ready'] and st.button("🔍 Voir", key=f"view_{idx}"):
-                                res_corr = supabase.table("exam_results").select("*").eq("exam_id", exam['id']).eq("student_id", student_id).order("created_at", desc=True).limit(1).execute()
-                                if res_corr.data:
-                                    st.session_state.correction_data = res_corr.data[0]
+                                # The results page also needs the exam body: warm it while the result is read
+                                page = fetch_all({"result": partial(repo.get_latest_result, student_id, exam['id'], prefetched=True),
+                                                  "exam": partial(repo.get_exam_content, exam['id'])})
+                                page.raise_for("result")
+                                result = page["result"]
+                                if result:
+                                    show_result(result)
                                     st.session_state.current_exam_id = exam['id']
+                                    st.session_state.current_exam_archived = False
                                     st.session_state.current_user = student_id
                                     st.rerun()
                                 else:
@@ -443,8 +618,7 @@ if not st.session_state.get('exam_json') and not st.session_state.get('correctio
                             c1, c2 = st.columns(2)
                             if c1.button("✅ Oui", key=f"yes_{idx}"):
                                 try:
-                                    supabase.table("exam_results").delete().eq("exam_id", exam['id']).execute()
-                                    supabase.table("exams_streamlit").delete().eq("id", exam['id']).execute()
+                                    repo.delete_exam(exam['id'])
                                     st.session_state[f"confirm_delete_{exam['id']}"] = False
                                     st.success("Examen supprimé")
                                     time.sleep(1)
@@ -454,6 +628,28 @@ if not st.session_state.get('exam_json') and not st.session_state.get('correctio
                             if c2.button("❌ Non", key=f"no_{idx}"):
                                 st.session_state[f"confirm_delete_{exam['id']}"] = False
                                 st.rerun()
+
+            # Les vieux examens sont déplacés dans les tables d'archive (archive_exams.py) : lus seulement à la demande
+            if st.checkbox("🗄️ Afficher les examens archivés", key="show_archived"):
+                archived = repo.list_exams(student_id, archived=True)
+                if not archived:
+                    st.caption("Aucun examen archivé.")
+                for idx, exam in enumerate(archived):
+                    col1, col2 = st.columns([3, 1])
+                    col1.markdown(f"🗄️ **Examen du {exam['created_at'][:10]}** - Status: `{exam['status']}`")
+                    if col2.button("🔍 Voir", key=f"view_archived_{idx}"):
+                        page = fetch_all({"result": partial(repo.get_latest_result, student_id, exam['id'], archived=True),
+                                          "exam": partial(repo.get_exam_content, exam['id'], archived=True)})
+                        page.raise_for("result")
+                        result = page["result"]
+                        if result:
+                            show_result(result)
+                            st.session_state.current_exam_id = exam['id']
+                            st.session_state.current_exam_archived = True
+                            st.session_state.current_user = student_id
+                            st.rerun()
+                        else:
+                            st.info("Aucune correction archivée pour cet examen.")
                                 
         except Exception as e:
             st.error(f"⚠️ Erreur: {str(e)}")
@@ -465,197 +661,164 @@ if not st.session_state.get('exam_json') and not st.session_state.get('correctio
         with col1:
             filiere = st.selectbox("📚 Sélectionner la Filière", ["Science Physique", "SVT", "Sciences Math"])
         with col2:
-            st.info("⏱️ Durée : **120 minutes** (Fixe)")
-            duration = 120
+            st.info(f"⏱️ Durée : **{EXAM_DURATION_MINUTES:g} minutes** (Fixe)")
+            duration = int(EXAM_DURATION_MINUTES)
         
         if st.button("🚀 Générer un nouvel examen", use_container_width=True):
-            with st.spinner("Génération de votre examen..."):
-                # Clear previous state
-                st.session_state.exam_json = None
-                st.session_state.correction_data = None
-                st.session_state.current_exam_id = None
-                st.session_state.generation_start_time = datetime.now(timezone.utc).isoformat()
-                
-                payload = {
-                    "student_id": student_id,
-                    "filiere": filiere,
-                    "duration": duration
-                }
-                try:
-                    response = requests.post(N8N_WEBHOOK, json=payload)
-                    if response.status_code == 200:
-                        raw_data = response.json()
-                        exam_data = normalize_exam_data(raw_data)
-                        st.session_state.exam_json = exam_data
-                        
-                        # Persist to Supabase immediately
-                        try:
-                            res_insert = supabase.table("exams_streamlit").insert({
-                                "student_id": student_id,
-                                "exam_content": exam_data,
-                                "status": "ready"
-                            }).execute()
-                            if res_insert.data:
-                                st.session_state.current_exam_id = res_insert.data[0]['id']
-                            
-                            st.success("✅ Examen généré et sauvegardé!")
-                            time.sleep(1)
-                            st.rerun()
-                        except Exception as e_supa:
-                            st.error(f"Examen généré mais erreur de sauvegarde: {e_supa}")
-                            # Still show the exam even if save failed
-                            st.rerun()
-                    else:
-                        st.error(f"Erreur n8n ({response.status_code}): {response.text}")
-                except Exception as e:
-                    st.error(f"Erreur lors de la génération: {str(e)}")
+            # Clear previous state
+            close_exam()
+            st.session_state.current_exam_id = None
+            st.session_state.generation_start_time = datetime.now(timezone.utc).isoformat()
+            
+            # Kept until the exam is saved: a retry from another replica saves into the same row
+            st.session_state.generation_request_id = st.session_state.get('generation_request_id') or str(uuid.uuid4())
+            payload = {
+                "student_id": student_id,
+                "filiere": filiere,
+                "duration": duration,
+                "request_id": st.session_state.generation_request_id,
+                "trace": Trace("generate", student_id=student_id).context()
+            }
+            try:
+                # Bounded queue in front of the generation webhook, one pending generation per student
+                ticket = get_queue("generation").submit(student_id, request_generation, payload, key=f"generation:{student_id}", reuse=True)
+                st.session_state.generation_ticket = ticket.id
+                st.rerun()
+            except QueueFull as e:
+                st.warning(f"⏳ Beaucoup d'examens sont en cours de génération. Réessayez dans {format_wait(e.retry_after)}.")
 
-# --- LOGIQUE D'ATTENTE DE GÉNÉRATION (SUPPRIMÉE CAR SYNC) ---
 
 # --- AFFICHAGE DE L'EXAMEN ---
-if st.session_state.get("exam_json") and not st.session_state.get('correction_data'):
-    import json
-    
+if current_exam_shown() and not st.session_state.get('result_ref'):
     # Bouton retour
     if st.button("← Retour aux examens"):
-        st.session_state.exam_json = None
+        close_exam()
         st.session_state.current_exam_id = None
         st.rerun()
     
-    data = st.session_state.exam_json
-    
-    # Apply normalization (handles both direct n8n response and loaded from supa)
-    data = normalize_exam_data(data)
-
-    if isinstance(data, str):
-        try:
-            # Clean possible markdown block
-            cleaned_data = data.strip()
-            if cleaned_data.startswith("```json"):
-                cleaned_data = cleaned_data[7:]
-            if cleaned_data.endswith("```"):
-                cleaned_data = cleaned_data[:-3]
-            data = json.loads(cleaned_data.strip())
-            # Re-normalize after parsing string
-            data = normalize_exam_data(data)
-        except Exception as e:
-            st.error(f"❌ Erreur lors du chargement de l'examen: {str(e)}")
-            with st.expander("Détails techniques"):
-                st.code(data)
-            st.stop()
-
-    # Re-check for list after string parsing (if string was a list)
-    if isinstance(data, list) and len(data) > 0:
-        data = data[0]
-
-    if not isinstance(data, dict):
-        st.error("❌ Données d'examen invalides (Format non-dict)")
-        with st.expander("🔍 Voir les données reçues (DEBUG)"):
-            st.write(f"Type: `{type(data)}`")
-            st.write(data)
+    try:
+        data = load_exam_view()
+    except ExamPayloadError as e:
+        st.error("❌ Cet examen est mal formé et ne peut pas être affiché.")
+        operator_debug("Erreurs de validation", e.errors)
         st.stop()
     
-    if not any(k in data for k in ['comprehension', 'language', 'writing']):
-        st.warning("⚠️ L'examen semble vide ou mal structuré.")
-        with st.expander("Voir le contenu reçu"):
-            st.json(data)
-    
-    title = data['info'].get('title') if 'info' in data else 'Examen'
-    st.title(title)
+    st.title(data['info']['title'])
     
     # Info examen
-    if 'info' in data:
-        col1, col2, col3 = st.columns(3)
-        if 'duration' in data['info']:
-            col1.metric("⏱️ Durée", data['info']['duration'])
-        if 'total_points' in data['info']:
-            col2.metric("📊 Points Total", data['info']['total_points'])
+    col1, col2, col3 = st.columns(3)
+    if 'duration' in data['info']:
+        col1.metric("⏱️ Durée", data['info']['duration'])
+    if 'total_points' in data['info']:
+        col2.metric("📊 Points Total", data['info']['total_points'])
+    expired = st.session_state.get('exam_expired', False)
+    if expired:
+        col3.metric("⏱️ Temps restant", "0:00:00")
+        st.warning("⏰ Le temps de cet examen est écoulé : vos réponses ne peuvent plus être modifiées. Envoyez-les pour obtenir votre note.")
+        time_up, buffered = False, False
+    else:
+        # The countdown runs in the browser: no rerun while it ticks, one event when time is up
+        deadline = st.session_state.get('exam_deadline')
+        with col3:
+            time_up = time_is_up(deadline, countdown(deadline) if deadline else False)
+        # Already submitted: the results page takes over, do not send the answers again
+        time_up = time_up and not st.session_state.get('waiting_for_correction')
+        # Answers are typed and buffered in the browser, then sent in batches (answer_buffer.py)
+        buffered = answer_sync(save_answers)
     
     # Onglets
     t1, t2, t3 = st.tabs(["I. COMPREHENSION (15 pts)", "II. LANGUAGE (15 pts)", "III. WRITING (10 pts)"])
 
     with t1:
-        if 'comprehension' in data:
-            comp = data['comprehension']
-            if 'texte' in comp:
-                st.markdown(f'<div style="background-color: #f9f9f9; padding: 20px; border-left: 5px solid #333; margin-bottom: 30px;">{comp["texte"]}</div>', unsafe_allow_html=True)
+        comp = data['comprehension']
+        if comp['texte']:
+            st.markdown(f'<div style="background-color: #f9f9f9; padding: 20px; border-left: 5px solid #333; margin-bottom: 30px;">{comp["texte"]}</div>', unsafe_allow_html=True)
+        
+        for idx_ex, exercice in enumerate(comp['exercices']):
+            abc = chr(65 + idx_ex) # A, B, C...
+            st.markdown(f'<div class="instr-bold">{abc}. {exercice["consigne"].upper()}</div>', unsafe_allow_html=True)
             
-            if 'exercices' in comp:
-                for idx_ex, exercice in enumerate(comp['exercices']):
-                    abc = chr(65 + idx_ex) # A, B, C...
-                    consigne = exercice.get('consigne', '').upper()
-                    st.markdown(f'<div class="instr-bold">{abc}. {consigne}</div>', unsafe_allow_html=True)
-                    
-                    for q_idx, question in enumerate(exercice.get('questions', [])):
-                        q_text = question.get('question', '')
-                        q_id = question.get('id', f"comp_{idx_ex}_{q_idx}")
-                        points = question.get('points', 0)
-                        
-                        st.markdown(f"**{q_idx + 1}.** {q_text} <span class='points-tag'>({points} pt{'s' if points > 1 else ''})</span>", unsafe_allow_html=True)
-                        st.text_area("Réponse:", key=q_id, height=100, on_change=save_answers, label_visibility="collapsed")
+            for q_idx, question in enumerate(exercice['questions']):
+                q_id = question.get('id', f"comp_{idx_ex}_{q_idx}")
+                points = question['points']
+                
+                st.markdown(f"**{q_idx + 1}.** {question['question']} <span class='points-tag'>({points} pt{'s' if points > 1 else ''})</span>", unsafe_allow_html=True)
+                answer_editor(q_id, "Réponse:", 100, buffered, on_change=save_answers, read_only=expired)
 
     with t2:
-        if 'language' in data:
-            lang = data['language']
+        for idx_ex, exercice in enumerate(data['language']['exercices']):
+            abc = chr(65 + idx_ex) # A, B, C...
+            st.markdown(f'<div class="instr-bold">{abc}. {exercice["consigne"].upper()}</div>', unsafe_allow_html=True)
             
-            if 'exercices' in lang:
-                for idx_ex, exercice in enumerate(lang['exercices']):
-                    abc = chr(65 + idx_ex) # A, B, C...
-                    consigne = exercice.get('consigne', '').upper()
-                    st.markdown(f'<div class="instr-bold">{abc}. {consigne}</div>', unsafe_allow_html=True)
-                    
-                    # Handle both 'details' (standard) and 'questions' (n8n variant)
-                    qs = exercice.get('details') or exercice.get('questions') or []
-                    for q_idx, q_item in enumerate(qs):
-                        q_text = q_item.get('question', '')
-                        q_id = q_item.get('id', f"lang_{idx_ex}_{q_idx}")
-                        points = q_item.get('points', 0)
-                        
-                        st.markdown(f"**{q_idx + 1}.** {q_text} <span class='points-tag'>({points} pt{'s' if points > 1 else ''})</span>", unsafe_allow_html=True)
-                        st.text_area("Réponse:", key=q_id, height=80, on_change=save_answers, label_visibility="collapsed")
-                    
-                    if 'matching' in exercice:
-                        st.write("**Matching Exercise:**")
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.write("**Expressions:**")
-                            for expr in exercice['matching'].get('expressions', []):
-                                st.write(f"- {expr['id']}. {expr['text']}")
-                        with col2:
-                            st.write("**Fonctions:**")
-                            for func in exercice['matching'].get('fonctions', []):
-                                st.write(f"- {func['id']}. {func['text']}")
-                        
-                        # Assuming points for matching are at the exercise level or default to 0
-                        matching_points = exercice['matching'].get('points', 0)
-                        q_instr = exercice['matching'].get('instruction', '')
-                        
-                        if q_instr:
-                            st.markdown(f"**{q_instr.upper()}**")
-                        st.markdown(f"**Q:** Match the expressions with their functions <span class='points-tag'>({matching_points} pts)</span>", unsafe_allow_html=True)
-                        st.text_area("Réponse (e.g., 1-A, 2-B):", key=f"lang_match_{idx_ex}_0", height=100, on_change=save_answers, label_visibility="collapsed")
+            # Handle both 'details' (standard) and 'questions' (n8n variant)
+            for q_idx, q_item in enumerate(exercice['details'] or exercice['questions']):
+                q_id = q_item.get('id', f"lang_{idx_ex}_{q_idx}")
+                points = q_item['points']
+                
+                st.markdown(f"**{q_idx + 1}.** {q_item['question']} <span class='points-tag'>({points} pt{'s' if points > 1 else ''})</span>", unsafe_allow_html=True)
+                answer_editor(q_id, "Réponse:", 80, buffered, on_change=save_answers, read_only=expired)
+            
+            if exercice.get('matching'):
+                matching = exercice['matching']
+                st.write("**Matching Exercise:**")
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.write("**Expressions:**")
+                    for expr in matching['expressions']:
+                        st.write(f"- {expr['id']}. {expr['text']}")
+                with col2:
+                    st.write("**Fonctions:**")
+                    for func in matching['fonctions']:
+                        st.write(f"- {func['id']}. {func['text']}")
+                
+                if matching['instruction']:
+                    st.markdown(f"**{matching['instruction'].upper()}**")
+                st.markdown(f"**Q:** Match the expressions with their functions <span class='points-tag'>({matching['points']} pts)</span>", unsafe_allow_html=True)
+                answer_editor(matching_key(exercice.get('id', idx_ex)), "Réponse (e.g., 1-A, 2-B):", 100, buffered, on_change=save_answers, read_only=expired)
 
     with t3:
-        if 'writing' in data:
-            writing = data['writing']
-            
-            if 'sujets' in writing:
-                for idx_sujet, sujet in enumerate(writing['sujets']):
-                    sujet_id = sujet.get('id', '?')
-                    sujet_type = sujet.get('type', sujet.get('instruction', 'WRITING')).upper()
-                    points = sujet.get('points', 0)
-                    
-                    abc = chr(65 + idx_sujet)
-                    st.markdown(f'<div class="instr-bold">{abc}. {sujet_type} ({points} pts)</div>', unsafe_allow_html=True)
-                    st.markdown(f"**{sujet.get('sujet', sujet.get('question_text', 'Pas de description'))}**")
-                    st.text_area("Votre réponse:", key=sujet_id, height=300, on_change=save_answers, label_visibility="collapsed")
+        for idx_sujet, sujet in enumerate(data['writing']['sujets']):
+            abc = chr(65 + idx_sujet)
+            st.markdown(f'<div class="instr-bold">{abc}. {sujet["type"].upper()} ({sujet["points"]} pts)</div>', unsafe_allow_html=True)
+            st.markdown(f"**{sujet['sujet']}**")
+            answer_editor(sujet['id'], "Votre réponse:", 300, buffered, on_change=save_answers, read_only=expired)
     
+    # HISTORIQUE DES RÉPONSES
+    if st.session_state.get('current_exam_id') and not expired:
+        st.divider()
+        col_undo, col_history = st.columns([1, 3])
+        col_undo.button("↩️ Annuler la dernière modification", key="answers_undo", on_click=undo_answers, use_container_width=True)
+        # Read from answer_log only when asked for
+        with col_history:
+            if st.checkbox("🕘 Historique des réponses", key="show_answer_history"):
+                versions = history.versions(st.session_state.current_exam_id)
+                if not versions:
+                    st.caption("Aucune version enregistrée.")
+                else:
+                    by_seq = {v['seq']: v for v in versions}
+                    def version_label(seq):
+                        v = by_seq[seq]
+                        touched = "toutes les réponses" if v['kind'] == 'checkpoint' else ", ".join(v['keys'][:4])
+                        return f"Version {seq} — {str(v['created_at'])[11:19]} — {touched}"
+                    chosen = st.selectbox("Version", list(by_seq), format_func=version_label, key="answer_history_version")
+                    _, preview = history.state_at(st.session_state.current_exam_id, chosen)
+                    for key, value in sorted(preview.items()):
+                        if value:
+                            st.caption(f"**{key}** : {str(value)[:200]}")
+                    st.button("⏪ Restaurer cette version", key="answers_restore", on_click=restore_answers, args=(chosen,))
+
     # SOUMISSION
     st.divider()
     col_submit, col_info = st.columns([3, 2])
     
     with col_submit:
-        if st.button("🏁 Terminer l'examen et voir ma note", use_container_width=True):
+        submit_label = "📤 Envoyer mes réponses pour correction" if expired else "🏁 Terminer l'examen et voir ma note"
+        if st.button(submit_label, use_container_width=True) or time_up:
+            if time_up:
+                # Locked from now on, whatever happens to the automatic submission below
+                st.session_state.exam_expired = True
+                st.session_state.pop('exam_deadline', None)
+                st.warning("⏰ Temps écoulé : vos réponses sont envoyées automatiquement.")
             if not st.session_state.get('current_exam_id'):
                 st.error("❌ Erreur: Aucun examen n'est chargé.")
             else:
@@ -664,24 +827,29 @@ if st.session_state.get("exam_json") and not st.session_state.get('correction_da
                     if any(key.startswith(prefix) for prefix in ["ans_", "lang_", "writing_", "comp_"]):
                         user_answers[key] = st.session_state[key]
                 
-                if len(user_answers) == 0:
+                if time_up and not any(user_answers.values()):
+                    # Nothing to send: show the locked exam instead of repeating the warning on every rerun
+                    st.rerun()
+                elif len(user_answers) == 0:
                     st.warning("⚠️ Veuillez répondre à au moins une question.")
                 else:
                     try:
-                        supabase.table("exams_streamlit").update({
-                            "student_responses": user_answers,
-                            "status": "submitted"
-                        }).eq("id", st.session_state.current_exam_id).execute()
+                        trace = Trace("submit", st.session_state.current_exam_id, st.session_state.current_user)
+                        # Answers already graded for another student are resolved locally
+                        grading = get_grading_cache().correction_payload(user_answers, index_questions(data, KEYS_BY_POSITION))
+                        st.session_state.submitted_answers = user_answers
+                        record_submitted_answers(user_answers)
                         
-                        webhook_correction = os.getenv("N8N_CORRECTION_WEBHOOK", "https://n8n.faysal.me/webhook/correction-exam")
-                        requests.post(webhook_correction, json={
-                            "student_id": st.session_state.current_user,
-                            "exam_id": st.session_state.current_exam_id,
-                            "answers": user_answers,
-                            "action": "start_correction"
-                        })
+                        # Status change + outbox record in one transaction, n8n is called by the dispatcher
+                        enqueue_correction(supabase, st.session_state.current_exam_id, st.session_state.current_user, user_answers,
+                                           status="submitted", payload={**grading, "trace": trace.context()},
+                                           priority="final_submit", exam=data)
+                        trace.mark("submit", cached=len(grading["cached_corrections"]), to_grade=len(grading["to_grade"]))
+                        trace.flush(supabase)
+                        st.session_state.correction_trace = trace.context()
                         
                         st.session_state.waiting_for_correction = True
+                        st.session_state.pop('exam_deadline', None)
                         st.info("⏳ Correction en cours... Veuillez patienter.")
                         st.rerun()
                     except Exception as e:
@@ -696,50 +864,68 @@ if st.session_state.get("waiting_for_correction"):
     
     with placeholder.container():
         st.warning("⏳ Correction en cours...")
+        queue_status = st.empty()
         with st.spinner("Vérification des résultats..."):
             found = False
             for i in range(30):
-                res = supabase.table("exam_results") \
-                    .select("*") \
-                    .eq("student_id", st.session_state.current_user) \
-                    .eq("exam_id", st.session_state.current_exam_id) \
-                    .order("created_at", desc=True) \
-                    .limit(1) \
-                    .execute()
+                mark_waiting("correction")
+                queue_message = correction_queue_message(st.session_state.current_exam_id)
+                if queue_message:
+                    queue_status.info(queue_message)
+                else:
+                    queue_status.empty()
+                result = repo.get_latest_result(st.session_state.current_user, st.session_state.current_exam_id)
                 
-                if res.data:
-                    st.session_state.correction_data = res.data[0]
+                if result:
+                    show_result(result)
                     st.session_state.waiting_for_correction = False
+                    remember_corrections(result)
+                    finish_correction_trace(supabase, st.session_state.pop('correction_trace', None), result)
                     found = True
                     break
                 
                 time.sleep(3)
+            done_waiting("correction")
             
             if found:
                 placeholder.empty()
                 st.balloons()
                 st.rerun()
             else:
-                st.error("Délai dépassé. Veuillez réessayer.")
-                st.session_state.waiting_for_correction = False
+                outbox = None
+                try:
+                    outbox = get_outbox_status(supabase, st.session_state.current_exam_id)
+                except Exception:
+                    pass
+                if outbox and outbox.get('status') == 'dead':
+                    st.error(f"La demande de correction n'a pas pu être transmise ({outbox.get('attempts')} tentatives). Veuillez relancer la correction.")
+                    st.session_state.waiting_for_correction = False
+                elif correction_queue_message(st.session_state.current_exam_id) or (outbox and outbox.get('status') in ('pending', 'delivering')):
+                    # Still queued behind other students: keep waiting instead of timing out
+                    st.rerun()
+                else:
+                    st.error("Délai dépassé. Veuillez réessayer.")
+                    st.session_state.waiting_for_correction = False
 
 # --- AFFICHAGE DES RÉSULTATS ---
-if st.session_state.get('correction_data'):
-    # Lazy load exam_content if missing (e.g. when view is clicked directly from dashboard)
-    if not st.session_state.get('exam_json') and st.session_state.get('current_exam_id'):
-        try:
-            res_exam = supabase.table("exams_streamlit").select("exam_content").eq("id", st.session_state.current_exam_id).execute()
-            if res_exam.data:
-                st.session_state.exam_json = res_exam.data[0].get('exam_content')
-        except:
-            pass
+if st.session_state.get('result_ref'):
+    # The exam body is read lazily (e.g. when view is clicked directly from dashboard)
+    if not st.session_state.get('exam_ref') and st.session_state.get('current_exam_id'):
+        show_exam(st.session_state.current_exam_id)
+    # Exam body and result row at once (both usually cached already)
+    preload_current(repo)
 
     if st.button("← Retour"):
-        st.session_state.correction_data = None
-        st.session_state.exam_json = None
+        close_exam()
+        st.session_state.current_exam_archived = False
         st.rerun()
     
-    resultat = st.session_state.get('correction_data')
+    resultat = current_result(repo)
+    if resultat is None:
+        # Deleted since it was opened
+        st.session_state.result_ref = None
+        st.warning("⚠️ Ce résultat n'existe plus.")
+        st.stop()
     if isinstance(resultat, str):
         try:
             resultat = json.loads(resultat)
@@ -789,49 +975,50 @@ if st.session_state.get('correction_data'):
     
     st.divider()
 
-    # Actions
-    with st.expander("⚙️ Actions", expanded=False):
-        saved_rs = resultat.get('student_responses') or resultat.get('student_answers')
-        if isinstance(saved_rs, dict) and saved_rs:
-            if st.button("✏️ Charger les réponses pour modification"):
-                for k, v in saved_rs.items():
-                    if isinstance(k, str) and k.startswith('lang_match_'):
-                        ex = k[len('lang_match_'):]
-                        new_k = f"lang_{ex}_0"
-                        st.session_state[new_k] = v
-                    else:
+    # Actions (un examen archivé est en consultation seule)
+    if st.session_state.get('current_exam_archived'):
+        st.caption("🗄️ Examen archivé : consultation seule.")
+    else:
+        with st.expander("⚙️ Actions", expanded=False):
+            saved_rs = resultat.get('student_responses') or resultat.get('student_answers')
+            if isinstance(saved_rs, dict) and saved_rs:
+                if st.button("✏️ Charger les réponses pour modification"):
+                    for k, v in canonical_answers(saved_rs, partial(repo.get_exam_content, st.session_state.current_exam_id)).items():
                         st.session_state[k] = v
-                st.session_state.correction_data = None
-                st.success("✅ Réponses chargées.")
-                st.rerun()
+                    st.session_state.result_ref = None
+                    st.success("✅ Réponses chargées.")
+                    st.rerun()
 
-        if st.button("🔁 Relancer la correction"):
-            user_answers = {}
-            for key in st.session_state.keys():
-                if any(key.startswith(prefix) for prefix in ["ans_", "lang_", "writing_", "comp_", "lang_match_"]):
-                    user_answers[key] = st.session_state[key]
+            if st.button("🔁 Relancer la correction"):
+                user_answers = {}
+                for key in st.session_state.keys():
+                    if any(key.startswith(prefix) for prefix in ["ans_", "lang_", "writing_", "comp_"]):
+                        user_answers[key] = st.session_state[key]
 
-            if len(user_answers) == 0:
-                st.warning("⚠️ Aucune réponse à relancer.")
-            else:
-                try:
-                    supabase.table("exams_streamlit").update({
-                        "student_responses": user_answers,
-                        "status": "resubmitted"
-                    }).eq("id", st.session_state.current_exam_id).execute()
-
-                    webhook_correction = os.getenv("N8N_CORRECTION_WEBHOOK", "http://localhost:5678/webhook-test/correction")
-                    requests.post(webhook_correction, json={
-                        "student_id": st.session_state.current_user,
-                        "exam_id": st.session_state.current_exam_id,
-                        "action": "start_correction"
-                    })
-
-                    st.session_state.waiting_for_correction = True
-                    st.info("⏳ Relance demandée...")
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"Erreur: {e}")
+                if len(user_answers) == 0:
+                    st.warning("⚠️ Aucune réponse à relancer.")
+                else:
+                    try:
+                        trace = Trace("resubmit", st.session_state.current_exam_id, st.session_state.current_user)
+                        exam_data = normalize_exam_data(current_exam(repo))
+                        grading = get_grading_cache().correction_payload(user_answers, index_questions(exam_data, KEYS_BY_POSITION))
+                        st.session_state.submitted_answers = user_answers
+                        record_submitted_answers(user_answers)
+
+                        enqueue_correction(supabase, st.session_state.current_exam_id, st.session_state.current_user, user_answers,
+                                           status="resubmitted", payload={**grading, "trace": trace.context()},
+                                           priority="regrade", exam=exam_data)
+                        trace.mark("submit", cached=len(grading["cached_corrections"]), to_grade=len(grading["to_grade"]))
+                        trace.flush(supabase)
+                        st.session_state.correction_trace = trace.context()
+
+                        st.session_state.waiting_for_correction = True
+                        st.info("⏳ Relance demandée...")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Erreur: {e}")
+
+    show_timeline(supabase, st.session_state.get('current_exam_id'))
 
     # Feedback général
     feedback = resultat.get('feedback_general', 'Pas de feedback')
@@ -855,9 +1042,9 @@ if st.session_state.get('correction_data'):
         
         # --- TAB: READING ---
         with tabs[0]:
-            # Afficher le texte de lecture s'il est disponible dans exam_json
-            if st.session_state.get('exam_json'):
-                data = st.session_state.get('exam_json')
+            # Afficher le texte de lecture s'il est disponible dans l'examen
+            data = current_exam(repo)
+            if data:
                 if isinstance(data, str):
                     try:
                         data = json.loads(data.strip("`json\n"))
@@ -0,0 +1,72 @@
+"""Archivage des vieux examens : déplace examens et résultats vers les tables *_archive.
+
+Appelle la fonction SQL `archive_old_exams` (migrations/0006_archive.sql) par lots
+jusqu'à ce qu'il ne reste rien à déplacer. Chaque lot est une transaction courte
+(au plus `--batch-size` examens, lignes verrouillées par une session ignorées) et
+une pause entre les lots laisse passer le trafic des étudiants.
+
+    python archive_exams.py --older-than-days 180
+    python archive_exams.py --dry-run
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from supabase import create_client
+
+
+def count_archivable(supabase, older_than_days):
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).isoformat()
+    res = supabase.table("exams_streamlit").select("id", count="exact", head=True).lt("created_at", cutoff).execute()
+    return res.count or 0
+
+
+def archive(supabase, older_than_days, batch_size=200, pause=0.5, max_batches=0):
+    """Run batches until none is left (or `max_batches`); returns the number of exams moved."""
+    total, batches = 0, 0
+    while True:
+        started = time.perf_counter()
+        moved = supabase.rpc("archive_old_exams", {
+            "p_older_than": f"{older_than_days} days",
+            "p_limit": batch_size,
+        }).execute().data or 0
+        batches += 1
+        total += moved
+        print(f"  lot {batches}: {moved} examens ({time.perf_counter() - started:.2f}s)")
+        if moved == 0 or (max_batches and batches >= max_batches):
+            return total
+        time.sleep(pause)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archiver les examens et résultats plus anciens que la rétention.")
+    parser.add_argument("--older-than-days", type=int, default=int(os.getenv("ARCHIVE_AFTER_DAYS", "180")),
+                        help="âge minimum d'un examen archivé (défaut: $ARCHIVE_AFTER_DAYS ou 180)")
+    parser.add_argument("--batch-size", type=int, default=200, help="examens par transaction (défaut: 200)")
+    parser.add_argument("--pause", type=float, default=0.5, help="pause entre deux lots en secondes")
+    parser.add_argument("--max-batches", type=int, default=0, help="nombre maximum de lots (0: jusqu'au bout)")
+    parser.add_argument("--dry-run", action="store_true", help="compter les examens à archiver sans rien déplacer")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    supabase_url, supabase_key = os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY")
+    if not supabase_url or not supabase_key:
+        print("❌ SUPABASE_URL ou SUPABASE_KEY manquants. Vérifiez le fichier .env", file=sys.stderr)
+        return 2
+    supabase = create_client(supabase_url, supabase_key)
+
+    pending = count_archivable(supabase, args.older_than_days)
+    print(f"🗄️ {pending} examens de plus de {args.older_than_days} jours")
+    if args.dry_run or not pending:
+        return 0
+    started = time.perf_counter()
+    moved = archive(supabase, args.older_than_days, args.batch_size, args.pause, args.max_batches)
+    print(f"✅ {moved} examens archivés en {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
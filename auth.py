@@ -0,0 +1,186 @@
+"""Connexion : codes d'accès en mémoire et reprise de session signée.
+
+Les codes actifs sont chargés une fois pour tout le processus (empreintes sha256,
+jamais les codes en clair) et rechargés toutes les `ACCESS_CODES_REFRESH` secondes :
+un début d'examen où toute la classe se connecte en même temps ne fait qu'une
+requête. Un code inconnu déclenche au plus un rechargement anticipé toutes les
+`ACCESS_CODES_MISS_REFRESH` secondes, pour qu'un code créé à l'instant soit accepté.
+
+Après la connexion, l'URL reçoit `?session=<jeton>` : un jeton signé (HMAC-SHA256,
+`SESSION_SECRET`) qui expire après `SESSION_TTL_HOURS`. Un rafraîchissement de la page
+restaure la session sans redemander le code. La déconnexion révoque l'identifiant de
+session du jeton dans le magasin de session_store.py, partagé par les répliques : une
+URL copiée avant la déconnexion ne rouvre plus la session. Si le magasin ne répond pas,
+la reprise est refusée (il suffit de ressaisir le code).
+
+`SESSION_SECRET` est obligatoire : sans lui, l'import échoue. Avec `APP_ENV=dev`
+seulement, une clé aléatoire par processus est utilisée (jetons perdus au redémarrage et
+refusés par les autres répliques).
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ACCESS_CODES_REFRESH = float(os.getenv("ACCESS_CODES_REFRESH", "60"))
+ACCESS_CODES_MISS_REFRESH = float(os.getenv("ACCESS_CODES_MISS_REFRESH", "5"))
+SESSION_TTL = float(os.getenv("SESSION_TTL_HOURS", "12")) * 3600
+SESSION_PARAM = "session"
+
+_secret = os.getenv("SESSION_SECRET", "").encode("utf-8")
+if not _secret:
+    if os.getenv("APP_ENV", "").lower() not in ("dev", "development"):
+        raise RuntimeError("SESSION_SECRET manquant : définissez-le (identique sur toutes les répliques), "
+                           "ou APP_ENV=dev pour une clé aléatoire de développement")
+    logger.warning("auth: SESSION_SECRET absent (APP_ENV=dev), clé aléatoire : sessions perdues au redémarrage")
+    _secret = secrets.token_bytes(32)
+
+
+def code_hash(code):
+    return hashlib.sha256((code or "").strip().encode("utf-8")).hexdigest()
+
+
+class AccessCodeCache:
+    """Active access codes (as hashes), refreshed in the background of logins."""
+
+    def __init__(self, fetch, refresh_seconds=ACCESS_CODES_REFRESH, miss_refresh_seconds=ACCESS_CODES_MISS_REFRESH):
+        self._fetch = fetch
+        self.refresh_seconds = refresh_seconds
+        self.miss_refresh_seconds = miss_refresh_seconds
+        self._hashes = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def _refresh(self, min_age):
+        # Single flight: concurrent logins keep using the current set while one thread reloads it
+        if not self._refreshing.acquire(blocking=self._hashes is None):
+            return
+        try:
+            if self._hashes is not None and time.monotonic() - self._loaded_at < min_age:
+                return
+            hashes = {code_hash(code) for code in self._fetch()}
+            with self._lock:
+                self._hashes, self._loaded_at = hashes, time.monotonic()
+        except Exception as e:
+            if self._hashes is None:
+                raise
+            logger.warning("auth: rechargement des codes d'accès impossible, ancienne liste conservée: %s", e)
+        finally:
+            self._refreshing.release()
+
+    def is_active(self, code):
+        """True if `code` is an active access code. Raises only if the codes were never loaded."""
+        self._refresh(self.refresh_seconds)
+        digest = code_hash(code)
+        if digest in self._hashes:
+            return True
+        self._refresh(self.miss_refresh_seconds)
+        return digest in self._hashes
+
+
+_code_cache = None
+_code_cache_lock = threading.Lock()
+
+
+def get_access_code_cache(repo):
+    """Process-wide cache over `repo.list_active_access_codes()`."""
+    global _code_cache
+    with _code_cache_lock:
+        if _code_cache is None:
+            _code_cache = AccessCodeCache(repo.list_active_access_codes)
+        return _code_cache
+
+
+# --- HELPER: jeton de session signé ---
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def issue_session_token(user_name, user_email, ttl=SESSION_TTL, sid=None):
+    # "s" identifies the session's working set in session_store.py, shared by all replicas
+    claims = {"n": user_name, "e": user_email, "s": sid or secrets.token_urlsafe(12), "x": int(time.time() + ttl)}
+    body = _b64(json.dumps(claims,
+                           ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    signature = _b64(hmac.new(_secret, body.encode("ascii"), hashlib.sha256).digest())
+    return f"{body}.{signature}"
+
+
+def read_session_token(token):
+    """{"user_name", "user_email", "sid"} if the token is authentic and not expired, else None."""
+    try:
+        body, signature = token.split(".")
+        expected = _b64(hmac.new(_secret, body.encode("ascii"), hashlib.sha256).digest())
+        if not hmac.compare_digest(signature, expected):
+            return None
+        claims = json.loads(_unb64(body))
+        if claims["x"] < time.time():
+            return None
+        return {"user_name": claims["n"], "user_email": claims["e"], "sid": claims.get("s")}
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+
+
+def revoke_session_token(token):
+    """Make an authentic token unusable until it expires. Returns False if the store refused it."""
+    from session_store import revoke_sid
+
+    try:
+        body, _ = token.split(".")
+        claims = json.loads(_unb64(body))
+    except (ValueError, TypeError, AttributeError):
+        return False
+    if not read_session_token(token) or not claims.get("s"):
+        return False
+    return revoke_sid(claims["s"], ttl=max(1.0, claims["x"] - time.time()))
+
+
+def remember_session(user_name, user_email):
+    """Put a signed token in the URL so that a page refresh keeps the student logged in."""
+    import streamlit as st
+
+    sid = secrets.token_urlsafe(12)
+    st.query_params[SESSION_PARAM] = issue_session_token(user_name, user_email, sid=sid)
+    st.session_state.session_sid = sid
+
+
+def resume_session():
+    """Restore the login from the URL token; returns True when the session was restored."""
+    import streamlit as st
+
+    from session_store import sid_revoked
+
+    token = st.query_params.get(SESSION_PARAM)
+    claims = read_session_token(token) if token else None
+    if claims and sid_revoked(claims["sid"]):
+        claims = None
+    if not claims:
+        if token:
+            del st.query_params[SESSION_PARAM]
+        return False
+    st.session_state.authenticated = True
+    st.session_state.user_name = claims["user_name"]
+    st.session_state.user_email = claims["user_email"]
+    st.session_state.current_user = claims["user_email"]
+    st.session_state.session_sid = claims["sid"]
+    return True
+
+
+def forget_session():
+    """Logout: revoke the URL token on every replica, then drop it from the URL."""
+    import streamlit as st
+
+    if SESSION_PARAM in st.query_params:
+        revoke_session_token(st.query_params.get(SESSION_PARAM))
+        del st.query_params[SESSION_PARAM]
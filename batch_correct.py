@@ -0,0 +1,232 @@
+"""Correction en lot des copies d'une classe, sans navigateur.
+
+Parcourt les lignes `submitted` / `resubmitted` de `exams_streamlit`, déclenche
+la correction n8n de chacune avec une concurrence bornée et attend le résultat
+dans `exam_results`. Le statut reste `submitted` après la correction : une copie dont
+le dernier résultat est postérieur à sa soumission (`submitted_at`) est déjà corrigée
+et n'est pas renvoyée, avec ou sans fichier de reprise. Le fichier de reprise évite en
+plus de relire ces résultats après une interruption.
+
+    python batch_correct.py --concurrency 8 --checkpoint classe_2bac.json
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import requests
+from dotenv import load_dotenv
+from supabase import create_client
+
+from answer_keys import canonical_answers
+from correction_outbox import enqueue_correction
+from grading_cache import get_grading_cache, index_questions
+from storage_codec import decode, decode_row
+
+PENDING_STATUSES = ["submitted", "resubmitted"]
+
+
+class Checkpoint:
+    """JSON file holding the exam ids already handled, rewritten atomically after each one."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.state = {"done": {}, "failed": {}}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.state.update(json.load(f))
+
+    def is_done(self, exam_id):
+        return exam_id in self.state["done"]
+
+    def record(self, exam_id, ok, info):
+        with self._lock:
+            bucket, other = ("done", "failed") if ok else ("failed", "done")
+            self.state[bucket][exam_id] = info
+            self.state[other].pop(exam_id, None)
+            if self.path:
+                tmp = f"{self.path}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self.state, f, ensure_ascii=False, indent=1)
+                os.replace(tmp, self.path)
+
+
+def iter_pending_exams(supabase, page_size=100, student_prefix=None):
+    """Stream pending exams page by page (keyset pagination on (created_at, id))."""
+    last = None
+    while True:
+        # The view resolves exam_content through exam_templates (migrations/0005_exam_templates.sql)
+        query = supabase.table("exams_streamlit_full") \
+            .select("id, student_id, status, created_at, submitted_at, exam_content, student_responses") \
+            .in_("status", PENDING_STATUSES)
+        if student_prefix:
+            query = query.like("student_id", f"{student_prefix}%")
+        if last:
+            # Rows sharing a created_at (bulk inserts) are ordered by id, so none is skipped
+            created_at, exam_id = last
+            query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{exam_id})')
+        rows = query.order("created_at").order("id").limit(page_size).execute().data or []
+        corrected = corrected_exam_ids(supabase, rows)
+        for row in rows:
+            row['corrected'] = row['id'] in corrected
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last = (rows[-1]['created_at'], rows[-1]['id'])
+
+
+def corrected_exam_ids(supabase, rows):
+    """Ids of the exams in `rows` whose newest result is not older than their submission (one query per page)."""
+    if not rows:
+        return set()
+    res = supabase.table("exam_results").select("exam_id, created_at") \
+        .in_("exam_id", [row['id'] for row in rows]) \
+        .order("created_at", desc=True).execute()
+    latest = {}
+    for result in res.data or []:
+        latest.setdefault(result['exam_id'], datetime.fromisoformat(result['created_at']))
+    return {row['id'] for row in rows
+            if row['id'] in latest and (not row.get('submitted_at') or latest[row['id']] >= datetime.fromisoformat(row['submitted_at']))}
+
+
+def latest_result_id(supabase, exam_id, student_id):
+    res = supabase.table("exam_results").select("id") \
+        .eq("exam_id", exam_id).eq("student_id", student_id) \
+        .order("created_at", desc=True).limit(1).execute()
+    return res.data[0]['id'] if res.data else None
+
+
+def correct_exam(supabase, webhook_url, row, wait_timeout, poll_interval, via_outbox=False):
+    """Dispatch one correction and wait for its `exam_results` row. Returns the latency in seconds.
+
+    With `via_outbox` the request goes through `correction_outbox` in the
+    `backfill` class, so the apps' dispatchers serve live submissions first.
+    """
+    started = time.perf_counter()
+    # The new result is told apart by its id, not by comparing the local clock with the database one
+    previous_result = latest_result_id(supabase, row['id'], row['student_id']) if wait_timeout > 0 else None
+    decode_row(row)
+    exam_data = row.get('exam_content')
+    if isinstance(exam_data, str):
+        exam_data = json.loads(exam_data.strip("`json\n"))
+    answers = canonical_answers(row.get('student_responses') or {}, exam_data)
+    # Either app may have written the answers: only keys meaning the same question in both are cached
+    questions = index_questions(exam_data)
+    grading = get_grading_cache().correction_payload(answers, questions)
+
+    if via_outbox:
+        enqueue_correction(supabase, row['id'], row['student_id'], answers, status=row['status'],
+                           payload=grading, priority="backfill", exam=exam_data)
+    else:
+        response = requests.post(webhook_url, json={
+            "student_id": row['student_id'],
+            "exam_id": row['id'],
+            **grading,
+            "action": "start_correction"
+        }, timeout=30)
+        response.raise_for_status()
+
+    if wait_timeout <= 0:
+        return time.perf_counter() - started
+
+    deadline = started + wait_timeout
+    while time.perf_counter() < deadline:
+        res = supabase.table("exam_results") \
+            .select("id, detailed_correction, created_at") \
+            .eq("exam_id", row['id']) \
+            .eq("student_id", row['student_id']) \
+            .order("created_at", desc=True).limit(1).execute()
+        if res.data and res.data[0]['id'] != previous_result:
+            corrections = decode(res.data[0].get('detailed_correction')) or []
+            if isinstance(corrections, str):
+                corrections = json.loads(corrections)
+            get_grading_cache().remember(corrections, answers, questions)
+            return time.perf_counter() - started
+        time.sleep(poll_interval)
+    raise TimeoutError(f"aucun résultat après {wait_timeout:.0f}s")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # nearest-rank percentile
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def run(args):
+    load_dotenv()
+    supabase_url, supabase_key = os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY")
+    if not supabase_url or not supabase_key:
+        print("❌ SUPABASE_URL ou SUPABASE_KEY manquants. Vérifiez le fichier .env", file=sys.stderr)
+        return 2
+    supabase = create_client(supabase_url, supabase_key)
+    webhook_url = args.webhook or os.getenv("N8N_CORRECTION_WEBHOOK", "http://localhost:5678/webhook-test/correction")
+    checkpoint = Checkpoint(args.checkpoint)
+
+    latencies, failures, skipped = [], [], 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        in_flight = {}
+        for row in iter_pending_exams(supabase, args.page_size, args.student_prefix):
+            if row['corrected'] or checkpoint.is_done(row['id']):
+                skipped += 1
+                continue
+            if args.limit and len(in_flight) + len(latencies) + len(failures) >= args.limit:
+                break
+            in_flight[pool.submit(correct_exam, supabase, webhook_url, row, args.wait_timeout, args.poll_interval, args.via_outbox)] = row
+            # Keep at most 2x concurrency rows in memory while streaming
+            if len(in_flight) >= 2 * args.concurrency:
+                _drain(in_flight, checkpoint, latencies, failures, block_for_one=True)
+        _drain(in_flight, checkpoint, latencies, failures, block_for_one=False)
+    elapsed = time.perf_counter() - started
+
+    done = len(latencies)
+    print(f"✅ {done} corrigées, ❌ {len(failures)} échecs, ⏭️ {skipped} déjà corrigées")
+    print(f"⏱️ {elapsed:.1f}s — débit {done / elapsed if elapsed else 0:.2f} copies/s")
+    if latencies:
+        print(f"📈 latence p50 {percentile(latencies, 50):.1f}s • p95 {percentile(latencies, 95):.1f}s • max {max(latencies):.1f}s")
+    stats = get_grading_cache().stats()
+    print(f"🧠 cache de correction : {stats['hits']} réponses réutilisées ({stats['hit_rate']:.0%})")
+    for exam_id, error in failures:
+        print(f"   - {exam_id}: {error}")
+    return 1 if failures else 0
+
+
+def _drain(in_flight, checkpoint, latencies, failures, block_for_one):
+    for future in as_completed(list(in_flight)):
+        row = in_flight.pop(future)
+        try:
+            latency = future.result()
+            latencies.append(latency)
+            checkpoint.record(row['id'], True, {"student_id": row['student_id'], "latency": round(latency, 3)})
+        except Exception as e:
+            failures.append((row['id'], str(e)))
+            checkpoint.record(row['id'], False, {"student_id": row['student_id'], "error": str(e)})
+        if block_for_one:
+            return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Corriger en lot les examens soumis d'une classe.")
+    parser.add_argument("--concurrency", type=int, default=4, help="corrections simultanées (défaut: 4)")
+    parser.add_argument("--checkpoint", default="batch_checkpoint.json", help="fichier de reprise")
+    parser.add_argument("--student-prefix", help="ne traiter que les student_id commençant par ce préfixe")
+    parser.add_argument("--limit", type=int, default=0, help="nombre maximum de copies à traiter")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--wait-timeout", type=float, default=180, help="attente max d'un résultat en secondes (0: ne pas attendre)")
+    parser.add_argument("--poll-interval", type=float, default=3)
+    parser.add_argument("--via-outbox", action="store_true",
+                        help="passer par correction_outbox en priorité 'backfill' au lieu d'appeler n8n directement")
+    parser.add_argument("--webhook", help="URL du webhook de correction (défaut: N8N_CORRECTION_WEBHOOK)")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
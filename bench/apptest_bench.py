@@ -0,0 +1,248 @@
+"""Benchmark hors ligne de app.py et app_new.py avec Streamlit AppTest.
+
+Les deux scripts tournent contre un faux Supabase in-process et un faux n8n
+local (voir bench/fakes.py). Chaque scénario (login, liste des examens,
+ouverture, saisie des réponses, soumission, attente de la correction,
+affichage des résultats) mesure le temps des reruns, le nombre de requêtes,
+les octets échangés et le nombre d'éléments rendus. Une exception dans un
+scénario (ou affichée par l'app) est un échec : il est signalé sous le tableau et
+le code de sortie vaut 1. Seule exception, AppTest ne sait pas toujours
+reconstruire l'arbre de la page après des reruns enchaînés (`st.rerun()` après
+`st.empty()`) : le script a tourné jusqu'au bout, ses mesures restent valables et
+seul le nombre d'éléments est absent (`n/a`). Les résultats sont écrits en JSON
+pour comparer deux exécutions :
+
+    python -m bench.apptest_bench --out bench_before.json
+    python -m bench.apptest_bench --out bench_after.json --compare bench_before.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import traceback
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from bench.fakes import FakeDatabase, FakeN8n, install_fake_supabase  # noqa: E402
+
+APPS = ("app.py", "app_new.py")
+METRICS = ("wall_time", "queries", "bytes", "elements")
+
+
+def count_elements(node):
+    children = getattr(node, "children", None) or {}
+    return 1 + sum(count_elements(child) for child in children.values())
+
+
+def _tree_parser_error(error):
+    # AppTest merges the deltas of chained reruns and its tree parser then fails on a
+    # container replaced by st.empty(): the script ran, only the page tree is missing
+    frames = traceback.extract_tb(error.__traceback__)
+    return isinstance(error, AssertionError) and bool(frames) and frames[-1].name == "parse_tree_from_messages"
+
+
+def _describe(error):
+    frame = traceback.extract_tb(error.__traceback__)[-1]
+    return f"{type(error).__name__}: {error} ({os.path.basename(frame.filename)}:{frame.lineno})"
+
+
+class Recorder:
+    """Runs AppTest steps and collects one metrics dict per scenario."""
+
+    def __init__(self, db, n8n, at=None):
+        self.db, self.n8n = db, n8n
+        self.at = at
+        self.scenarios = {}
+
+    def step(self, name, action, repeat=1):
+        """Run `action(at)` `repeat` times and record its averaged metrics under `name`."""
+        samples = []
+        for _ in range(repeat):
+            self.db.reset_counters()
+            self.n8n.reset_counters()
+            started = time.perf_counter()
+            error, tree_error = None, False
+            try:
+                action(self.at)
+            except Exception as e:
+                tree_error = _tree_parser_error(e)
+                error = None if tree_error else _describe(e)
+            wall = time.perf_counter() - started
+            if error is None and not tree_error and self.at.exception:
+                error = f"exception affichée par l'app: {self.at.exception[0].value}"
+            samples.append({
+                "wall_time": wall,
+                "queries": self.db.queries,
+                "bytes": self.db.bytes + self.n8n.bytes,
+                "webhook_calls": self.n8n.requests,
+                "elements": None if tree_error else count_elements(self.at._tree),
+                "error": error,
+                "_started": started,
+            })
+            if error or tree_error:
+                # Later scenarios start again from the session state in a fresh AppTest
+                self.reload()
+                self.at.run()
+        result = {k: sum(s[k] for s in samples) / len(samples) for k in ("wall_time", "queries", "bytes", "webhook_calls")}
+        elements = [s["elements"] for s in samples if s["elements"] is not None]
+        result["elements"] = sum(elements) / len(elements) if elements else None
+        result["runs"] = len(samples)
+        result["error"] = next((s["error"] for s in samples if s["error"]), None)
+        self.scenarios[name] = result
+        return samples[-1]
+
+    def reload(self):
+        """Same session in a fresh AppTest, as a browser reloading the page; not run yet."""
+        from streamlit.testing.v1 import AppTest
+
+        old = self.at
+        self.at = AppTest.from_file(old._script_path, default_timeout=old.default_timeout)
+        for key, value in old.session_state.filtered_state.items():
+            self.at.session_state[key] = value
+
+    def split_submit(self, sample):
+        """Split the submit rerun into the click itself and the wait for the correction."""
+        enqueued = next((t for t, table, _, _ in self.db.calls if table == "rpc:submit_exam_for_correction"), None)
+        if enqueued is None:
+            return
+        total = self.scenarios["submit"]
+        before = [c for c in self.db.calls if c[0] <= enqueued]
+        submit = dict(total, wall_time=enqueued - sample["_started"], queries=len(before),
+                      bytes=sum(c[3] for c in before))
+        self.scenarios["submit"] = submit
+        self.scenarios["wait_for_correction"] = dict(
+            total,
+            wall_time=total["wall_time"] - submit["wall_time"],
+            queries=total["queries"] - submit["queries"],
+            bytes=total["bytes"] - submit["bytes"],
+        )
+
+
+def _authenticated(AppTest, script, email, timeout):
+    at = AppTest.from_file(script, default_timeout=timeout)
+    at.session_state["authenticated"] = True
+    at.session_state["user_name"] = "Bench Student"
+    at.session_state["user_email"] = email
+    at.session_state["current_user"] = email
+    return at
+
+
+def _button(at, prefix):
+    return next(b for b in at.button if b.label.startswith(prefix))
+
+
+def bench_app(app, db, n8n, args):
+    from streamlit.testing.v1 import AppTest
+
+    script = os.path.join(ROOT, app)
+    # app.py reads the student id from a sidebar text input (default user_123456)
+    student = "bench.student@exam.local" if app == "app_new.py" else "user_123456"
+    db.seed(student, n_exams=args.exams, with_results=0)
+
+    login = AppTest.from_file(script, default_timeout=args.timeout)
+    login.run()
+    login.text_input[0].input("Bench Student")
+    login.text_input[1].input("EXAM2024")
+    rec = Recorder(db, n8n, login)
+    rec.step("login", lambda at: _button(at, "🚀 Se Connecter").click().run())
+
+    rec.at = _authenticated(AppTest, script, student, args.timeout)
+    rec.step("list_exams", lambda at: at.run())
+    open_label = "📖 Ouvrir" if app == "app_new.py" else "✅ Charger cet examen"
+    rec.step("open_exam", lambda at: _button(at, open_label).click().run())
+
+    # One rerun per answered question, as a student typing in the browser
+    n_answers = min(args.answers, len(rec.at.text_area))
+    answered = iter(range(n_answers))
+    rec.step("type_answers", lambda at: at.text_area[next(answered)].input("A typical student answer for this question.").run(),
+             repeat=n_answers)
+
+    sample = rec.step("submit", lambda at: _button(at, "🏁 Terminer").click().run())
+    rec.split_submit(sample)
+    # Widgets dropped by the submit reruns have no state left in the old AppTest
+    rec.reload()
+    rec.step("view_results", lambda at: at.run())
+    return rec.scenarios
+
+
+def compare(current, previous):
+    lines = [f"{'scénario':32} " + " ".join(f"{m:>22}" for m in METRICS)]
+    for app, scenarios in current["apps"].items():
+        for name, values in scenarios.items():
+            old = previous.get("apps", {}).get(app, {}).get(name)
+            cells = []
+            for m in METRICS:
+                if values[m] is None:
+                    cells.append(f"{'n/a':>22}")
+                elif old and old.get(m):
+                    delta = (values[m] - old[m]) / old[m] * 100
+                    cells.append(f"{values[m]:>12.3f} ({delta:+6.1f}%)")
+                else:
+                    cells.append(f"{values[m]:>22.3f}")
+            lines.append(f"{app + ':' + name:32} " + " ".join(cells))
+    for app, name, error in failures(current):
+        lines.append(f"❌ {app}:{name} : {error}")
+    return "\n".join(lines)
+
+
+def failures(results):
+    return [(app, name, values["error"]) for app, scenarios in results["apps"].items()
+            for name, values in scenarios.items() if values.get("error")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark AppTest de app.py / app_new.py avec faux back ends.")
+    parser.add_argument("--apps", nargs="+", default=list(APPS), choices=APPS)
+    parser.add_argument("--supabase-latency", type=float, default=0.02, help="latence par requête Supabase (s)")
+    parser.add_argument("--generation-latency", type=float, default=0.5, help="latence du webhook de génération (s)")
+    parser.add_argument("--correction-latency", type=float, default=1.0, help="délai avant l'écriture du résultat (s)")
+    parser.add_argument("--exams", type=int, default=5, help="examens existants par étudiant")
+    parser.add_argument("--answers", type=int, default=8, help="réponses saisies (un rerun chacune)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="fichier JSON d'une exécution précédente")
+    args = parser.parse_args(argv)
+
+    db = FakeDatabase(latency=args.supabase_latency)
+    install_fake_supabase(db)
+    n8n = FakeN8n(db, args.generation_latency, args.correction_latency).start()
+    os.environ.update({
+        "SUPABASE_URL": "http://fake-supabase.local",
+        "SUPABASE_KEY": "fake-key",
+        "SESSION_SECRET": "bench-session-secret",
+        "N8N_WEBHOOK": f"{n8n.url}/generation",
+        "N8N_CORRECTION_WEBHOOK": f"{n8n.url}/correction",
+    })
+
+    results = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        },
+        "apps": {},
+    }
+    try:
+        for app in args.apps:
+            results["apps"][app] = bench_app(app, db, n8n, args)
+    finally:
+        n8n.stop()
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(results, json.load(f)))
+    else:
+        print(compare(results, {}))
+    print(f"\n📄 Résultats enregistrés dans {args.out}")
+    return 1 if failures(results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Benchmark du codec de stockage (storage_codec.py) sur les payloads d'une page.
+
+Pour chaque page, compare le JSON brut, zstd seul et zstd avec un dictionnaire
+entraîné : octets échangés avec Supabase (enveloppe base64 comprise) et temps de
+décodage côté app. Les examens et corrections viennent de bench/fakes.py, ou d'un
+export réel (`--samples export.json`, liste de lignes `exams_streamlit` / `exam_results`).
+
+    python -m bench.codec_bench
+    python -m bench.codec_bench --samples export.json --dict codec_dicts/0001-123.dict
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import storage_codec  # noqa: E402
+from bench.fakes import PASSAGE, fake_result, stored_exam  # noqa: E402
+
+ANSWER = "A typical student answer for this question, with a few words from the passage."
+ESSAY = " ".join(["Technology helps students to revise and to work together outside the classroom."] * 12)
+
+
+def fake_rows(n):
+    """(exam row, result row) pairs with some variety between students."""
+    rng = random.Random(42)
+    rows = []
+    for seed in range(n):
+        exam = stored_exam(seed)
+        words = PASSAGE.split()
+        rng.shuffle(words)
+        exam["comprehension"]["texte"] = " ".join(words)
+        answers = {f"ans_{i}": f"{ANSWER} ({rng.randint(0, 999)})" for i in range(8)}
+        answers.update({f"lang_{i}_0": f"Sentence {rng.randint(0, 99)} was rewritten." for i in range(10)})
+        answers["writing_1"] = ESSAY
+        exam_row = {"id": str(seed), "exam_content": exam, "student_responses": answers}
+        rows.append((exam_row, fake_result(str(seed), "student", answers)))
+    return rows
+
+
+def load_rows(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    exams = [r for r in data if "exam_content" in r]
+    results = {r.get("exam_id"): r for r in data if "detailed_correction" in r}
+    return [(e, results.get(e.get("id"), {})) for e in exams]
+
+
+PAGES = {
+    # page -> [(row index in the pair, column)]
+    "open_exam": [(0, "exam_content"), (0, "student_responses")],
+    "save_answers": [(0, "student_responses")],
+    "results": [(1, "detailed_correction"), (1, "student_responses")],
+}
+
+
+def configure(mode, dictionary=None):
+    """Point storage_codec at one mode: raw, zstd or zstd+dict."""
+    storage_codec.STORAGE_CODEC = "" if mode == "raw" else "zstd"
+    storage_codec.WRITE_COLUMNS = set(storage_codec.CODEC_COLUMNS)
+    dicts = {dictionary.dict_id(): dictionary} if mode == "zstd+dict" and dictionary is not None else {}
+    storage_codec._dicts = (dicts, next(iter(dicts), None))
+    storage_codec._local = type(storage_codec._local)()
+
+
+def measure(rows, mode, dictionary=None):
+    configure(mode, dictionary)
+    report = {}
+    for page, columns in PAGES.items():
+        wire, decode_s, count = 0, 0.0, 0
+        for pair in rows:
+            for idx, column in columns:
+                value = pair[idx].get(column)
+                if value is None:
+                    continue
+                stored = storage_codec.encode(value, column)
+                wire += len(json.dumps(stored, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+                started = time.perf_counter()
+                decoded = storage_codec.decode(stored)
+                decode_s += time.perf_counter() - started
+                assert decoded == value, f"{page}/{column}: aller-retour incorrect"
+            count += 1
+        report[page] = {"octets": round(wire / max(count, 1)), "décodage_us": round(decode_s / max(count, 1) * 1e6, 1)}
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Octets échangés et temps de décodage par page, avec et sans codec.")
+    parser.add_argument("--rows", type=int, default=300, help="examens synthétiques (sans --samples)")
+    parser.add_argument("--samples", help="export JSON de lignes réelles")
+    parser.add_argument("--dict", help="dictionnaire existant (défaut : entraîné sur la moitié des lignes)")
+    parser.add_argument("--dict-size", type=int, default=64 * 1024)
+    parser.add_argument("--out", default="bench_codec.json")
+    args = parser.parse_args(argv)
+
+    if storage_codec.zstandard is None:
+        print("❌ zstandard manquant : pip install zstandard", file=sys.stderr)
+        return 2
+    rows = load_rows(args.samples) if args.samples else fake_rows(args.rows)
+    if args.dict:
+        with open(args.dict, "rb") as f:
+            dictionary = storage_codec.zstandard.ZstdCompressionDict(f.read())
+        test = rows
+    else:
+        # Train on one half, measure on the other: the dictionary never saw the measured rows
+        train, test = rows[::2], rows[1::2]
+        samples = [pair[idx][col] for pair in train for idx, cols in ((0, ("exam_content", "student_responses")),
+                                                                       (1, ("detailed_correction",)))
+                   for col in cols if pair[idx].get(col)]
+        dictionary = storage_codec.train(samples, args.dict_size)
+
+    results = {mode: measure(test, mode, dictionary) for mode in ("raw", "zstd", "zstd+dict")}
+    print(f"{'page':<14}" + "".join(f"{mode + ' octets':>18}{'décodage µs':>14}" for mode in results))
+    for page in PAGES:
+        print(f"{page:<14}" + "".join(f"{results[mode][page]['octets']:>18}{results[mode][page]['décodage_us']:>14}"
+                                      for mode in results))
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"rows": len(test), "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\n📄 Résultats enregistrés dans {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
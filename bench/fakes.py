@@ -0,0 +1,418 @@
+"""Faux back ends pour mesurer les apps hors ligne.
+
+`FakeSupabase` remplace le module `supabase` (in-process, latence configurable,
+comptage des requêtes et des octets) ; `FakeN8n` est un petit serveur HTTP local
+qui répond aux webhooks de génération et de correction. La correction est
+asynchrone comme dans n8n : le webhook répond tout de suite et la ligne
+`exam_results` apparaît après `correction_latency` secondes.
+"""
+import copy
+import hashlib
+import itertools
+import json
+import sys
+import threading
+import time
+import types
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PASSAGE = " ".join([
+    "Morocco's education system has changed a lot over the last twenty years.",
+    "More and more students in rural areas now go to secondary school,",
+    "and many of them use their phones to revise for the national baccalaureate.",
+] * 12)
+
+
+def sample_exam(seed=0):
+    """Exam in the shape produced by the n8n generation workflow (before normalize_exam_data)."""
+    return {
+        "info": {"title": f"Bac National - Anglais (#{seed})", "duration": "2h", "total_points": 40},
+        "comprehension": {
+            "text": PASSAGE,
+            "questions": [
+                {"id": f"comp_{i}", "instruction": "Answer the following questions" if i < 4 else "Find in the text",
+                 "question_text": f"Comprehension question {i} about the passage?", "points": 1}
+                for i in range(8)
+            ],
+        },
+        "language": {
+            "questions": [
+                {"id": f"lang_{i}", "instruction": "Rewrite the sentences" if i < 4 else "Fill in the gaps",
+                 "question_text": f"Language task {i}: rewrite this sentence in the passive voice.", "points": 1}
+                for i in range(10)
+            ],
+        },
+        "writing": {
+            "topics": [
+                {"id": "1", "instruction": "Essay", "question_text": "Write an essay about the role of technology in education.", "points": 10},
+            ],
+        },
+    }
+
+
+def stored_exam(seed=0):
+    """Same exam in the shape stored in `exams_streamlit.exam_content` (texte / exercices / sujets)."""
+    return {
+        "info": {"title": f"Bac National - Anglais (#{seed})", "duration": "2h", "total_points": 40},
+        "comprehension": {
+            "texte": PASSAGE,
+            "exercices": [
+                {"id": str(ex + 1), "consigne": "Answer the following questions" if ex == 0 else "Find in the text",
+                 "questions": [{"question": f"Comprehension question {ex * 4 + i} about the passage?", "points": 1} for i in range(4)]}
+                for ex in range(2)
+            ],
+        },
+        "language": {
+            "exercices": [
+                {"id": str(ex + 3), "consigne": "Rewrite the sentences" if ex == 0 else "Fill in the gaps",
+                 "details": [{"question": f"Language task {ex * 5 + i}: rewrite this sentence in the passive voice.", "points": 1} for i in range(5)]}
+                for ex in range(2)
+            ],
+        },
+        "writing": {
+            "sujets": [{"id": "writing_1", "type": "Essay", "sujet": "Write an essay about the role of technology in education.", "points": 10}],
+        },
+    }
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _json_equals(stored, text):
+    try:
+        return stored == json.loads(text)
+    except ValueError:
+        return False
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeDatabase:
+    """Tables as lists of dicts, plus query/byte counters."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.tables = {"exams_streamlit": [], "exam_results": [], "access_codes": [], "correction_outbox": [], "exam_traces": [],
+                       "exam_templates": [], "exams_streamlit_archive": [], "exam_results_archive": []}
+        self.lock = threading.RLock()
+        self._outbox_ids = itertools.count(1)
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.queries = 0
+        self.bytes = 0
+        self.calls = []
+
+    def account(self, table, op, sent, received):
+        with self.lock:
+            size = len(json.dumps(sent, default=str)) + len(json.dumps(received, default=str))
+            self.queries += 1
+            self.bytes += size
+            self.calls.append((time.perf_counter(), table, op, size))
+        if self.latency:
+            time.sleep(self.latency)
+
+    def use_template(self, row):
+        """Same effect as the exams_streamlit_use_template trigger (migrations/0005_exam_templates.sql)."""
+        if row.get("exam_content") is None:
+            return
+        content = row.pop("exam_content")
+        digest = hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+        with self.lock:
+            if not any(t["hash"] == digest for t in self.tables["exam_templates"]):
+                self.tables["exam_templates"].append({"hash": digest, "content": content, "created_at": _now()})
+        row["exam_content"], row["template_hash"] = None, digest
+
+    def seed(self, student_id, n_exams=5, with_results=1):
+        """A student with `n_exams` ready exams, the first `with_results` ones already corrected."""
+        base = datetime.now(timezone.utc)
+        exam_ids = []
+        for i in range(n_exams):
+            exam_id = str(uuid.uuid4())
+            exam_ids.append(exam_id)
+            row = {
+                "id": exam_id, "student_id": student_id, "status": "ready",
+                "created_at": (base - timedelta(days=i)).isoformat(),
+                "exam_content": stored_exam(i), "student_responses": {},
+            }
+            self.use_template(row)
+            self.tables["exams_streamlit"].append(row)
+            if i < with_results:
+                self.tables["exam_results"].append(fake_result(exam_id, student_id, {f"comp_{k}": "answer" for k in range(8)}))
+        self.tables["access_codes"].append({"code": "EXAM2024", "active": True, "created_at": _now()})
+        return exam_ids
+
+
+def fake_result(exam_id, student_id, answers):
+    corrections = [{
+        "id": key, "status": "correct" if i % 3 else "partial", "points_earned": 1 if i % 3 else 0.5,
+        "points": 1, "student_answer": answer, "correct_answer": "Expected answer",
+        "explanation": "The answer is supported by the second paragraph of the text. " * 3,
+    } for i, (key, answer) in enumerate(sorted(answers.items()))]
+    return {
+        "id": str(uuid.uuid4()), "exam_id": exam_id, "student_id": student_id, "created_at": _now(),
+        "score_total": sum(c["points_earned"] for c in corrections), "max_score": 40,
+        "feedback_general": "Good work overall, revise the passive voice.",
+        "detailed_correction": corrections, "student_responses": answers,
+    }
+
+
+class FakeQuery:
+    """Subset of the postgrest query builder used by the apps."""
+
+    def __init__(self, db, table):
+        self.db, self.table = db, table
+        self.op, self.values, self.columns = "select", None, "*"
+        self.returning = "representation"
+        self.on_conflict, self.ignore_duplicates = "id", False
+        self.filters, self.ordering, self.limit_n, self.offset = [], [], None, 0
+
+    # --- operations ---
+    def select(self, columns="*", **kwargs):
+        self.op, self.columns = "select", columns
+        return self
+
+    def insert(self, values, **kwargs):
+        self.op, self.values = "insert", values
+        return self
+
+    def upsert(self, values, on_conflict="", ignore_duplicates=False, **kwargs):
+        self.op, self.values = "upsert", values
+        self.on_conflict, self.ignore_duplicates = on_conflict or "id", ignore_duplicates
+        return self
+
+    def update(self, values, returning=None, **kwargs):
+        self.op, self.values = "update", values
+        self.returning = getattr(returning, "value", returning) or "representation"
+        return self
+
+    def delete(self, **kwargs):
+        self.op = "delete"
+        return self
+
+    # --- filters ---
+    def _filter(self, fn):
+        self.filters.append(fn)
+        return self
+
+    def eq(self, col, value):
+        # PostgREST casts the value to the column type: JSON text matches a jsonb column
+        return self._filter(lambda r: r.get(col) == value or (isinstance(r.get(col), (dict, list)) and isinstance(value, str)
+                                                              and _json_equals(r.get(col), value)))
+
+    def neq(self, col, value):
+        return self._filter(lambda r: r.get(col) != value)
+
+    def in_(self, col, values):
+        return self._filter(lambda r: r.get(col) in values)
+
+    def gt(self, col, value):
+        return self._filter(lambda r: r.get(col) is not None and r.get(col) > value)
+
+    def gte(self, col, value):
+        return self._filter(lambda r: r.get(col) is not None and r.get(col) >= value)
+
+    def lt(self, col, value):
+        return self._filter(lambda r: r.get(col) is not None and r.get(col) < value)
+
+    def lte(self, col, value):
+        return self._filter(lambda r: r.get(col) is not None and r.get(col) <= value)
+
+    def is_(self, col, value):
+        return self._filter(lambda r: r.get(col) is None if value in (None, "null") else r.get(col) == value)
+
+    def like(self, col, pattern):
+        prefix = pattern.rstrip("%")
+        return self._filter(lambda r: str(r.get(col, "")).startswith(prefix))
+
+    def order(self, col, desc=False, **kwargs):
+        self.ordering.append((col, desc))
+        return self
+
+    def limit(self, n, **kwargs):
+        self.limit_n = n
+        return self
+
+    def range(self, start, end, **kwargs):
+        self.offset, self.limit_n = start, end - start + 1
+        return self
+
+    def execute(self):
+        with self.db.lock:
+            rows = self.db.tables.setdefault(self.table, [])
+            matched = [r for r in rows if all(f(r) for f in self.filters)]
+            if self.op in ("insert", "upsert"):
+                new_rows = self.values if isinstance(self.values, list) else [self.values]
+                data = []
+                for values in new_rows:
+                    row = {"id": str(uuid.uuid4()), "created_at": _now()}
+                    row.update(copy.deepcopy(values))
+                    if self.table == "exams_streamlit":
+                        self.db.use_template(row)
+                    conflict = [c.strip() for c in self.on_conflict.split(",")] if self.op == "upsert" else None
+                    existing = next((r for r in rows if all(r.get(c) == row.get(c) for c in conflict)), None) if conflict else None
+                    if existing is not None:
+                        if self.ignore_duplicates:
+                            continue
+                        existing.update(row)
+                    else:
+                        rows.append(row)
+                    data.append(copy.deepcopy(row))
+            elif self.op == "update":
+                for r in matched:
+                    r.update(copy.deepcopy(self.values))
+                    if self.table == "exams_streamlit":
+                        self.db.use_template(r)
+                data = copy.deepcopy(matched) if self.returning == "representation" else []
+            elif self.op == "delete":
+                for r in matched:
+                    rows.remove(r)
+                data = copy.deepcopy(matched)
+            else:
+                for col, desc in reversed(self.ordering):
+                    matched.sort(key=lambda r: (r.get(col) is None, r.get(col) or ""), reverse=desc)
+                matched = matched[self.offset:]
+                if self.limit_n is not None:
+                    matched = matched[:self.limit_n]
+                data = [self._project(r) for r in matched]
+        self.db.account(self.table, self.op, self.values, data)
+        return FakeResponse(data)
+
+    def _project(self, row):
+        if self.columns.strip() == "*":
+            return copy.deepcopy(row)
+        cols = [c.strip() for c in self.columns.split(",")]
+        return {c: copy.deepcopy(row.get(c)) for c in cols}
+
+
+class FakeRpc:
+    def __init__(self, db, name, params):
+        self.db, self.name, self.params = db, name, params or {}
+
+    def execute(self):
+        handler = getattr(self, f"_{self.name}", None)
+        if handler is None:
+            raise RuntimeError(f"fake rpc '{self.name}' non implémentée")
+        with self.db.lock:
+            data = handler(self.params)
+        self.db.account(f"rpc:{self.name}", "rpc", self.params, data)
+        return FakeResponse(data)
+
+    def _submit_exam_for_correction(self, p):
+        for row in self.db.tables["exams_streamlit"]:
+            if row["id"] == p["p_exam_id"]:
+                row.update(student_responses=copy.deepcopy(p["p_student_responses"]), status=p["p_status"], submitted_at=_now())
+        outbox = self.db.tables["correction_outbox"]
+        existing = next((r for r in outbox if r["dedup_key"] == p["p_dedup_key"]
+                         and r["status"] in ("pending", "delivering")), None)
+        if existing:
+            return existing["id"]
+        record = {
+            "id": next(self.db._outbox_ids), "exam_id": p["p_exam_id"], "student_id": p["p_student_id"],
+            "payload": copy.deepcopy(p["p_payload"]), "dedup_key": p["p_dedup_key"],
+            "priority": p.get("p_priority", "first_correction"), "status": "pending", "attempts": 0,
+            "next_attempt_at": _now(), "created_at": _now(), "last_error": None,
+        }
+        outbox.append(record)
+        return record["id"]
+
+    def _claim_correction_outbox(self, p):
+        now = _now()
+        due = [r for r in self.db.tables["correction_outbox"]
+               if r["status"] in ("pending", "delivering") and r["next_attempt_at"] <= now]
+        claimed = due[:p.get("p_limit", 10)]
+        lease = (datetime.now(timezone.utc) + timedelta(seconds=p.get("p_lease_seconds", 60))).isoformat()
+        for r in claimed:
+            r.update(status="delivering", attempts=r["attempts"] + 1, next_attempt_at=lease)
+        return copy.deepcopy(claimed)
+
+
+class FakeSupabase:
+    def __init__(self, db):
+        self.db = db
+
+    def table(self, name):
+        return FakeQuery(self.db, name)
+
+    def from_(self, name):
+        return self.table(name)
+
+    def rpc(self, name, params=None):
+        return FakeRpc(self.db, name, params)
+
+
+def install_fake_supabase(db):
+    """Replace the `supabase` module so `create_client` returns a client on `db`."""
+    module = types.ModuleType("supabase")
+    module.create_client = lambda url, key, *args, **kwargs: FakeSupabase(db)
+    module.Client = FakeSupabase
+    sys.modules["supabase"] = module
+    return module
+
+
+class FakeN8n:
+    """Local HTTP server answering /generation and /correction like the n8n workflows."""
+
+    def __init__(self, db, generation_latency=0.5, correction_latency=1.0):
+        self.db = db
+        self.generation_latency = generation_latency
+        self.correction_latency = correction_latency
+        self.requests = 0
+        self.bytes = 0
+        self._seed = itertools.count(100)
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                payload = json.loads(body or b"{}")
+                if self.path.startswith("/generation"):
+                    time.sleep(fake.generation_latency)
+                    response = sample_exam(next(fake._seed))
+                else:
+                    threading.Timer(fake.correction_latency, fake._write_result, args=(payload,)).start()
+                    response = {"status": "accepted"}
+                raw = json.dumps(response).encode("utf-8")
+                fake.requests += 1
+                fake.bytes += len(body) + len(raw)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-n8n", daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def _write_result(self, payload):
+        answers = dict(payload.get("answers") or {})
+        for item in payload.get("cached_corrections") or []:
+            answers.setdefault(item["id"], item.get("student_answer"))
+        with self.db.lock:
+            result = fake_result(payload.get("exam_id"), payload.get("student_id"), answers)
+            result["trace_id"] = (payload.get("trace") or {}).get("trace_id")
+            self.db.tables["exam_results"].append(result)
+
+    def reset_counters(self):
+        self.requests = 0
+        self.bytes = 0
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
@@ -0,0 +1,370 @@
+"""Test de charge : N étudiants simultanés contre un vrai serveur Streamlit.
+
+Chaque palier de concurrence démarre un serveur bench/stub_server.py (app +
+faux Supabase / n8n) puis simule N étudiants qui parlent le protocole websocket
+de Streamlit comme le navigateur : connexion, ouverture ou génération d'un
+examen, saisie des réponses (un rerun par réponse), soumission et attente de la
+note. Pour chaque palier : latence des reruns (p50/p95/p99), latence par étape,
+threads et mémoire du processus serveur, taux d'erreur.
+
+    python -m bench.load --levels 1 5 10 25 50
+    python -m bench.load --app app.py --levels 10 --generate --out bench_load_app.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from bench.stub_server import APPS, student_identity  # noqa: E402
+
+WIDGETS = ("button", "text_input", "text_area", "selectbox", "checkbox", "radio", "number_input")
+LABELS = {
+    "app_new.py": {"open": "📖 Ouvrir", "generate": "🚀 Générer un nouvel examen"},
+    "app.py": {"open": "✅ Charger cet examen", "generate": "🚀 Générer un nouvel Examen"},
+}
+ANSWER = "A typical student answer for this question."
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # nearest-rank percentile
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class SessionError(Exception):
+    pass
+
+
+class StreamlitSession:
+    """Minimal Streamlit websocket client: sends reruns with widget states like the browser does."""
+
+    def __init__(self, url, timeout):
+        from websockets.sync.client import connect
+
+        self.ws = connect(f"{url.replace('http', 'ws', 1)}/_stcore/stream", max_size=None, open_timeout=timeout)
+        self.timeout = timeout
+        self.page_script_hash = ""
+        self.widgets = []  # (kind, label, id) rendered by the last script run
+        self.values = {}   # widget id -> WidgetState set by the simulated student
+        self.run_latencies = []
+        self.errors = []
+
+    def close(self):
+        self.ws.close()
+
+    # --- widgets ---
+    def widget(self, kind, label_prefix="", nth=0):
+        matches = [w for w in self.widgets if w[0] == kind and w[1].startswith(label_prefix)]
+        if len(matches) <= nth:
+            raise SessionError(f"{kind} '{label_prefix}' introuvable")
+        return matches[nth][2]
+
+    def count(self, kind):
+        return sum(1 for w in self.widgets if w[0] == kind)
+
+    def fill(self, widget_id, text):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        self.values[widget_id] = WidgetState(id=widget_id, string_value=text)
+
+    def click(self, widget_id):
+        return self.rerun(trigger=widget_id)
+
+    # --- protocol ---
+    def rerun(self, trigger=None):
+        """Send a rerun and read until the script is idle. Returns the wall time in seconds."""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+
+        msg = BackMsg()
+        state = msg.rerun_script
+        state.page_script_hash = self.page_script_hash
+        rendered = {w[2] for w in self.widgets}
+        # The browser only reports widgets still on screen
+        state.widget_states.widgets.extend(v for wid, v in self.values.items() if wid in rendered)
+        if trigger:
+            state.widget_states.widgets.add(id=trigger, trigger_value=True)
+        started = time.perf_counter()
+        self.ws.send(msg.SerializeToString())
+        return self._read_until_idle(started)
+
+    def _read_until_idle(self, started):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        run_started, widgets = started, []
+        deadline = started + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise SessionError(f"pas de fin de rerun après {self.timeout:.0f}s")
+            msg = ForwardMsg()
+            msg.ParseFromString(self.ws.recv(timeout=remaining))
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                # Sent at the start of every script run, including the ones chained by st.rerun()
+                self.page_script_hash = msg.new_session.page_script_hash
+                widgets = []
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                self._collect(msg.delta.new_element, widgets)
+            elif kind == "script_finished":
+                now = time.perf_counter()
+                self.run_latencies.append(now - run_started)
+                run_started = now
+                if msg.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    self.widgets = widgets
+                    return now - started
+
+    def _collect(self, element, widgets):
+        kind = element.WhichOneof("type")
+        if kind in WIDGETS:
+            proto = getattr(element, kind)
+            widgets.append((kind, proto.label, proto.id))
+        elif kind == "exception":
+            self.errors.append(f"exception: {element.exception.type}: {element.exception.message}")
+        elif kind == "alert" and element.alert.format == element.alert.ERROR:
+            self.errors.append(f"st.error: {element.alert.body}")
+
+
+def run_student(url, app, i, args):
+    """Full exam lifecycle for simulated student `i`. Returns a result dict (never raises)."""
+    labels = LABELS[app]
+    name, student_id = student_identity(app, i)
+    result = {"student": student_id, "steps": {}, "runs": [], "errors": [], "ok": False}
+    session = None
+
+    def step(label, fn):
+        elapsed = fn()
+        result["steps"].setdefault(label, []).append(elapsed)
+        if args.think_time:
+            time.sleep(args.think_time)
+
+    try:
+        session = StreamlitSession(url, args.timeout)
+        step("connect", session.rerun)
+
+        session.fill(session.widget("text_input", "👤"), name)
+        session.fill(session.widget("text_input", "🔐"), "EXAM2024")
+        step("login", lambda: session.click(session.widget("button", "🚀 Se Connecter")))
+        if app == "app.py":
+            session.fill(session.widget("text_input", "ID Étudiant"), student_id)
+            step("student_id", session.rerun)
+
+        if args.generate:
+            step("generate", lambda: session.click(session.widget("button", labels["generate"])))
+        else:
+            step("open_exam", lambda: session.click(session.widget("button", labels["open"])))
+        if not session.count("text_area"):
+            raise SessionError("examen non affiché")
+
+        for n in range(min(args.answers, session.count("text_area"))):
+            session.fill(session.widget("text_area", nth=n), ANSWER)
+            step("type_answer", session.rerun)
+
+        step("submit_and_wait", lambda: session.click(session.widget("button", "🏁 Terminer")))
+        result["ok"] = not session.errors
+    except Exception as e:
+        result["errors"].append(f"{type(e).__name__}: {e}")
+    finally:
+        if session is not None:
+            result["runs"] = session.run_latencies
+            result["errors"] = session.errors + result["errors"]
+            try:
+                session.close()
+            except Exception:
+                pass
+    return result
+
+
+# --- server process ---
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def proc_status(pid):
+    """VmRSS (bytes) and thread count of a process, from /proc (Linux only)."""
+    status = {"rss": 0, "threads": 0}
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    status["rss"] = int(line.split()[1]) * 1024
+                elif line.startswith("Threads:"):
+                    status["threads"] = int(line.split()[1])
+    except OSError:
+        pass
+    return status
+
+
+class ProcessSampler(threading.Thread):
+    """Polls the server's RSS and thread count, keeping the peaks."""
+
+    def __init__(self, pid, interval=0.25):
+        super().__init__(name="load-sampler", daemon=True)
+        self.pid, self.interval = pid, interval
+        self.peak_rss = self.peak_threads = 0
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.is_set():
+            status = proc_status(self.pid)
+            self.peak_rss = max(self.peak_rss, status["rss"])
+            self.peak_threads = max(self.peak_threads, status["threads"])
+            self._stopping.wait(self.interval)
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+
+
+def start_server(args, students):
+    port = _free_port()
+    cmd = [
+        sys.executable, "-m", "bench.stub_server", "--app", args.app, "--port", str(port),
+        "--students", str(students), "--exams", str(args.exams),
+        "--supabase-latency", str(args.supabase_latency),
+        "--generation-latency", str(args.generation_latency),
+        "--correction-latency", str(args.correction_latency),
+    ]
+    output = None if args.verbose else subprocess.DEVNULL
+    process = subprocess.Popen(cmd, cwd=ROOT, stdout=output, stderr=output)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"le serveur s'est arrêté (code {process.returncode}), relancez avec --verbose")
+        try:
+            with urllib.request.urlopen(f"{url}/_stcore/health", timeout=1) as r:
+                if r.status == 200:
+                    return process, url
+        except OSError:
+            time.sleep(0.3)
+    process.kill()
+    raise RuntimeError("le serveur n'a pas démarré en 60s")
+
+
+def run_level(args, sessions):
+    process, url = start_server(args, sessions)
+    try:
+        baseline = proc_status(process.pid)
+        sampler = ProcessSampler(process.pid)
+        sampler.start()
+        results = [None] * sessions
+
+        def worker(i):
+            results[i] = run_student(url, args.app, i, args)
+
+        threads = []
+        started = time.perf_counter()
+        for i in range(sessions):
+            t = threading.Thread(target=worker, args=(i,), name=f"student-{i}")
+            t.start()
+            threads.append(t)
+            if args.ramp_up and sessions > 1:
+                time.sleep(args.ramp_up / sessions)
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return summarize(sessions, results, baseline, sampler, elapsed)
+
+
+def summarize(sessions, results, baseline, sampler, elapsed):
+    runs = [r for res in results for r in res["runs"]]
+    failed = [res for res in results if not res["ok"]]
+    steps = {}
+    for res in results:
+        for name, values in res["steps"].items():
+            steps.setdefault(name, []).extend(values)
+    return {
+        "sessions": sessions,
+        "duration": elapsed,
+        "completed": sessions - len(failed),
+        "error_rate": len(failed) / sessions,
+        "errors": sorted({e for res in failed for e in res["errors"]})[:20],
+        "reruns": len(runs),
+        "rerun_p50": percentile(runs, 50),
+        "rerun_p95": percentile(runs, 95),
+        "rerun_p99": percentile(runs, 99),
+        "steps": {name: {"p50": percentile(v, 50), "p95": percentile(v, 95), "max": max(v)} for name, v in steps.items()},
+        "threads_baseline": baseline["threads"],
+        "threads_peak": sampler.peak_threads,
+        "rss_baseline": baseline["rss"],
+        "rss_peak": sampler.peak_rss,
+        "rss_per_session": max(0, sampler.peak_rss - baseline["rss"]) / sessions,
+    }
+
+
+def format_table(levels):
+    lines = [f"{'sessions':>8} {'erreurs':>8} {'p50':>7} {'p95':>7} {'p99':>7} {'soumission p95':>15} {'threads':>8} {'Mo/session':>11}"]
+    for level in levels:
+        submit = level["steps"].get("submit_and_wait", {}).get("p95", 0.0)
+        lines.append(
+            f"{level['sessions']:>8} {level['error_rate']:>8.1%} {level['rerun_p50']:>6.2f}s {level['rerun_p95']:>6.2f}s "
+            f"{level['rerun_p99']:>6.2f}s {submit:>14.1f}s {level['threads_peak']:>8} {level['rss_per_session'] / 2**20:>11.2f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test de charge de l'app avec N étudiants simultanés (faux back ends).")
+    parser.add_argument("--app", default="app_new.py", choices=APPS)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 5, 10, 25], help="paliers de sessions simultanées")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="étalement des connexions d'un palier (s)")
+    parser.add_argument("--think-time", type=float, default=0.5, help="pause entre deux actions d'un étudiant (s)")
+    parser.add_argument("--answers", type=int, default=8, help="réponses saisies par étudiant (un rerun chacune)")
+    parser.add_argument("--generate", action="store_true", help="générer un examen au lieu d'ouvrir un examen existant")
+    parser.add_argument("--exams", type=int, default=3, help="examens existants par étudiant")
+    parser.add_argument("--supabase-latency", type=float, default=0.02)
+    parser.add_argument("--generation-latency", type=float, default=0.5)
+    parser.add_argument("--correction-latency", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=180, help="attente max d'un rerun (s)")
+    parser.add_argument("--out", default="bench_load.json")
+    parser.add_argument("--verbose", action="store_true", help="afficher la sortie du serveur")
+    args = parser.parse_args(argv)
+
+    levels = []
+    for sessions in args.levels:
+        print(f"▶️ {sessions} session(s)...", flush=True)
+        level = run_level(args, sessions)
+        levels.append(level)
+        for error in level["errors"][:3]:
+            print(f"   - {error}")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({
+            "meta": {
+                "date": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+                "params": {k: v for k, v in vars(args).items() if k not in ("out", "verbose")},
+            },
+            "levels": levels,
+        }, f, indent=2, ensure_ascii=False)
+    print(format_table(levels))
+    print(f"\n📄 Résultats enregistrés dans {args.out}")
+    return 1 if any(level["error_rate"] for level in levels) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
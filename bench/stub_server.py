@@ -0,0 +1,74 @@
+"""Lance app.py ou app_new.py dans un vrai serveur Streamlit branché sur les faux back ends.
+
+Le faux Supabase et le faux n8n (bench/fakes.py) tournent dans le même
+processus que le serveur, ce qui permet de mesurer la mémoire et les threads
+du processus Streamlit seul vu de l'extérieur (voir bench/load.py).
+
+    python -m bench.stub_server --app app_new.py --port 8599 --students 50
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from bench.fakes import FakeDatabase, FakeN8n, install_fake_supabase  # noqa: E402
+
+APPS = ("app.py", "app_new.py")
+
+
+def student_identity(app, i):
+    """(full name typed at login, student_id used by the app) of simulated student `i`."""
+    name = f"Load Student {i}"
+    if app == "app_new.py":
+        return name, f"{name.lower().replace(' ', '.')}@exam.local"
+    # app.py reads the student id from the sidebar text input
+    return name, f"load_student_{i}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serveur Streamlit avec faux Supabase / n8n pour les tests de charge.")
+    parser.add_argument("--app", default="app_new.py", choices=APPS)
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--students", type=int, default=50, help="étudiants pré-créés")
+    parser.add_argument("--exams", type=int, default=3, help="examens prêts par étudiant")
+    parser.add_argument("--supabase-latency", type=float, default=0.02)
+    parser.add_argument("--generation-latency", type=float, default=0.5)
+    parser.add_argument("--correction-latency", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    db = FakeDatabase(latency=args.supabase_latency)
+    for i in range(args.students):
+        db.seed(student_identity(args.app, i)[1], n_exams=args.exams, with_results=0)
+    install_fake_supabase(db)
+    n8n = FakeN8n(db, args.generation_latency, args.correction_latency).start()
+    os.environ.update({
+        "SUPABASE_URL": "http://fake-supabase.local",
+        "SUPABASE_KEY": "fake-key",
+        "SESSION_SECRET": "bench-session-secret",
+        "N8N_WEBHOOK": f"{n8n.url}/generation",
+        "N8N_CORRECTION_WEBHOOK": f"{n8n.url}/correction",
+    })
+
+    from streamlit import config
+    from streamlit.web import bootstrap
+
+    script = os.path.join(ROOT, args.app)
+    flag_options = {
+        "server_port": args.port,
+        "server_address": "127.0.0.1",
+        "server_headless": True,
+        "server_fileWatcherType": "none",
+        # The load generator is not a browser: no XSRF cookie to echo back
+        "server_enableXsrfProtection": False,
+        "browser_gatherUsageStats": False,
+    }
+    config._main_script_path = script
+    bootstrap.load_config_options(flag_options=flag_options)
+    bootstrap.run(script, False, [], flag_options)
+
+
+if __name__ == "__main__":
+    main()
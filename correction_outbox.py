@@ -0,0 +1,233 @@
+"""Outbox des demandes de correction.
+
+La soumission n'appelle plus le webhook n8n directement : elle met à jour
+`exams_streamlit` et écrit un enregistrement dans `correction_outbox` dans la
+même transaction (fonction SQL `submit_exam_for_correction`, voir
+migrations/0001_correction_outbox.sql). Un dispatcher en arrière-plan livre ces
+enregistrements à n8n avec reprises, déduplication et mise de côté (`dead`)
+après trop d'échecs.
+
+Le dispatcher démarre avec l'app ; il peut aussi tourner seul :
+
+    python correction_outbox.py
+"""
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from answer_keys import workflow_answers
+from metrics import instrument_supabase, start_metrics_server, webhook_post
+from tracing import Trace, parse_ts
+from work_queue import DEFAULT_PRIORITY, get_queue
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CORRECTION_WEBHOOK = "http://localhost:5678/webhook-test/correction"
+
+
+def dedup_key(exam_id, status, answers):
+    """Same exam, same status and same answers => same request while one is pending or delivering."""
+    raw = json.dumps({"exam_id": exam_id, "status": status, "answers": answers}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def enqueue_correction(supabase, exam_id, student_id, answers, status="submitted", payload=None, priority=DEFAULT_PRIORITY,
+                       exam=None):
+    """Save the answers, set the exam status and enqueue its correction in one transaction.
+
+    `payload` is merged into the webhook body (e.g. `cached_corrections`),
+    `priority` is one of work_queue.PRIORITY_CLASSES. With the exam content in `exam`,
+    matching answers are also saved under the keys n8n reads (answer_keys.workflow_answers).
+    Returns the outbox record id.
+    """
+    answers = workflow_answers(answers, exam)
+    body = {
+        "student_id": student_id,
+        "exam_id": exam_id,
+        "action": "start_correction",
+    }
+    body.update(payload or {})
+    res = supabase.rpc("submit_exam_for_correction", {
+        "p_exam_id": exam_id,
+        "p_student_id": student_id,
+        "p_student_responses": answers,
+        "p_status": status,
+        "p_payload": body,
+        "p_dedup_key": dedup_key(exam_id, status, answers),
+        "p_priority": priority,
+    }).execute()
+    wake_dispatcher()
+    return res.data
+
+
+class OutboxDispatcher(threading.Thread):
+    """Background thread delivering outbox records to the n8n correction webhook."""
+
+    def __init__(self, supabase, webhook_url=None, batch_size=10, poll_interval=2.0,
+                 max_attempts=6, base_backoff=2.0, request_timeout=15.0, lease_seconds=300):
+        super().__init__(name="correction-outbox", daemon=True)
+        self.supabase = supabase
+        self.webhook_url = webhook_url or os.getenv("N8N_CORRECTION_WEBHOOK", DEFAULT_CORRECTION_WEBHOOK)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.request_timeout = request_timeout
+        self.lease_seconds = lease_seconds
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        # Records claimed by this process and still waiting in the correction queue
+        self._queued_ids = set()
+        self._queued_lock = threading.Lock()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                delivered = self.dispatch_once()
+            except Exception:
+                logger.exception("outbox: claim failed")
+                delivered = 0
+            # A full batch means there is probably more work waiting
+            if delivered < self.batch_size or not get_queue("correction").idle_slots():
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def dispatch_once(self):
+        # Only claim what can start now: a record waiting in the queue past its lease
+        # would be claimed again (and delivered twice). The rest stays pending in the outbox.
+        queue = get_queue("correction")
+        limit = min(self.batch_size, queue.idle_slots())
+        if not limit:
+            return 0
+        records = self.supabase.rpc("claim_correction_outbox", {
+            "p_limit": limit,
+            "p_lease_seconds": self.lease_seconds,
+        }).execute().data or []
+        claimed_at = time.time()
+        for record in records:
+            with self._queued_lock:
+                if record['id'] in self._queued_ids:
+                    continue # Lease expired while still queued here: already on its way
+                self._queued_ids.add(record['id'])
+            record['_claimed_at'] = claimed_at
+            queue.submit(record['student_id'], self._deliver, record, key=record['exam_id'],
+                         priority=record.get('priority') or DEFAULT_PRIORITY)
+        return len(records)
+
+    def _deliver(self, record):
+        try:
+            self._post(record)
+        finally:
+            with self._queued_lock:
+                self._queued_ids.discard(record['id'])
+
+    def _post(self, record):
+        trace = Trace.from_context((record.get('payload') or {}).get('trace'))
+        # One key per outbox record: retries of a record share it, a new request for the same answers does not
+        headers = {"Idempotency-Key": f"{record['dedup_key']}:{record['id']}"}
+        if trace is not None:
+            headers.update(trace.headers())
+        started = time.time()
+        try:
+            response = webhook_post(
+                "correction",
+                self.webhook_url,
+                json=record['payload'],
+                headers=headers,
+                timeout=self.request_timeout,
+            )
+            response.raise_for_status()
+        except Exception as e:
+            self._trace(trace, record, started, error=str(e))
+            self._fail(record, str(e))
+            return
+        self._trace(trace, record, started)
+        self.supabase.table("correction_outbox").update({
+            "status": "delivered",
+            "delivered_at": datetime.now(timezone.utc).isoformat(),
+            "last_error": None,
+        }).eq("id", record['id']).execute()
+
+    def _trace(self, trace, record, started, error=None):
+        if trace is None:
+            return
+        claimed_at = record.get('_claimed_at', started)
+        created_at = parse_ts(record.get('created_at'))
+        if created_at:
+            trace.add_span("outbox_wait", created_at, claimed_at, attempts=record.get('attempts'))
+        trace.add_span("queue_wait", claimed_at, started)
+        trace.add_span("webhook_post", started, time.time(), **({"error": error} if error else {}))
+        trace.flush(self.supabase, record['exam_id'])
+
+    def _fail(self, record, error):
+        attempts = record.get('attempts') or 1
+        if attempts >= self.max_attempts:
+            logger.error("outbox: record %s dead after %s attempts: %s", record['id'], attempts, error)
+            update = {"status": "dead", "last_error": error}
+        else:
+            delay = self.base_backoff * (2 ** (attempts - 1))
+            update = {
+                "status": "pending",
+                "last_error": error,
+                "next_attempt_at": (datetime.now(timezone.utc) + timedelta(seconds=delay)).isoformat(),
+            }
+        self.supabase.table("correction_outbox").update(update).eq("id", record['id']).execute()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def start_dispatcher(supabase):
+    """Start the process-wide dispatcher once (Streamlit re-executes the script on every rerun)."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None or not _dispatcher.is_alive():
+            _dispatcher = OutboxDispatcher(supabase)
+            _dispatcher.start()
+        return _dispatcher
+
+
+def wake_dispatcher():
+    if _dispatcher is not None:
+        _dispatcher.wake()
+
+
+def get_outbox_status(supabase, exam_id):
+    """Latest outbox record for an exam (status, attempts, last_error), or None."""
+    res = supabase.table("correction_outbox") \
+        .select("status, attempts, last_error") \
+        .eq("exam_id", exam_id) \
+        .order("created_at", desc=True).limit(1).execute()
+    return res.data[0] if res.data else None
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    if not os.getenv("SUPABASE_URL") or not os.getenv("SUPABASE_KEY"):
+        print("❌ SUPABASE_URL ou SUPABASE_KEY manquants. Vérifiez le fichier .env", file=sys.stderr)
+        sys.exit(2)
+    dispatcher = OutboxDispatcher(instrument_supabase(create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))))
+    dispatcher.start()
+    start_metrics_server()
+    try:
+        while dispatcher.is_alive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        dispatcher.stop()
@@ -0,0 +1,364 @@
+"""Accès aux tables Supabase des apps : une méthode par besoin, colonnes explicites.
+
+Les pages ne font plus de `select("*")` : la liste des examens et les vérifications
+d'existence ne rapatrient pas `exam_content` / `detailed_correction` (les plus gros
+JSON de la base), qui passent par storage_codec.py (compression optionnelle).
+Le nombre de requêtes par rerun est surveillé par metrics.py (`QUERY_BUDGET`).
+
+Le corps d'un examen est stocké une seule fois dans `exam_templates` (clé : hash du
+contenu, voir migrations/0005_exam_templates.sql). Les modèles, les corps
+d'examens et les résultats, qui ne changent plus une fois écrits, sont gardés dans
+un cache LRU borné en octets pour tout le processus (`PAYLOAD_CACHE_MAX_MB`) : une
+classe qui passe le même examen ne le télécharge qu'une fois, et les sessions ne
+gardent que des ids.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+
+from postgrest.types import ReturnMethod
+
+from metrics import REGISTRY
+from storage_codec import decode, decode_row, encode
+from work_queue import QueueFull, get_queue
+
+EXAMS_TABLE = "exams_streamlit"
+RESULTS_TABLE = "exam_results"
+TEMPLATES_TABLE = "exam_templates"
+# Append-only answer history (migrations/0008_answer_log.sql, answer_history.py)
+ANSWER_LOG_TABLE = "answer_log"
+# Cold copies of old exams and results (migrations/0006_archive.sql, archive_exams.py)
+ARCHIVE_TABLES = {EXAMS_TABLE: "exams_streamlit_archive", RESULTS_TABLE: "exam_results_archive"}
+
+EXAM_LIST_COLUMNS = "id, created_at, status"
+EXAM_STATUS_COLUMNS = "id, status, created_at"
+# exam_content is only set on rows older than the templates migration
+EXAM_COLUMNS = "id, student_id, status, exam_content, template_hash, student_responses, started_at"
+EXAM_STATE_COLUMNS = "id, student_id, status, student_responses, started_at"
+ANSWER_LOG_COLUMNS = "seq, kind, changes, created_at"
+RESULT_SUMMARY_COLUMNS = "id, exam_id, student_id, score_total, max_score, created_at"
+# The results page shows the whole row, and n8n workflow versions write either
+# `results` or `detailed_correction` (and `student_responses` or `student_answers`):
+# PostgREST rejects unknown columns, so the detail view keeps every column.
+RESULT_DETAIL_COLUMNS = "*"
+
+# Dashboard prefetch: newest exams warmed in the background, summaries trusted for PREFETCH_TTL seconds
+PREFETCH_EXAMS = int(os.getenv("PREFETCH_EXAMS", "3"))
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "60"))
+
+
+def _first(res):
+    return res.data[0] if res.data else None
+
+
+class PayloadCache:
+    """Process-wide LRU of immutable JSON bodies, bounded in bytes.
+
+    Keys are `(kind, id)`: exam templates by hash, exam bodies (raw and validated,
+    see exam_schema.py) by exam id, result rows by result id. Sessions only keep
+    ids (session_store.py) and ask the repository, which answers from here without
+    a query. Bodies are kept as JSON text: every `get` returns a fresh copy that the
+    page may normalize in place without touching the other sessions.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get(self, kind, key):
+        with self._lock:
+            raw = self._entries.get((kind, key))
+            if raw is None:
+                self.misses[kind] += 1
+            else:
+                self._entries.move_to_end((kind, key))
+                self.hits[kind] += 1
+        if raw is None:
+            REGISTRY.inc("payload_cache_misses_total", kind=kind)
+            return None
+        REGISTRY.inc("payload_cache_hits_total", kind=kind)
+        return json.loads(raw)
+
+    def put(self, kind, key, content):
+        raw = json.dumps(content, ensure_ascii=False)
+        with self._lock:
+            self._discard((kind, key))
+            self._entries[(kind, key)] = raw
+            self._bytes += sys.getsizeof(raw)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= sys.getsizeof(evicted)
+
+    def peek(self, kind, key):
+        """Like `get` without touching the LRU order or the hit counters."""
+        with self._lock:
+            raw = self._entries.get((kind, key))
+        return json.loads(raw) if raw is not None else None
+
+    def discard(self, kind, key):
+        with self._lock:
+            self._discard((kind, key))
+
+    def discard_where(self, kind, match):
+        """Drop the entries of `kind` whose key satisfies `match(key)`."""
+        with self._lock:
+            for entry in [e for e in self._entries if e[0] == kind and match(e[1])]:
+                self._discard(entry)
+
+    def _discard(self, entry):
+        raw = self._entries.pop(entry, None)
+        if raw is not None:
+            self._bytes -= sys.getsizeof(raw)
+
+    def stats(self):
+        """Entries, bytes and hit rate per kind."""
+        with self._lock:
+            per_kind = {}
+            for (kind, _), raw in self._entries.items():
+                s = per_kind.setdefault(kind, {"size": 0, "bytes": 0})
+                s["size"] += 1
+                s["bytes"] += sys.getsizeof(raw)
+            for kind in set(self.hits) | set(self.misses):
+                s = per_kind.setdefault(kind, {"size": 0, "bytes": 0})
+                lookups = self.hits[kind] + self.misses[kind]
+                s.update(hits=self.hits[kind], misses=self.misses[kind],
+                         hit_rate=(self.hits[kind] / lookups) if lookups else 0.0)
+            return {"bytes": self._bytes, "max_bytes": self.max_bytes, "kinds": per_kind}
+
+
+_payload_cache = None
+_payload_cache_lock = threading.Lock()
+
+
+def get_payload_cache():
+    """Process-wide payload cache, sized from PAYLOAD_CACHE_MAX_MB."""
+    global _payload_cache
+    with _payload_cache_lock:
+        if _payload_cache is None:
+            _payload_cache = PayloadCache(max_bytes=int(float(os.getenv("PAYLOAD_CACHE_MAX_MB", "64")) * 1024 * 1024))
+        return _payload_cache
+
+
+def _cache_gauge(field):
+    def read():
+        kinds = get_payload_cache().stats()["kinds"]
+        return {(("kind", kind),): s.get(field, 0) for kind, s in kinds.items()}
+    return read
+
+
+REGISTRY.gauge("payload_cache_bytes", _cache_gauge("bytes"), "Mémoire du cache des corps d'examens et de résultats")
+REGISTRY.gauge("payload_cache_entries", _cache_gauge("size"), "Entrées du cache des corps d'examens et de résultats")
+
+
+class ExamRepository:
+    """Thin layer over the Supabase client; returns plain dicts (or None)."""
+
+    def __init__(self, supabase):
+        self.supabase = supabase
+
+    def _table(self, name, archived=False):
+        return self.supabase.table(ARCHIVE_TABLES[name] if archived else name)
+
+    # --- codes d'accès ---
+    def list_active_access_codes(self):
+        """Every active code, for the in-memory login check (auth.py)."""
+        res = self.supabase.table("access_codes").select("code").eq("active", True).execute()
+        return [row["code"] for row in res.data or []]
+
+    # --- examens ---
+    def list_exams(self, student_id, archived=False):
+        """Id, date and status of a student's exams, newest first (hot rows unless `archived`)."""
+        res = self._table(EXAMS_TABLE, archived).select(EXAM_LIST_COLUMNS) \
+            .eq("student_id", student_id).order("created_at", desc=True).execute()
+        return res.data or []
+
+    def get_exam(self, exam_id):
+        """Content and saved answers, to open an exam. Only the answers are read when the content is cached."""
+        cache = get_payload_cache()
+        content = cache.get("exam", exam_id)
+        columns = EXAM_STATE_COLUMNS if content is not None else EXAM_COLUMNS
+        row = decode_row(_first(self.supabase.table(EXAMS_TABLE).select(columns).eq("id", exam_id).execute()))
+        if row:
+            row["exam_content"] = content if content is not None else self._content(row)
+            if content is None and row["exam_content"] is not None:
+                cache.put("exam", exam_id, row["exam_content"])
+        return row
+
+    def get_exam_content(self, exam_id, archived=False):
+        cache = get_payload_cache()
+        content = cache.get("exam", exam_id)
+        if content is None:
+            row = _first(self._table(EXAMS_TABLE, archived).select("exam_content, template_hash").eq("id", exam_id).execute())
+            content = self._content(decode_row(row)) if row else None
+            if content is not None:
+                cache.put("exam", exam_id, content)
+        return content
+
+    def get_template(self, template_hash):
+        cache = get_payload_cache()
+        content = cache.get("template", template_hash)
+        if content is None:
+            row = _first(self.supabase.table(TEMPLATES_TABLE).select("content").eq("hash", template_hash).execute())
+            content = decode(row["content"]) if row else None
+            if content is not None:
+                cache.put("template", template_hash, content)
+        return content
+
+    def _content(self, row):
+        if row.get("exam_content") is not None or not row.get("template_hash"):
+            return row.get("exam_content")
+        return self.get_template(row["template_hash"])
+
+    def start_exam(self, exam_id):
+        """Record the first opening of an exam (timer start) and return the stored `started_at`."""
+        now = datetime.now(timezone.utc).isoformat()
+        # Only the first opening writes: a second tab or replica reads the existing value
+        row = _first(self.supabase.table(EXAMS_TABLE).update({"started_at": now})
+                     .eq("id", exam_id).is_("started_at", "null").execute())
+        if row is None:
+            row = _first(self.supabase.table(EXAMS_TABLE).select("started_at").eq("id", exam_id).execute())
+        return row["started_at"] if row else None
+
+    def get_latest_exam_status(self, student_id):
+        """Newest exam of a student without its content (generation polling)."""
+        return _first(self.supabase.table(EXAMS_TABLE).select(EXAM_STATUS_COLUMNS)
+                      .eq("student_id", student_id).order("created_at", desc=True).limit(1).execute())
+
+    def insert_exam(self, student_id, exam_content, status="ready", request_id=None):
+        """Returns the id of the exam. The database trigger moves the body to `exam_templates`.
+
+        With `request_id` (generation request), a second save of the same request, from
+        another session or replica, returns the exam already stored instead of a copy.
+        """
+        values = {
+            "student_id": student_id,
+            "exam_content": encode(exam_content, "exam_content"),
+            "status": status,
+        }
+        if request_id is None:
+            row = _first(self.supabase.table(EXAMS_TABLE).insert(values).execute())
+        else:
+            values["generation_request_id"] = request_id
+            # migrations/0012_exam_generation_request.sql: unique (student_id, generation_request_id)
+            row = _first(self.supabase.table(EXAMS_TABLE).upsert(values, on_conflict="student_id,generation_request_id",
+                                                                 ignore_duplicates=True).execute())
+            if row is None:
+                row = _first(self.supabase.table(EXAMS_TABLE).select("id").eq("student_id", student_id)
+                             .eq("generation_request_id", request_id).execute())
+        if not row:
+            return None
+        get_payload_cache().put("exam", row["id"], exam_content)
+        return row["id"]
+
+    def save_answers(self, exam_id, answers):
+        # Called on every answer change: don't send the whole row (exam_content included) back
+        self.supabase.table(EXAMS_TABLE).update({"student_responses": encode(answers, "student_responses")},
+                                                returning=ReturnMethod.minimal).eq("id", exam_id).execute()
+
+    # --- historique des réponses ---
+    def append_answer_log(self, exam_id, seq, kind, changes):
+        """Insert one version; a concurrent writer of the same seq gets a unique violation."""
+        self.supabase.table(ANSWER_LOG_TABLE).insert({"exam_id": exam_id, "seq": seq, "kind": kind, "changes": changes},
+                                                     returning=ReturnMethod.minimal).execute()
+
+    def get_answer_checkpoint(self, exam_id, until_seq=None):
+        """Newest full checkpoint at or before `until_seq`."""
+        query = self.supabase.table(ANSWER_LOG_TABLE).select(ANSWER_LOG_COLUMNS).eq("exam_id", exam_id).eq("kind", "checkpoint")
+        if until_seq is not None:
+            query = query.lte("seq", until_seq)
+        return _first(query.order("seq", desc=True).limit(1).execute())
+
+    def get_answer_log(self, exam_id, after_seq=0, until_seq=None):
+        """Versions after `after_seq` (up to `until_seq`), oldest first."""
+        query = self.supabase.table(ANSWER_LOG_TABLE).select(ANSWER_LOG_COLUMNS).eq("exam_id", exam_id).gt("seq", after_seq)
+        if until_seq is not None:
+            query = query.lte("seq", until_seq)
+        return query.order("seq").execute().data or []
+
+    def list_answer_log(self, exam_id, limit=30):
+        return (self.supabase.table(ANSWER_LOG_TABLE).select(ANSWER_LOG_COLUMNS).eq("exam_id", exam_id)
+                .order("seq", desc=True).limit(limit).execute().data or [])
+
+    def delete_exam(self, exam_id):
+        result_ids = [r["id"] for r in self.supabase.table(RESULTS_TABLE).select("id").eq("exam_id", exam_id).execute().data or []]
+        self.supabase.table(RESULTS_TABLE).delete().eq("exam_id", exam_id).execute()
+        self.supabase.table(EXAMS_TABLE).delete().eq("id", exam_id).execute()
+        cache = get_payload_cache()
+        cache.discard("exam", exam_id)
+        cache.discard("exam_view", exam_id)
+        for result_id in result_ids:
+            cache.discard("result", result_id)
+        cache.discard_where("latest_result", lambda key: key[1] == exam_id)
+
+    # --- résultats ---
+    def get_latest_result_summary(self, student_id, exam_id=None, archived=False):
+        """Newest result (score and ids only), for the exam or for any exam of the student."""
+        query = self._table(RESULTS_TABLE, archived).select(RESULT_SUMMARY_COLUMNS).eq("student_id", student_id)
+        if exam_id is not None:
+            query = query.eq("exam_id", exam_id)
+        return _first(query.order("created_at", desc=True).limit(1).execute())
+
+    def get_result_details(self, result_id, archived=False):
+        """Full result row (corrections, feedback), for the results page. Results are never updated."""
+        cache = get_payload_cache()
+        row = cache.get("result", result_id)
+        if row is None:
+            row = decode_row(_first(self._table(RESULTS_TABLE, archived).select(RESULT_DETAIL_COLUMNS).eq("id", result_id).execute()))
+            if row is not None:
+                cache.put("result", result_id, row)
+        return row
+
+    def get_latest_result(self, student_id, exam_id=None, archived=False, prefetched=False):
+        """Summary first: the detailed correction is only fetched when a result exists.
+
+        With `prefetched=True` a summary warmed by `prefetch_dashboard` less than
+        PREFETCH_TTL seconds ago is used (once) instead of querying. Polling for a
+        new correction must not pass it.
+        """
+        summary = self._take_prefetched_summary(student_id, exam_id) if prefetched else None
+        if summary is None:
+            summary = self.get_latest_result_summary(student_id, exam_id, archived)
+        elif not summary:
+            summary = None
+        return self.get_result_details(summary["id"], archived) if summary else None
+
+    # --- préchargement du tableau de bord ---
+    def prefetch_dashboard(self, student_id, exams, limit=PREFETCH_EXAMS):
+        """Warm the cache in the background for the newest exams of the list (the ones a student opens)."""
+        cache, queue = get_payload_cache(), get_queue("prefetch")
+        for exam in exams[:limit]:
+            if exam.get("status") not in ("ready", "submitted"):
+                continue
+            warmed = cache.peek("latest_result", (student_id, exam["id"]))
+            if warmed is not None and time.time() - warmed["at"] < PREFETCH_TTL / 2:
+                continue
+            try:
+                queue.submit(student_id, self._prefetch_exam, student_id, exam["id"], exam["status"],
+                             key=f"prefetch:{exam['id']}", reuse=True)
+            except QueueFull:
+                return  # best effort: the buttons still work, they just query
+
+    def _prefetch_exam(self, student_id, exam_id, status):
+        if status == "ready":
+            self.get_exam_content(exam_id)
+        summary = self.get_latest_result_summary(student_id, exam_id)
+        # {} records "no result yet", so that the button does not query again
+        get_payload_cache().put("latest_result", (student_id, exam_id), {"at": time.time(), "summary": summary or {}})
+        if summary:
+            self.get_result_details(summary["id"])
+
+    def _take_prefetched_summary(self, student_id, exam_id):
+        cache = get_payload_cache()
+        entry = cache.get("latest_result", (student_id, exam_id))
+        if entry is None:
+            return None
+        cache.discard("latest_result", (student_id, exam_id))
+        return entry["summary"] if time.time() - entry["at"] < PREFETCH_TTL else None
@@ -0,0 +1,273 @@
+"""Schéma des examens générés par n8n, validé une fois à l'arrivée.
+
+`EXAM_SCHEMA` décrit, de façon déclarative (un sous-ensemble de JSON Schema), l'examen
+tel que l'affiche app_new.py après `normalize_exam_data`. `compile_schema` le
+transforme une seule fois, à l'import, en fonctions imbriquées : valider un examen
+ne relit pas le schéma et reste de l'ordre de la dizaine de microsecondes.
+
+La validation répare ce qui est sans ambiguïté (valeurs par défaut déclarées,
+points envoyés en texte, ids numériques, `null` retiré des champs facultatifs) et rejette le reste avec le chemin exact
+de chaque erreur, par exemple `language.exercices[1].details[0].question : texte
+manquant`. app_new.py valide la réponse du webhook de génération avant de
+l'enregistrer ; un examen rejeté n'est jamais écrit dans Supabase. Les pages peuvent
+ensuite lire la structure sans vérifications défensives.
+
+Les examens déjà en base n'ont pas tous passé ce contrôle (une section peut manquer).
+Ils sont lus avec `strict=False` : mêmes types et mêmes réparations, mais ce qui était
+obligatoire prend une valeur vide (`{}`, `[]`, `""`) au lieu d'être rejeté, pour qu'un
+examen commencé reste ouvrable. Seul un type impossible à afficher (une liste à la
+place d'un objet, par exemple) est encore refusé.
+
+Mots-clés reconnus : `type` (object, array, string, number), `properties`,
+`required`, `requiredAny` (au moins une des propriétés non vide), `default`,
+`items`, `minItems`, `minLength`.
+"""
+import copy
+import json
+
+from metrics import REGISTRY
+
+_QUESTION = {
+    "type": "object",
+    "required": ["question"],
+    "properties": {
+        "id": {"type": "string"},
+        "question": {"type": "string", "minLength": 1},
+        "points": {"type": "number", "default": 0},
+    },
+}
+
+_MATCHING_ITEM = {
+    "type": "object",
+    "required": ["id", "text"],
+    "properties": {"id": {"type": "string"}, "text": {"type": "string"}},
+}
+
+EXAM_SCHEMA = {
+    "type": "object",
+    "required": ["comprehension", "language", "writing"],
+    "properties": {
+        "info": {
+            "type": "object",
+            "default": {},
+            "properties": {
+                "title": {"type": "string", "default": "Examen"},
+                "total_points": {"type": "number"},
+            },
+        },
+        "comprehension": {
+            "type": "object",
+            "required": ["texte", "exercices"],
+            "properties": {
+                "texte": {"type": "string", "minLength": 1},
+                "exercices": {"type": "array", "minItems": 1, "items": {
+                    "type": "object",
+                    "required": ["questions"],
+                    "properties": {
+                        "id": {"type": "string"},
+                        "consigne": {"type": "string", "default": ""},
+                        "questions": {"type": "array", "minItems": 1, "items": _QUESTION},
+                    },
+                }},
+            },
+        },
+        "language": {
+            "type": "object",
+            "required": ["exercices"],
+            "properties": {
+                "exercices": {"type": "array", "minItems": 1, "items": {
+                    "type": "object",
+                    # Questions under `details` (stored exams) or `questions` (n8n variant), or a matching exercise
+                    "requiredAny": ["details", "questions", "matching"],
+                    "properties": {
+                        "id": {"type": "string"},
+                        "consigne": {"type": "string", "default": ""},
+                        "details": {"type": "array", "default": [], "items": _QUESTION},
+                        "questions": {"type": "array", "default": [], "items": _QUESTION},
+                        "matching": {
+                            "type": "object",
+                            "properties": {
+                                "expressions": {"type": "array", "default": [], "items": _MATCHING_ITEM},
+                                "fonctions": {"type": "array", "default": [], "items": _MATCHING_ITEM},
+                                "points": {"type": "number", "default": 0},
+                                "instruction": {"type": "string", "default": ""},
+                            },
+                        },
+                    },
+                }},
+            },
+        },
+        "writing": {
+            "type": "object",
+            "required": ["sujets"],
+            "properties": {
+                "sujets": {"type": "array", "minItems": 1, "items": {
+                    "type": "object",
+                    "required": ["id", "sujet"],
+                    "properties": {
+                        "id": {"type": "string"},
+                        "type": {"type": "string", "default": "Writing"},
+                        "sujet": {"type": "string", "minLength": 1},
+                        "points": {"type": "number", "default": 0},
+                    },
+                }},
+            },
+        },
+    },
+}
+
+
+class ExamPayloadError(ValueError):
+    """The payload does not match the schema; `errors` lists "path : problem" strings."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors[:5]) + (f" (+{len(errors) - 5})" if len(errors) > 5 else ""))
+        self.errors = errors
+
+
+# --- Compilation du schéma en fonctions ---
+def _join(path, key):
+    return f"{path}.{key}" if path else str(key)
+
+
+def compile_schema(schema):
+    """Validator `check(value, path, errors, repairs) -> value` for `schema`, built once."""
+    kind = schema.get("type")
+    if kind == "object":
+        return _compile_object(schema)
+    if kind == "array":
+        return _compile_array(schema)
+    if kind == "string":
+        return _compile_string(schema)
+    if kind == "number":
+        return _compile_number()
+    return lambda value, path, errors, repairs: value
+
+
+def _compile_object(schema):
+    fields = [(name, compile_schema(sub), sub) for name, sub in schema.get("properties", {}).items()]
+    required = tuple(schema.get("required", ()))
+    required_any = tuple(schema.get("requiredAny", ()))
+
+    def check(value, path, errors, repairs):
+        if not isinstance(value, dict):
+            errors.append(f"{path or 'examen'} : objet attendu, reçu {type(value).__name__}")
+            return value
+        for name in required:
+            if value.get(name) is None:
+                errors.append(f"{_join(path, name)} : champ obligatoire manquant")
+        if required_any and not any(value.get(name) for name in required_any):
+            errors.append(f"{path} : il faut au moins un de {', '.join(required_any)}")
+        for name, sub_check, sub in fields:
+            if value.get(name) is None:
+                if "default" not in sub:
+                    # An explicit null is the same as a missing field: pages test presence, not value
+                    value.pop(name, None)
+                    continue
+                value[name] = copy.deepcopy(sub["default"])
+            value[name] = sub_check(value[name], _join(path, name), errors, repairs)
+        return value
+    return check
+
+
+def _compile_array(schema):
+    item_check = compile_schema(schema.get("items", {}))
+    min_items = schema.get("minItems", 0)
+
+    def check(value, path, errors, repairs):
+        if not isinstance(value, list):
+            errors.append(f"{path} : liste attendue, reçu {type(value).__name__}")
+            return value
+        if len(value) < min_items:
+            errors.append(f"{path} : au moins {min_items} élément(s) attendu(s), {len(value)} reçu(s)")
+        for i, item in enumerate(value):
+            value[i] = item_check(item, f"{path}[{i}]", errors, repairs)
+        return value
+    return check
+
+
+def _compile_string(schema):
+    min_length = schema.get("minLength", 0)
+
+    def check(value, path, errors, repairs):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            # Numeric ids from the LLM: same value, as text
+            repairs.append(f"{path} : {value!r} → texte")
+            value = str(value)
+        if not isinstance(value, str):
+            errors.append(f"{path} : texte attendu, reçu {type(value).__name__}")
+        elif len(value.strip()) < min_length:
+            errors.append(f"{path} : texte manquant")
+        return value
+    return check
+
+
+def _compile_number():
+    def check(value, path, errors, repairs):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            try:
+                number = float(str(value).replace(",", ".").strip())
+            except ValueError:
+                errors.append(f"{path} : nombre attendu, reçu {value!r}")
+                return value
+            repairs.append(f"{path} : {value!r} → {number:g}")
+            return int(number) if number.is_integer() else number
+        return value
+    return check
+
+
+_EMPTY = {"object": {}, "array": [], "string": ""}
+
+
+def lenient_schema(schema):
+    """Copy of `schema` where required fields default to an empty value and sizes are not checked."""
+    required = set(schema.get("required", ()))
+    schema = {k: v for k, v in schema.items() if k not in ("required", "requiredAny", "minItems", "minLength")}
+    if "properties" in schema:
+        props = {}
+        for name, sub in schema["properties"].items():
+            sub = lenient_schema(sub)
+            if name in required and "default" not in sub and sub.get("type") in _EMPTY:
+                sub["default"] = _EMPTY[sub["type"]]
+            props[name] = sub
+        schema["properties"] = props
+    if "items" in schema:
+        schema["items"] = lenient_schema(schema["items"])
+    return schema
+
+
+_check_exam = compile_schema(EXAM_SCHEMA)
+_check_stored_exam = compile_schema(lenient_schema(EXAM_SCHEMA))
+
+
+# --- Entrée du webhook ---
+def parse_payload(raw):
+    """Unwrap what the generation webhook returns: JSON text (possibly in a ```json block), a list, a wrapper."""
+    if isinstance(raw, str):
+        text = raw.strip()
+        if text.startswith("```"):
+            text = text.split("\n", 1)[1] if "\n" in text else ""
+            text = text.rsplit("```", 1)[0]
+        try:
+            raw = json.loads(text)
+        except ValueError as e:
+            raise ExamPayloadError([f"examen : JSON illisible ({e})"]) from e
+    if isinstance(raw, list) and raw:
+        raw = raw[0]
+    if isinstance(raw, dict) and isinstance(raw.get("exam_content"), (dict, str)):
+        return parse_payload(raw["exam_content"])
+    return raw
+
+
+def validate_exam(data, strict=True):
+    """Repaired exam (modified in place), or ExamPayloadError with every problem and its path.
+
+    `strict=False` is for exams already stored: missing sections and fields become empty.
+    """
+    errors, repairs = [], []
+    data = (_check_exam if strict else _check_stored_exam)(data, "", errors, repairs)
+    if errors:
+        REGISTRY.inc("exam_payloads_total", outcome="rejected")
+        raise ExamPayloadError(errors)
+    REGISTRY.inc("exam_payloads_total", outcome="repaired" if repairs else "valid")
+    return data
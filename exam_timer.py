@@ -0,0 +1,114 @@
+"""Compte à rebours de l'examen, exécuté dans le navigateur.
+
+Un minuteur côté serveur demanderait un rerun par seconde et par étudiant. Ici le
+serveur donne seulement l'échéance (`started_at` de l'examen + `EXAM_DURATION_MINUTES`,
+voir migrations/0007_exam_started_at.sql) : le composant affiche le temps restant
+sans parler au serveur et n'envoie qu'un événement, « temps écoulé », qui passe par
+le bouton « 🏁 Terminer » habituel.
+
+Le serveur ne fait pas confiance à l'horloge du navigateur : l'événement n'est
+accepté qu'à partir de l'échéance moins `EXAM_TIMER_GRACE` secondes, et tout rerun
+après l'échéance plus la même marge termine l'examen, même sans le composant
+(JavaScript bloqué, onglet en veille). Dans les deux cas l'examen passe en lecture
+seule (`exam_expired`) avant l'envoi automatique : sans réponse à envoyer, ou si l'envoi
+échoue, il reste verrouillé avec le bouton d'envoi explicite. Un examen déjà échu quand
+on l'ouvre n'a pas de compte à rebours : app_new.py l'affiche en lecture seule et ne
+l'envoie que sur demande.
+
+Seul app_new.py a un compte à rebours ; les examens ouverts dans app.py n'ont pas de
+durée limite.
+"""
+import logging
+import os
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+EXAM_DURATION_MINUTES = float(os.getenv("EXAM_DURATION_MINUTES", "120"))
+# Clock skew between browser and server, plus the last save in flight
+EXAM_TIMER_GRACE = float(os.getenv("EXAM_TIMER_GRACE", "30"))
+
+_CSS = """
+.exam-timer { font-size: 1.6rem; font-weight: 600; font-variant-numeric: tabular-nums; }
+.exam-timer .label { display: block; font-size: 0.875rem; font-weight: 400; opacity: 0.7; }
+.exam-timer.warn { color: #d33; }
+"""
+
+_JS = """
+export default function (component) {
+    const { data, parentElement, setTriggerValue } = component;
+    // Server clock minus browser clock, measured when the page is rendered
+    const offset = data.server_now_ms - Date.now();
+    const root = document.createElement("div");
+    root.className = "exam-timer";
+    parentElement.appendChild(root);
+    let fired = false;
+    const pad = (n) => String(n).padStart(2, "0");
+    const tick = () => {
+        const left = Math.max(0, data.deadline_ms - (Date.now() + offset));
+        const s = Math.ceil(left / 1000);
+        root.innerHTML = `<span class="label">⏱️ Temps restant</span>${Math.floor(s / 3600)}:${pad(Math.floor(s % 3600 / 60))}:${pad(s % 60)}`;
+        root.classList.toggle("warn", s <= 300);
+        if (left === 0 && !fired) {
+            fired = true;
+            clearInterval(timer);
+            // Send the answers still buffered in the browser (answer_buffer.py) with the same rerun
+            window.dispatchEvent(new Event("examaroc:answers-flush"));
+            setTriggerValue("expired", true);
+        }
+    };
+    const timer = setInterval(tick, 1000);
+    tick();
+    return () => {
+        clearInterval(timer);
+        root.remove();
+    };
+}
+"""
+
+_component = None
+
+
+def _mount():
+    global _component
+    if _component is None:
+        import streamlit as st
+
+        _component = st.components.v2.component("exam_countdown", css=_CSS, js=_JS)
+    return _component
+
+
+def deadline_for(started_at):
+    """Epoch seconds at which an exam started at `started_at` (ISO timestamp) ends; None if unknown."""
+    if not started_at:
+        return None
+    started = datetime.fromisoformat(str(started_at).replace("Z", "+00:00"))
+    return started.timestamp() + EXAM_DURATION_MINUTES * 60
+
+
+def countdown(deadline, key="exam_timer"):
+    """Show the countdown; True on the rerun where the browser reports that time is up."""
+    import streamlit as st
+
+    try:
+        result = _mount()(key=key, data={"deadline_ms": int(deadline * 1000), "server_now_ms": int(time.time() * 1000)},
+                          on_expired_change=lambda: None)
+    except Exception as e:
+        # No component runtime (AppTest, old frontend): static remaining time, the server check still applies
+        logger.debug("exam_timer: composant indisponible (%s)", e)
+        left = max(0, int(deadline - time.time()))
+        st.metric("⏱️ Temps restant", f"{left // 3600}:{left % 3600 // 60:02d}:{left % 60:02d}")
+        return False
+    return bool(getattr(result, "expired", None))
+
+
+def time_is_up(deadline, reported=False):
+    """Server-side check of the deadline, with or without the browser's event."""
+    if not deadline:
+        return False
+    now = time.time()
+    if reported and now < deadline - EXAM_TIMER_GRACE:
+        logger.warning("exam_timer: fin signalée %.0f s avant l'échéance, ignorée", deadline - now)
+        return False
+    return reported or now >= deadline + EXAM_TIMER_GRACE
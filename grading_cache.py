@@ -0,0 +1,232 @@
+"""Cache de correction partagé entre les étudiants qui passent le même examen.
+
+Une entrée est indexée par (hash du contenu de la question, réponse normalisée)
+et garde le verdict du prof IA : status, points_earned, correct_answer et
+explanation. Les réponses déjà vues sont corrigées localement : le webhook n8n
+reçoit toujours toutes les réponses, avec les verdicts déjà connus
+(`cached_corrections`) et la liste des clés qui restent à corriger (`to_grade`).
+
+Les deux apps ne nomment pas les réponses de la même façon : app.py utilise l'id
+de l'exercice (`comp_{id}_{q}`, `lang_{id}_{q}`, `lang_free_{id}_{q}`), app_new.py
+l'id de la question ou sa position (`comp_{position}_{q}`, `lang_{position}_{q}`).
+Une même clé peut donc désigner deux questions différentes d'un schéma à l'autre :
+`index_questions` construit l'index d'un seul schéma, et une clé qui reste ambiguë
+n'est jamais servie depuis le cache.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from answer_keys import matching_key
+from metrics import REGISTRY
+
+CACHED_FIELDS = ("status", "points_earned", "correct_answer", "explanation")
+
+# Writing is graded on the whole essay, two answers are practically never identical
+CACHEABLE_PREFIXES = ("comp_", "lang_")
+
+# Answer key schemes (see the module docstring)
+KEYS_BY_ID = "ids"            # app.py
+KEYS_BY_POSITION = "positions"  # app_new.py
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_answer(text):
+    """Normalize an answer so trivial differences (case, spaces, final dot) share an entry."""
+    if text is None:
+        return ""
+    text = unicodedata.normalize("NFKC", str(text)).casefold()
+    text = _WS_RE.sub(" ", text).strip()
+    return text.rstrip(" .;!")
+
+
+def question_hash(content):
+    """Stable hash of a question's content (passage, instruction, question, points and options)."""
+    raw = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _add(index, key, q_hash):
+    # A key claimed by two different questions is ambiguous: kept as None, never cached
+    if key is None:
+        return
+    key = str(key)
+    index[key] = q_hash if index.get(key, q_hash) == q_hash else None
+
+
+def _question_content(q, **context):
+    return {**context, "question": q.get('question') or q.get('question_text'),
+            "points": q.get('points'), "options": q.get('options')}
+
+
+def _keys_by_id(data):
+    index = {}
+    comp = data.get('comprehension') or {}
+    texte = comp.get('texte') or comp.get('text')
+    for exercice in comp.get('exercices', []) or []:
+        ex_id = exercice.get('id', '?')
+        for q_idx, q in enumerate(exercice.get('questions', []) or []):
+            _add(index, f"comp_{ex_id}_{q_idx}", question_hash(_question_content(q, texte=texte, consigne=exercice.get('consigne'))))
+
+    for exercice in (data.get('language') or {}).get('exercices', []) or []:
+        ex_id = exercice.get('id', '?')
+        for field, prefix in (('details', 'lang_'), ('questions', 'lang_free_')):
+            for q_idx, q in enumerate(exercice.get(field, []) or []):
+                _add(index, f"{prefix}{ex_id}_{q_idx}", question_hash(_question_content(q, consigne=exercice.get('consigne'))))
+        if exercice.get('matching'):
+            _add(index, matching_key(ex_id), question_hash({"consigne": exercice.get('consigne'), "matching": exercice['matching']}))
+    return index
+
+
+def _keys_by_position(data):
+    index = {}
+    comp = data.get('comprehension') or {}
+    texte = comp.get('texte') or comp.get('text')
+    for idx_ex, exercice in enumerate(comp.get('exercices', []) or []):
+        for q_idx, q in enumerate(exercice.get('questions', []) or []):
+            _add(index, q.get('id', f"comp_{idx_ex}_{q_idx}"),
+                 question_hash(_question_content(q, texte=texte, consigne=exercice.get('consigne'))))
+
+    for idx_ex, exercice in enumerate((data.get('language') or {}).get('exercices', []) or []):
+        # Same choice as the exam page: details, else questions
+        for q_idx, q in enumerate(exercice.get('details') or exercice.get('questions') or []):
+            _add(index, q.get('id', f"lang_{idx_ex}_{q_idx}"),
+                 question_hash(_question_content(q, consigne=exercice.get('consigne'))))
+        if exercice.get('matching'):
+            _add(index, matching_key(exercice.get('id', idx_ex)),
+                 question_hash({"consigne": exercice.get('consigne'), "matching": exercice['matching']}))
+    return index
+
+
+def index_questions(data, scheme=None):
+    """Map the answer keys of one app (`KEYS_BY_ID` / `KEYS_BY_POSITION`) to the hash of their question.
+
+    Without `scheme` (answers of unknown origin, e.g. batch_correct.py), a key is
+    kept only when both schemes point it at the same question. Ambiguous keys map to None.
+    """
+    if not isinstance(data, dict):
+        return {}
+    if scheme == KEYS_BY_ID:
+        return _keys_by_id(data)
+    if scheme == KEYS_BY_POSITION:
+        return _keys_by_position(data)
+    index = _keys_by_id(data)
+    for key, q_hash in _keys_by_position(data).items():
+        _add(index, key, q_hash)
+    return index
+
+
+class GradingCache:
+    """Thread-safe LRU cache with TTL, shared by every session of the process."""
+
+    def __init__(self, max_entries=5000, ttl_seconds=7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, q_hash, answer):
+        key = (q_hash, normalize_answer(answer))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                self.evictions += 1
+                REGISTRY.inc("grading_cache_evictions_total")
+                entry = None
+            if entry is None:
+                self.misses += 1
+                REGISTRY.inc("grading_cache_lookups_total", outcome="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        REGISTRY.inc("grading_cache_lookups_total", outcome="hit")
+        return dict(entry[1])
+
+    def put(self, q_hash, answer, item):
+        key = (q_hash, normalize_answer(answer))
+        if not key[1]:
+            return
+        value = {f: item.get(f) for f in CACHED_FIELDS}
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+                REGISTRY.inc("grading_cache_evictions_total")
+
+    def split(self, answers, questions):
+        """Split answers into cached corrections and the answers n8n still has to grade.
+
+        Returns (hits, misses): hits is a list of correction items (with `id`
+        and `student_answer`), misses the {key: answer} dict to send.
+        """
+        hits, misses = [], {}
+        for key, answer in answers.items():
+            q_hash = questions.get(key)
+            cached = None
+            if q_hash and key.startswith(CACHEABLE_PREFIXES) and normalize_answer(answer):
+                cached = self.get(q_hash, answer)
+            if cached is None:
+                misses[key] = answer
+            else:
+                cached.update({"id": key, "student_answer": answer, "cached": True})
+                hits.append(cached)
+        return hits, misses
+
+    def correction_payload(self, answers, questions):
+        """Webhook fields of a correction request: every answer, the cached verdicts and the keys left to grade."""
+        hits, misses = self.split(answers, questions)
+        return {"answers": answers, "cached_corrections": hits, "to_grade": sorted(misses)}
+
+    def remember(self, corrections, answers, questions):
+        """Store the verdicts of a finished correction for the next students."""
+        for item in corrections or []:
+            if not isinstance(item, dict) or item.get('status') not in ('correct', 'partial', 'incorrect'):
+                continue
+            key = str(item.get('id', ''))
+            q_hash = questions.get(key)
+            answer = answers.get(key) if answers else None
+            if answer is None:
+                answer = item.get('student_answer')
+            if q_hash and key.startswith(CACHEABLE_PREFIXES) and answer:
+                self.put(q_hash, answer, item)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_grading_cache():
+    """Process-wide cache instance, sized from GRADING_CACHE_MAX_ENTRIES / GRADING_CACHE_TTL."""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = GradingCache(
+                max_entries=int(os.getenv("GRADING_CACHE_MAX_ENTRIES", "5000")),
+                ttl_seconds=float(os.getenv("GRADING_CACHE_TTL", str(7 * 24 * 3600))),
+            )
+        return _shared_cache
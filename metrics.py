@@ -0,0 +1,506 @@
+"""Métriques du processus : reruns, appels Supabase, webhooks n8n, sessions.
+
+Tout est gardé en mémoire (histogrammes à buckets fixes) et exporté au format
+texte Prometheus par un petit serveur HTTP à côté de Streamlit :
+
+    curl http://127.0.0.1:9464/metrics
+
+Les sorties de debug qui étaient affichées aux étudiants passent par
+`operator_debug` et ne s'affichent qu'en mode opérateur
+(`?operator=<OPERATOR_CODE>` dans l'URL), avec `operator_panel` dans la barre latérale.
+"""
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "examaroc"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Histograms of counts rather than seconds
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 10, 15, 20, 30, 50, 100)
+_COUNT_HISTOGRAMS = {"rerun_queries"}
+# A session counts as waiting while its wait loop has checked in recently
+WAITING_TTL = 15.0
+# Supabase requests allowed per rerun (polling loops excepted); over budget is logged when APP_ENV=dev
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "8"))
+DEV_MODE = os.getenv("APP_ENV", "").lower() in ("dev", "development")
+
+_HELP = {
+    "rerun_duration_seconds": "Durée d'une exécution du script Streamlit",
+    "supabase_request_duration_seconds": "Durée des requêtes Supabase par table et opération",
+    "supabase_errors_total": "Requêtes Supabase en erreur",
+    "webhook_request_duration_seconds": "Durée des appels aux webhooks n8n",
+    "webhook_errors_total": "Appels aux webhooks n8n en erreur (réseau ou HTTP >= 400)",
+    "trace_stage_duration_seconds": "Durée des étapes d'une action tracée (voir tracing.py)",
+    "rerun_queries": "Requêtes Supabase par exécution du script",
+    "query_budget_exceeded_total": "Exécutions du script au-delà de QUERY_BUDGET requêtes",
+    "page_query_errors_total": "Lectures parallèles d'une page en erreur ou hors délai (voir page_loader.py)",
+    "answer_sync_answers_total": "Réponses reçues par lots du navigateur, acceptées ou déjà plus anciennes (voir answer_buffer.py)",
+    "grading_cache_lookups_total": "Réponses cherchées dans le cache de correction, trouvées (hit) ou non (miss) (voir grading_cache.py)",
+    "grading_cache_evictions_total": "Entrées du cache de correction retirées (LRU ou TTL)",
+    "work_queue_wait_seconds": "Attente d'une demande dans sa file avant le départ de l'appel, par file et classe (voir work_queue.py)",
+    "work_queue_run_seconds": "Durée de l'appel au webhook d'une demande, par file et classe",
+    "payload_cache_hits_total": "Lectures servies par le cache des corps d'examens et de résultats (voir exam_repository.py)",
+    "payload_cache_misses_total": "Lectures absentes du cache des corps d'examens et de résultats",
+    "exam_payloads_total": "Examens validés à la génération ou à la première ouverture : valides, réparés ou rejetés (voir exam_schema.py)",
+}
+
+
+class Registry:
+    """Thread-safe histograms and counters keyed by (name, sorted labels)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                bounds = COUNT_BUCKETS if name in _COUNT_HISTOGRAMS else BUCKETS
+                series = self._histograms[key] = {"bounds": bounds, "buckets": [0] * len(bounds), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(series["bounds"]):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def read_counter(self, name):
+        """Current values of a counter, {labels tuple: value}."""
+        with self._lock:
+            return {labels: value for (series_name, labels), value in self._counters.items() if series_name == name}
+
+    def gauge(self, name, fn, help_text=""):
+        """Register `fn() -> {labels tuple: value}` evaluated at scrape time."""
+        self._gauges[name] = (fn, help_text)
+
+    def read_gauge(self, name):
+        """Current values of a registered gauge ({} if unknown or failing)."""
+        fn = self._gauges.get(name, (lambda: {}, ""))[0]
+        try:
+            return fn()
+        except Exception:
+            logger.exception("metrics: gauge %s failed", name)
+            return {}
+
+    @contextmanager
+    def timed(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        """Count / average per histogram series, for the operator panel."""
+        with self._lock:
+            return [
+                {"métrique": name, **dict(labels), "appels": s["count"],
+                 **({"moyenne": round(s["sum"] / s["count"], 1) if s["count"] else 0.0} if name in _COUNT_HISTOGRAMS else
+                    {"moyenne_ms": round(s["sum"] / s["count"] * 1000, 1) if s["count"] else 0.0})}
+                for (name, labels), s in sorted(self._histograms.items())
+            ]
+
+    def render(self):
+        """Everything in Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            histograms = {k: dict(v, buckets=list(v["buckets"])) for k, v in self._histograms.items()}
+            counters = dict(self._counters)
+        for name in sorted({k[0] for k in histograms}):
+            full = f"{PREFIX}_{name}"
+            lines += [f"# HELP {full} {_HELP.get(name, name)}", f"# TYPE {full} histogram"]
+            for (series_name, labels), s in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                for bound, count in zip(s["bounds"], s["buckets"]):
+                    lines.append(f"{full}_bucket{_labels(labels + (('le', _num(bound)),))} {count}")
+                lines.append(f"{full}_bucket{_labels(labels + (('le', '+Inf'),))} {s['count']}")
+                lines.append(f"{full}_sum{_labels(labels)} {_num(s['sum'])}")
+                lines.append(f"{full}_count{_labels(labels)} {s['count']}")
+        for name in sorted({k[0] for k in counters}):
+            full = f"{PREFIX}_{name}"
+            lines += [f"# HELP {full} {_HELP.get(name, name)}", f"# TYPE {full} counter"]
+            for (series_name, labels), value in sorted(counters.items()):
+                if series_name == name:
+                    lines.append(f"{full}{_labels(labels)} {_num(value)}")
+        for name, (fn, help_text) in sorted(self._gauges.items()):
+            try:
+                values = fn()
+            except Exception:
+                logger.exception("metrics: gauge %s failed", name)
+                continue
+            full = f"{PREFIX}_{name}"
+            lines += [f"# HELP {full} {help_text or name}", f"# TYPE {full} gauge"]
+            for labels, value in sorted(values.items()):
+                lines.append(f"{full}{_labels(labels)} {_num(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _num(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+
+# --- HELPER: Supabase ---
+_QUERY_OPS = ("select", "insert", "upsert", "update", "delete")
+
+
+class _TimedQuery:
+    """Wraps a postgrest request builder so that `.execute()` is timed per table and operation."""
+
+    def __init__(self, inner, table, op):
+        self._inner, self._table, self._op = inner, table, op
+
+    def __getattr__(self, name):
+        attr = getattr(self._inner, name)
+        op = name if name in _QUERY_OPS else self._op
+        if not callable(attr):
+            # e.g. `.not_`, a property returning the builder itself
+            return _TimedQuery(attr, self._table, op) if hasattr(attr, "execute") else attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return _TimedQuery(result, self._table, op) if hasattr(result, "execute") else result
+        return call
+
+    def execute(self):
+        _count_query(self._table, self._op)
+        started = time.perf_counter()
+        try:
+            return self._inner.execute()
+        except Exception:
+            REGISTRY.inc("supabase_errors_total", table=self._table, op=self._op)
+            raise
+        finally:
+            REGISTRY.observe("supabase_request_duration_seconds", time.perf_counter() - started,
+                             table=self._table, op=self._op)
+
+
+class InstrumentedClient:
+    """Supabase client proxy: `table()` and `rpc()` calls are timed, everything else passes through."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name):
+        return _TimedQuery(self._client.table(name), name, "select")
+
+    def from_(self, name):
+        return self.table(name)
+
+    def rpc(self, fn, params=None, *args, **kwargs):
+        return _TimedQuery(self._client.rpc(fn, params, *args, **kwargs), fn, "rpc")
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def instrument_supabase(client):
+    if isinstance(client, InstrumentedClient):
+        return client
+    return InstrumentedClient(client)
+
+
+# --- HELPER: webhooks n8n ---
+def webhook_post(endpoint, url, **kwargs):
+    """`requests.post` timed under `endpoint` ("generation", "correction")."""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        response = requests.post(url, **kwargs)
+        status = str(response.status_code)
+        if response.status_code >= 400:
+            REGISTRY.inc("webhook_errors_total", endpoint=endpoint, status=status)
+        return response
+    except Exception:
+        REGISTRY.inc("webhook_errors_total", endpoint=endpoint, status=status)
+        raise
+    finally:
+        REGISTRY.observe("webhook_request_duration_seconds", time.perf_counter() - started,
+                         endpoint=endpoint, status=status)
+
+
+# --- HELPER: reruns et sessions ---
+def _script_runner():
+    # The script thread's target is ScriptRunner._run_script_thread (Streamlit internals,
+    # checked against 1.52): without it, reruns are simply not timed.
+    try:
+        target = getattr(threading.current_thread(), "_target", None)
+        runner = getattr(target, "__self__", None)
+        return runner if callable(getattr(getattr(runner, "on_event", None), "connect", None)) else None
+    except Exception:
+        return None
+
+
+def _on_script_event(app, sender, event=None, **kwargs):
+    outcome = {
+        "SCRIPT_STOPPED_WITH_SUCCESS": "ok",
+        "SCRIPT_STOPPED_FOR_RERUN": "rerun",
+        "SCRIPT_STOPPED_WITH_COMPILE_ERROR": "error",
+    }.get(getattr(event, "name", ""))
+    started = getattr(sender, "_metrics_rerun_started", None)
+    if outcome is None or started is None:
+        return
+    sender._metrics_rerun_started = None
+    REGISTRY.observe("rerun_duration_seconds", time.perf_counter() - started, app=app, outcome=outcome)
+    _check_query_budget(app, sender)
+    callbacks, sender._metrics_end_callbacks = getattr(sender, "_metrics_end_callbacks", []), []
+    for callback in callbacks:
+        try:
+            callback(outcome)
+        except Exception:
+            logger.exception("metrics: rerun end callback failed")
+
+
+_rerun_hook_failed = False
+
+
+def track_rerun(app):
+    """Call at the top of the script: the current run is timed until the ScriptRunner reports its end."""
+    global _rerun_hook_failed
+    runner = _script_runner()
+    if runner is None or _rerun_hook_failed:
+        return
+    if not getattr(runner, "_metrics_hooked", False):
+        try:
+            runner.on_event.connect(partial(_on_script_event, app), weak=False)
+        except Exception:
+            # Another Streamlit version: no rerun metrics rather than a broken page
+            _rerun_hook_failed = True
+            logger.warning("metrics: ScriptRunner.on_event indisponible, reruns non mesurés", exc_info=True)
+            return
+        runner._metrics_hooked = True
+    runner._metrics_rerun_started = time.perf_counter()
+    runner._metrics_end_callbacks = []
+    runner._metrics_queries = Counter()
+    runner._metrics_polling = False
+
+
+def on_rerun_end(callback):
+    """Run `callback(outcome)` in the script thread when the current run ends (after `track_rerun`).
+
+    Returns False when the end of the run cannot be observed.
+    """
+    runner = _script_runner()
+    if runner is None or getattr(runner, "_metrics_rerun_started", None) is None:
+        return False
+    runner._metrics_end_callbacks.append(callback)
+    return True
+
+
+_bound = threading.local()
+
+
+def bind_rerun(fn):
+    """Wrap `fn` so that the Supabase queries it makes from another thread count toward the current rerun."""
+    runner = _script_runner()
+
+    def call(*args, **kwargs):
+        _bound.runner = runner
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _bound.runner = None
+    return call
+
+
+def _count_query(table, op):
+    runner = getattr(_bound, "runner", None) or _script_runner()
+    queries = getattr(runner, "_metrics_queries", None)
+    if queries is not None:
+        queries[f"{table}.{op}"] += 1
+
+
+def _check_query_budget(app, runner):
+    queries = getattr(runner, "_metrics_queries", None) or Counter()
+    total = sum(queries.values())
+    REGISTRY.observe("rerun_queries", total, app=app)
+    # Wait loops poll on purpose: only regular page renders are held to the budget
+    if total <= QUERY_BUDGET or getattr(runner, "_metrics_polling", False):
+        return
+    REGISTRY.inc("query_budget_exceeded_total", app=app)
+    if DEV_MODE:
+        detail = ", ".join(f"{name}×{n}" for name, n in queries.most_common())
+        logger.warning("query budget: %s a fait %d requêtes Supabase (budget %d) : %s", app, total, QUERY_BUDGET, detail)
+
+
+def current_session_id():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        return ctx.session_id if ctx else None
+    except Exception:
+        return None
+
+
+_waiting = {}
+_waiting_lock = threading.Lock()
+
+
+def mark_waiting(kind):
+    """The current session is waiting for `kind` ("generation", "correction"); call on every poll."""
+    runner = _script_runner()
+    if runner is not None:
+        runner._metrics_polling = True
+    session_id = current_session_id()
+    if session_id:
+        with _waiting_lock:
+            _waiting.setdefault(kind, {})[session_id] = time.monotonic()
+
+
+def done_waiting(kind):
+    session_id = current_session_id()
+    with _waiting_lock:
+        _waiting.get(kind, {}).pop(session_id, None)
+
+
+def _waiting_sessions():
+    now = time.monotonic()
+    with _waiting_lock:
+        for sessions in _waiting.values():
+            for session_id, seen in list(sessions.items()):
+                if now - seen > WAITING_TTL:
+                    del sessions[session_id]
+        return {(("kind", kind),): len(sessions) for kind, sessions in _waiting.items()}
+
+
+def _active_sessions():
+    try:
+        from streamlit.runtime import Runtime
+        if Runtime.exists():
+            return {(): Runtime.instance()._session_mgr.num_active_sessions()}
+    except Exception:
+        pass
+    return {}
+
+
+REGISTRY.gauge("sessions_active", _active_sessions, "Sessions Streamlit connectées")
+REGISTRY.gauge("sessions_waiting", _waiting_sessions, "Sessions en attente d'une génération ou d'une correction")
+
+
+# --- HELPER: endpoint /metrics ---
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server():
+    """Serve /metrics on METRICS_ADDR:METRICS_PORT once per process (METRICS_PORT empty: disabled)."""
+    global _server
+    with _server_lock:
+        port = os.getenv("METRICS_PORT", "9464")
+        if _server is not None or not port:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((os.getenv("METRICS_ADDR", "127.0.0.1"), int(port)), _MetricsHandler)
+        except OSError as e:
+            # Another replica on the same host already owns the port
+            logger.warning("metrics: port %s indisponible (%s)", port, e)
+            _server = False
+            return None
+        threading.Thread(target=_server.serve_forever, name="metrics-endpoint", daemon=True).start()
+        return _server
+
+
+# --- HELPER: panneau opérateur ---
+def is_operator():
+    """True when the URL carries ?operator=<OPERATOR_CODE>; remembered for the session."""
+    import streamlit as st
+
+    expected = os.getenv("OPERATOR_CODE")
+    if not expected:
+        return False
+    if not st.session_state.get("operator_mode"):
+        supplied = st.query_params.get("operator") or ""
+        st.session_state.operator_mode = hmac.compare_digest(supplied.encode("utf-8"), expected.encode("utf-8"))
+    return st.session_state.operator_mode
+
+
+def operator_debug(label, *values):
+    """Diagnostic output for operators only; students see nothing."""
+    import streamlit as st
+
+    logger.debug("%s: %r", label, values)
+    if not is_operator():
+        return
+    with st.expander(f"🛠️ {label}"):
+        for value in values:
+            if isinstance(value, (dict, list)):
+                st.json(value)
+            else:
+                st.code(repr(value) if not isinstance(value, str) else value)
+
+
+def operator_panel():
+    """Live metrics in the sidebar, operators only."""
+    import streamlit as st
+
+    if not is_operator():
+        return
+    with st.sidebar.expander("🛠️ Opérateur", expanded=False):
+        sessions = _active_sessions().get((), 0)
+        waiting = _waiting_sessions()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Sessions", sessions)
+        col2.metric("Attente génération", waiting.get((("kind", "generation"),), 0))
+        col3.metric("Attente correction", waiting.get((("kind", "correction"),), 0))
+        cache_bytes = REGISTRY.read_gauge("payload_cache_bytes")
+        if cache_bytes:
+            st.caption("Cache des corps : " + " • ".join(f"{dict(labels)['kind']} {value / 1024 / 1024:.1f} Mo"
+                                                      for labels, value in sorted(cache_bytes.items())))
+        depth = Counter()
+        for labels, value in REGISTRY.read_gauge("work_queue_depth").items():
+            labels = dict(labels)
+            depth[(labels["queue"], labels["state"])] += value
+        if depth:
+            st.caption("Files : " + " • ".join(f"{queue} {depth[(queue, 'queued')]} en attente / {depth[(queue, 'running')]} en cours"
+                                               for queue in sorted({queue for queue, _ in depth})))
+        lookups = {dict(labels)["outcome"]: value for labels, value in REGISTRY.read_counter("grading_cache_lookups_total").items()}
+        if lookups:
+            total = lookups.get("hit", 0) + lookups.get("miss", 0)
+            st.caption(f"Cache de correction : {lookups.get('hit', 0) / total:.0%} de réponses déjà corrigées ({total} cherchées)")
+        rows = REGISTRY.snapshot()
+        if rows:
+            st.dataframe(rows, hide_index=True)
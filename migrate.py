@@ -0,0 +1,204 @@
+"""Applique les migrations SQL de `migrations/` et vérifie les plans des requêtes fréquentes.
+
+Les migrations sont appliquées dans l'ordre de leur numéro, chacune dans sa propre
+transaction, et enregistrées dans `schema_migrations` : relancer la commande
+n'applique que les nouvelles. Elles sont idempotentes (`if not exists`), donc un
+projet où elles avaient été passées à la main dans l'éditeur SQL de Supabase
+peut adopter le runner sans risque.
+
+    DATABASE_URL=postgresql://... python migrate.py            # appliquer
+    python migrate.py --status                                  # état
+    python migrate.py --check-plans                             # EXPLAIN des requêtes fréquentes
+
+`--check-plans` échoue (code 1) si une requête de `HOT_QUERIES` n'utilise pas son
+index ou trie ses lignes. tests/test_migrations.py fait la même vérification requête par
+requête contre un Postgres local (`docker run -e POSTGRES_PASSWORD=pg -p 5432:5432
+postgres:16`), après avoir appliqué les migrations.
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+
+from dotenv import load_dotenv
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# Arbitrary key: two replicas starting at once apply the migrations one after the other
+LOCK_KEY = 4_302_117
+
+_SAMPLE_UUID = "'00000000-0000-0000-0000-000000000000'::uuid"
+
+# (name, query as issued by exam_repository.py / correction_outbox.py, indexes the plan may use)
+HOT_QUERIES = [
+    ("list_exams",
+     "select id, created_at, status from exams_streamlit where student_id = 'x' order by created_at desc",
+     "exams_streamlit_student_created_idx"),
+    ("get_latest_exam_status",
+     "select id, status, created_at from exams_streamlit where student_id = 'x' order by created_at desc limit 1",
+     "exams_streamlit_student_created_idx"),
+    ("get_latest_result_summary",
+     "select id, exam_id, student_id, score_total, max_score, created_at from exam_results"
+     f" where student_id = 'x' and exam_id = {_SAMPLE_UUID} order by created_at desc limit 1",
+     "exam_results_exam_student_created_idx"),
+    ("get_latest_result_summary (sans examen)",
+     "select id, exam_id, student_id, score_total, max_score, created_at from exam_results"
+     " where student_id = 'x' order by created_at desc limit 1",
+     "exam_results_student_created_idx"),
+    ("get_outbox_status",
+     f"select status, attempts, last_error from correction_outbox where exam_id = {_SAMPLE_UUID}"
+     " order by created_at desc limit 1",
+     "correction_outbox_exam_created_idx"),
+    ("exam_timeline",
+     "select trace_id, action, stage, started_at, ended_at, attrs from exam_traces"
+     f" where exam_id = {_SAMPLE_UUID} order by started_at desc limit 100",
+     "exam_traces_exam_idx"),
+    ("get_answer_checkpoint",
+     "select seq, kind, changes, created_at from answer_log"
+     f" where exam_id = {_SAMPLE_UUID} and kind = 'checkpoint' and seq <= 100 order by seq desc limit 1",
+     "answer_log_checkpoint_idx"),
+    ("get_answer_log",
+     "select seq, kind, changes, created_at from answer_log"
+     f" where exam_id = {_SAMPLE_UUID} and seq > 50 order by seq",
+     "answer_log_pkey"),
+    ("list_active_access_codes",
+     "select code from access_codes where active = true",
+     "access_codes_active_idx"),
+]
+
+
+def _connect(url):
+    try:
+        import psycopg
+    except ImportError:
+        print("❌ psycopg manquant : pip install 'psycopg[binary]'", file=sys.stderr)
+        raise SystemExit(2)
+    return psycopg.connect(url)
+
+
+def list_migrations(directory=MIGRATIONS_DIR):
+    """[(version, name, path)] sorted by version, from files named NNNN_name.sql."""
+    found = []
+    for filename in os.listdir(directory):
+        match = re.fullmatch(r"(\d{4})_(.+)\.sql", filename)
+        if match:
+            found.append((match.group(1), match.group(2), os.path.join(directory, filename)))
+    return sorted(found)
+
+
+def _checksum(sql):
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()[:16]
+
+
+def _applied(conn):
+    conn.execute("""
+        create table if not exists schema_migrations (
+            version    text primary key,
+            name       text not null,
+            checksum   text not null,
+            applied_at timestamptz not null default now()
+        )""")
+    return {version: checksum for version, checksum in conn.execute("select version, checksum from schema_migrations")}
+
+
+def migrate(conn, dry_run=False):
+    """Apply pending migrations in order; returns the versions applied."""
+    conn.execute("select pg_advisory_lock(%s)", (LOCK_KEY,))
+    try:
+        with conn.transaction():
+            applied = _applied(conn)
+        done = []
+        for version, name, path in list_migrations():
+            with open(path, encoding="utf-8") as f:
+                sql = f.read()
+            if version in applied:
+                if applied[version] != _checksum(sql):
+                    print(f"⚠️ {version}_{name} modifiée après application (ajouter une nouvelle migration)")
+                continue
+            print(f"{'(simulation) ' if dry_run else ''}→ {version}_{name}")
+            if dry_run:
+                continue
+            with conn.transaction():
+                conn.execute(sql)
+                conn.execute("insert into schema_migrations (version, name, checksum) values (%s, %s, %s)",
+                             (version, name, _checksum(sql)))
+            done.append(version)
+        return done
+    finally:
+        conn.execute("select pg_advisory_unlock(%s)", (LOCK_KEY,))
+
+
+def status(conn):
+    with conn.transaction():
+        applied = _applied(conn)
+    for version, name, _ in list_migrations():
+        print(f"{'✅' if version in applied else '⏳'} {version}_{name}")
+
+
+def _plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def check_plans(conn):
+    """EXPLAIN each hot query with sequential scans disabled; returns the list of problems.
+
+    With `enable_seqscan = off` the planner still falls back to a sequential scan
+    when no index matches, so tiny CI tables give the same verdict as production.
+    """
+    problems = []
+    for name, sql, indexes in HOT_QUERIES:
+        problem = plan_problem(conn, name, sql, indexes)
+        if problem:
+            problems.append(problem)
+    return problems
+
+
+def plan_problem(conn, name, sql, indexes):
+    """Why the plan of one hot query is wrong, or None when it uses one of `indexes` without sorting."""
+    indexes = (indexes,) if isinstance(indexes, str) else indexes
+    with conn.transaction():
+        conn.execute("set local enable_seqscan = off")
+        (plan,), = conn.execute(f"explain (format json) {sql}").fetchall()
+    nodes = list(_plan_nodes(plan[0]["Plan"]))
+    used = {n.get("Index Name") for n in nodes if n.get("Index Name")}
+    if not used & set(indexes):
+        return f"{name}: index {indexes[0]} non utilisé (plan : {', '.join(n['Node Type'] for n in nodes)})"
+    if any(n["Node Type"] in ("Sort", "Incremental Sort") for n in nodes):
+        return f"{name}: tri en mémoire malgré {', '.join(used)}"
+    print(f"✅ {name} → {', '.join(used)}")
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Appliquer les migrations SQL (migrations/NNNN_*.sql).")
+    parser.add_argument("--database-url", help="chaîne de connexion Postgres (défaut : $DATABASE_URL)")
+    parser.add_argument("--status", action="store_true", help="afficher les migrations appliquées / en attente")
+    parser.add_argument("--dry-run", action="store_true", help="lister les migrations à appliquer sans rien changer")
+    parser.add_argument("--check-plans", action="store_true", help="vérifier que les requêtes fréquentes utilisent leurs index")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    url = args.database_url or os.getenv("DATABASE_URL")
+    if not url:
+        print("❌ DATABASE_URL manquant (Supabase : Settings → Database → Connection string)", file=sys.stderr)
+        return 2
+    with _connect(url) as conn:
+        conn.autocommit = True
+        if args.status:
+            status(conn)
+            return 0
+        if args.check_plans:
+            problems = check_plans(conn)
+            for problem in problems:
+                print(f"❌ {problem}")
+            return 1 if problems else 0
+        done = migrate(conn, dry_run=args.dry_run)
+        if not args.dry_run:
+            print(f"✅ {len(done)} migration(s) appliquée(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""Migration des anciennes clés de réponses vers les clés canoniques (answer_keys.py).
+
+Parcourt `exams_streamlit` puis `exam_results` par lots (pagination sur l'id) et
+réécrit `student_responses` des seules lignes qui ont encore d'anciennes clés
+d'association (`lang_match_{position}_0`, `lang_{ex}_0`). Une ligne qui a des clés de
+cette forme est comparée à son examen (modèle en cache) pour les départager des
+questions de langue.
+Le dernier id traité de chaque table est enregistré dans le fichier de reprise :
+relancer la même commande après une interruption reprend là où elle s'était arrêtée,
+et une ligne déjà migrée n'est jamais réécrite. Les pages lisent les lignes pas encore
+atteintes avec la même règle (`canonical_answers`).
+
+Un examen peut être en cours de composition : sa ligne n'est réécrite que si ses
+réponses n'ont pas changé depuis la lecture. Sinon l'app vient de l'enregistrer, déjà
+avec les clés canoniques, et la ligne est seulement comptée. Les copies `lang_{ex}_0`
+qu'une soumission ajoute pour n8n (`workflow_answers`) sont laissées en place.
+
+    python migrate_answer_keys.py --dry-run
+    python migrate_answer_keys.py --batch-size 500 --checkpoint answer_keys.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+from dotenv import load_dotenv
+from postgrest.types import ReturnMethod
+from supabase import create_client
+
+from answer_keys import canonical_answers, has_legacy_keys, workflow_answers
+from exam_repository import EXAMS_TABLE, RESULTS_TABLE, ExamRepository
+from storage_codec import decode, encode
+
+# Only the answers are read while scanning; exam bodies are loaded for the rows to rewrite
+SCAN_COLUMNS = {EXAMS_TABLE: "id, student_responses", RESULTS_TABLE: "id, exam_id, student_responses"}
+
+
+def load_cursors(path):
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def save_cursors(path, cursors):
+    if path:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cursors, f, indent=1)
+        os.replace(tmp, path)
+
+
+def migrate_table(supabase, repo, table, batch_size=500, after=None, dry_run=False, pause=0.0, on_batch=None):
+    """Rewrite the legacy keys of `table` from id `after` on; returns counters (scanned, legacy, rewritten, changed)."""
+    stats = Counter()
+    while True:
+        query = supabase.table(table).select(SCAN_COLUMNS[table]).order("id").limit(batch_size)
+        if after:
+            query = query.gt("id", after)
+        rows = query.execute().data or []
+        if not rows:
+            return stats
+        for row in rows:
+            stats["scanned"] += 1
+            stored = row.get("student_responses")
+            answers = decode(stored)
+            if not has_legacy_keys(answers):
+                continue
+            exam_id = row["id"] if table == EXAMS_TABLE else row.get("exam_id")
+            exam = repo.get_exam_content(exam_id) if exam_id else None
+            migrated = canonical_answers(answers, exam)
+            # Submitted rows keep the copies n8n reads (answer_keys.workflow_answers)
+            if migrated is answers or workflow_answers(migrated, exam) == answers:
+                continue
+            stats["legacy"] += 1
+            if dry_run:
+                continue
+            update = supabase.table(table).update({"student_responses": encode(migrated, "student_responses")},
+                                                  count="exact", returning=ReturnMethod.minimal).eq("id", row["id"])
+            if table == EXAMS_TABLE:
+                # Compare-and-set: PostgREST casts the JSON text to jsonb, so a save made meanwhile wins
+                update = update.eq("student_responses", json.dumps(stored))
+            res = update.execute()
+            stats["changed" if getattr(res, "count", None) == 0 else "rewritten"] += 1
+        after = rows[-1]["id"]
+        if on_batch:
+            on_batch(after, stats)
+        if pause:
+            time.sleep(pause)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Réécrire les anciennes clés d'association (lang_match_{position}_0, lang_{ex}_0) en clés canoniques.")
+    parser.add_argument("--batch-size", type=int, default=500, help="lignes lues par requête (défaut: 500)")
+    parser.add_argument("--pause", type=float, default=0.2, help="pause entre deux lots en secondes")
+    parser.add_argument("--checkpoint", default="answer_keys_checkpoint.json",
+                        help="fichier de reprise (dernier id traité par table)")
+    parser.add_argument("--restart", action="store_true", help="ignorer le fichier de reprise et tout relire")
+    parser.add_argument("--dry-run", action="store_true", help="compter les lignes à réécrire sans rien modifier")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    supabase_url, supabase_key = os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY")
+    if not supabase_url or not supabase_key:
+        print("❌ SUPABASE_URL ou SUPABASE_KEY manquants. Vérifiez le fichier .env", file=sys.stderr)
+        return 2
+    supabase = create_client(supabase_url, supabase_key)
+    repo = ExamRepository(supabase)
+
+    # A dry run reads everything and never moves the cursors
+    cursors = {} if args.restart or args.dry_run else load_cursors(args.checkpoint)
+    for table in (EXAMS_TABLE, RESULTS_TABLE):
+        if cursors.get(table) == "done":
+            print(f"✅ {table} : déjà migrée (--restart pour relire)")
+            continue
+        started = time.perf_counter()
+
+        def on_batch(last_id, stats, table=table):
+            if not args.dry_run:
+                cursors[table] = last_id
+                save_cursors(args.checkpoint, cursors)
+            print(f"  {table} : {stats['scanned']} lues, {stats['legacy']} avec anciennes clés, {stats['rewritten']} réécrites")
+
+        stats = migrate_table(supabase, repo, table, args.batch_size, cursors.get(table), args.dry_run, args.pause, on_batch)
+        if not args.dry_run:
+            cursors[table] = "done"
+            save_cursors(args.checkpoint, cursors)
+        print(f"{'🔍' if args.dry_run else '✅'} {table} : {stats['legacy']} lignes avec anciennes clés sur {stats['scanned']} lues, "
+              f"{stats['rewritten']} réécrites, {stats['changed']} modifiées entre-temps ({time.perf_counter() - started:.1f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
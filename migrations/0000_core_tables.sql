@@ -0,0 +1,32 @@
+-- Tables used by the apps and by the n8n workflows. Existing projects created them
+-- by hand in the Supabase dashboard: `if not exists` makes this a no-op there, and
+-- a fresh database (local Postgres, CI, new project) gets the same schema.
+
+create extension if not exists pgcrypto;
+
+create table if not exists exams_streamlit (
+    id                uuid primary key default gen_random_uuid(),
+    student_id        text not null,
+    exam_content      jsonb,
+    student_responses jsonb,
+    status            text not null default 'pending',   -- pending, ready, submitted, resubmitted
+    created_at        timestamptz not null default now()
+);
+
+create table if not exists exam_results (
+    id                  uuid primary key default gen_random_uuid(),
+    exam_id             uuid not null,
+    student_id          text not null,
+    score_total         numeric,
+    max_score           numeric,
+    feedback_general    text,
+    detailed_correction jsonb,
+    student_responses   jsonb,
+    created_at          timestamptz not null default now()
+);
+
+create table if not exists access_codes (
+    code       text primary key,
+    active     boolean not null default true,
+    created_at timestamptz not null default now()
+);
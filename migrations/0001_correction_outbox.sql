@@ -0,0 +1,82 @@
+-- Transactional outbox for correction requests.
+-- The status change of the exam and the outbox record are written by the same
+-- function call, so a submitted exam always has a pending correction to deliver.
+
+create table if not exists correction_outbox (
+    id              bigserial primary key,
+    exam_id         uuid not null,
+    student_id      text not null,
+    action          text not null default 'start_correction',
+    payload         jsonb not null,
+    dedup_key       text not null unique,
+    status          text not null default 'pending',   -- pending, delivering, delivered, dead
+    attempts        integer not null default 0,
+    next_attempt_at timestamptz not null default now(),
+    last_error      text,
+    created_at      timestamptz not null default now(),
+    delivered_at    timestamptz
+);
+
+create index if not exists correction_outbox_due_idx
+    on correction_outbox (next_attempt_at)
+    where status in ('pending', 'delivering');
+
+-- Update the exam row and enqueue its correction atomically.
+-- A second call with the same dedup_key (double click, retried request) is a no-op
+-- and returns the id of the existing record.
+create or replace function submit_exam_for_correction(
+    p_exam_id uuid,
+    p_student_id text,
+    p_student_responses jsonb,
+    p_status text,
+    p_payload jsonb,
+    p_dedup_key text
+) returns bigint
+language plpgsql
+as $$
+declare
+    v_id bigint;
+begin
+    update exams_streamlit
+       set student_responses = p_student_responses,
+           status = p_status
+     where id = p_exam_id;
+
+    insert into correction_outbox (exam_id, student_id, payload, dedup_key)
+    values (p_exam_id, p_student_id, p_payload, p_dedup_key)
+    on conflict (dedup_key) do nothing
+    returning id into v_id;
+
+    if v_id is null then
+        select id into v_id from correction_outbox where dedup_key = p_dedup_key;
+    end if;
+    return v_id;
+end;
+$$;
+
+-- Claim due records for delivery. SKIP LOCKED lets several dispatchers (one per
+-- Streamlit replica) share the outbox; the lease makes records claimed by a
+-- crashed dispatcher due again once it expires.
+create or replace function claim_correction_outbox(
+    p_limit integer default 10,
+    p_lease_seconds integer default 60
+) returns setof correction_outbox
+language plpgsql
+as $$
+begin
+    return query
+    update correction_outbox o
+       set status = 'delivering',
+           attempts = o.attempts + 1,
+           next_attempt_at = now() + make_interval(secs => p_lease_seconds)
+     where o.id in (
+        select id from correction_outbox
+         where status in ('pending', 'delivering')
+           and next_attempt_at <= now()
+         order by next_attempt_at
+         limit p_limit
+         for update skip locked
+     )
+    returning o.*;
+end;
+$$;
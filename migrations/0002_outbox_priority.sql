@@ -0,0 +1,76 @@
+-- Priority classes for correction requests (see PRIORITY_CLASSES in work_queue.py).
+-- Claim order uses the same aging rule as the in-process scheduler: a request is
+-- due at created_at + head start of its class, so regrades and backfill get
+-- served after live final submissions but are never starved.
+
+alter table correction_outbox
+    add column if not exists priority text not null default 'first_correction';
+
+create or replace function correction_priority_offset(p_priority text) returns interval
+language sql immutable
+as $$
+    select make_interval(secs => case p_priority
+        when 'final_submit' then 0
+        when 'first_correction' then 30
+        when 'regrade' then 120
+        when 'backfill' then 300
+        else 30
+    end)
+$$;
+
+drop function if exists submit_exam_for_correction(uuid, text, jsonb, text, jsonb, text);
+
+create or replace function submit_exam_for_correction(
+    p_exam_id uuid,
+    p_student_id text,
+    p_student_responses jsonb,
+    p_status text,
+    p_payload jsonb,
+    p_dedup_key text,
+    p_priority text default 'first_correction'
+) returns bigint
+language plpgsql
+as $$
+declare
+    v_id bigint;
+begin
+    update exams_streamlit
+       set student_responses = p_student_responses,
+           status = p_status
+     where id = p_exam_id;
+
+    insert into correction_outbox (exam_id, student_id, payload, dedup_key, priority)
+    values (p_exam_id, p_student_id, p_payload, p_dedup_key, p_priority)
+    on conflict (dedup_key) do nothing
+    returning id into v_id;
+
+    if v_id is null then
+        select id into v_id from correction_outbox where dedup_key = p_dedup_key;
+    end if;
+    return v_id;
+end;
+$$;
+
+create or replace function claim_correction_outbox(
+    p_limit integer default 10,
+    p_lease_seconds integer default 60
+) returns setof correction_outbox
+language plpgsql
+as $$
+begin
+    return query
+    update correction_outbox o
+       set status = 'delivering',
+           attempts = o.attempts + 1,
+           next_attempt_at = now() + make_interval(secs => p_lease_seconds)
+     where o.id in (
+        select id from correction_outbox
+         where status in ('pending', 'delivering')
+           and next_attempt_at <= now()
+         order by greatest(created_at + correction_priority_offset(priority), next_attempt_at)
+         limit p_limit
+         for update skip locked
+     )
+    returning o.*;
+end;
+$$;
@@ -0,0 +1,23 @@
+-- Trace spans per user action (generate, submit, resubmit), keyed by exam_id.
+-- The app and the outbox dispatcher write their own stages (see tracing.py);
+-- n8n receives `trace.trace_id` in the webhook payload and the `traceparent`
+-- header, and may insert its own spans (e.g. stage 'llm') with the same trace_id.
+
+create table if not exists exam_traces (
+    id bigserial primary key,
+    trace_id text not null,
+    exam_id uuid,
+    action text not null,
+    stage text not null,
+    started_at timestamptz not null,
+    ended_at timestamptz not null,
+    attrs jsonb not null default '{}'::jsonb,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists exam_traces_exam_idx on exam_traces (exam_id, started_at);
+create index if not exists exam_traces_trace_idx on exam_traces (trace_id);
+
+-- n8n copies trace.trace_id from the payload so a result row points to its trace
+alter table exam_results
+    add column if not exists trace_id text;
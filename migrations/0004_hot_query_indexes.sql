@@ -0,0 +1,25 @@
+-- Composite indexes matching the queries issued on every page (see exam_repository.py).
+-- Each one serves both the filter and the `order by created_at desc`, so the latest
+-- row is read straight from the index without a sort. `migrate.py --check-plans`
+-- verifies the planner actually uses them.
+
+-- list_exams, get_latest_exam_status: student_id = ? order by created_at desc
+create index if not exists exams_streamlit_student_created_idx
+    on exams_streamlit (student_id, created_at desc);
+
+-- get_latest_result_summary(student_id, exam_id): exam_id = ? and student_id = ? order by created_at desc limit 1
+-- (also serves delete_exam: exam_id = ?)
+create index if not exists exam_results_exam_student_created_idx
+    on exam_results (exam_id, student_id, created_at desc);
+
+-- get_latest_result_summary(student_id): results page fallback without an exam id
+create index if not exists exam_results_student_created_idx
+    on exam_results (student_id, created_at desc);
+
+-- access_code_is_active: code = ? and active (index-only scan)
+create index if not exists access_codes_code_active_idx
+    on access_codes (code, active);
+
+-- get_outbox_status: exam_id = ? order by created_at desc limit 1
+create index if not exists correction_outbox_exam_created_idx
+    on correction_outbox (exam_id, created_at desc);
@@ -0,0 +1,71 @@
+-- Content-addressed exam bodies. A class sitting the same exam shares one
+-- `exam_templates` row; `exams_streamlit` keeps only per-student state
+-- (student_responses, status, created_at) and the template hash.
+--
+-- The trigger moves any exam_content written to exams_streamlit (by the app or by
+-- the n8n generation workflow) into exam_templates, keyed by the sha256 of its
+-- canonical jsonb text. Rows written before this migration keep their inline
+-- exam_content until `select backfill_exam_templates(1000);` is run (repeat until 0).
+-- Readers that need the body (n8n correction workflow) use exams_streamlit_full.
+
+create table if not exists exam_templates (
+    hash       text primary key,
+    content    jsonb not null,
+    created_at timestamptz not null default now()
+);
+
+alter table exams_streamlit
+    add column if not exists template_hash text references exam_templates (hash);
+
+create index if not exists exams_streamlit_template_idx on exams_streamlit (template_hash);
+
+create or replace function exams_streamlit_use_template() returns trigger
+language plpgsql
+as $$
+declare
+    v_hash text;
+begin
+    if new.exam_content is null then
+        return new;
+    end if;
+    v_hash := encode(sha256(convert_to(new.exam_content::text, 'UTF8')), 'hex');
+    insert into exam_templates (hash, content)
+    values (v_hash, new.exam_content)
+    on conflict (hash) do nothing;
+    new.template_hash := v_hash;
+    new.exam_content := null;
+    return new;
+end;
+$$;
+
+drop trigger if exists exams_streamlit_use_template on exams_streamlit;
+create trigger exams_streamlit_use_template
+    before insert or update of exam_content on exams_streamlit
+    for each row execute function exams_streamlit_use_template();
+
+-- Move inline bodies of older rows to templates, p_limit rows per call (short locks).
+create or replace function backfill_exam_templates(p_limit integer default 1000) returns integer
+language plpgsql
+as $$
+declare
+    v_count integer;
+begin
+    update exams_streamlit
+       set exam_content = exam_content
+     where id in (
+        select id from exams_streamlit
+         where exam_content is not null
+         limit p_limit
+         for update skip locked
+     );
+    get diagnostics v_count = row_count;
+    return v_count;
+end;
+$$;
+
+-- Exam rows with their body, for readers that cannot follow template_hash.
+create or replace view exams_streamlit_full as
+select e.id, e.student_id, e.status, e.student_responses, e.created_at, e.template_hash,
+       coalesce(e.exam_content, t.content) as exam_content
+  from exams_streamlit e
+  left join exam_templates t on t.hash = e.template_hash;
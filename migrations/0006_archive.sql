@@ -0,0 +1,60 @@
+-- Hot/cold split: exams older than the retention window move, with their results,
+-- to *_archive tables that the dashboard only reads on demand ("Afficher les
+-- examens archivés"). The hot tables stay small for list queries and deletes.
+--
+-- Archive tables copy the hot columns and indexes (`like`), plus archived_at.
+-- Their JSON columns use lz4 TOAST compression (Postgres 14+): cold rows are
+-- written once and rarely read. Exam bodies stay in exam_templates, shared with hot rows.
+-- A later migration that adds a column to a hot table must add it to its archive too.
+
+create table if not exists exams_streamlit_archive (like exams_streamlit including defaults including indexes);
+alter table exams_streamlit_archive add column if not exists archived_at timestamptz not null default now();
+alter table exams_streamlit_archive alter column exam_content set compression lz4;
+alter table exams_streamlit_archive alter column student_responses set compression lz4;
+
+create table if not exists exam_results_archive (like exam_results including defaults including indexes);
+alter table exam_results_archive add column if not exists archived_at timestamptz not null default now();
+alter table exam_results_archive alter column detailed_correction set compression lz4;
+alter table exam_results_archive alter column student_responses set compression lz4;
+
+-- Move one batch of exams created before now() - p_older_than, with their results,
+-- in a single transaction. Rows locked by a student session are skipped (picked up
+-- by a later batch) and lock_timeout bounds the wait, so each call holds its locks
+-- for one small batch only. Returns the number of exams moved; archive_exams.py
+-- calls it until it returns 0.
+create or replace function archive_old_exams(
+    p_older_than interval default interval '180 days',
+    p_limit integer default 200
+) returns integer
+language plpgsql
+as $$
+declare
+    v_ids uuid[];
+    v_count integer;
+begin
+    perform set_config('lock_timeout', '2s', true);
+
+    select array_agg(id) into v_ids from (
+        select id from exams_streamlit
+         where created_at < now() - p_older_than
+         order by created_at
+         limit p_limit
+         for update skip locked
+    ) batch;
+    if v_ids is null then
+        return 0;
+    end if;
+
+    with moved as (
+        delete from exam_results where exam_id = any (v_ids) returning *
+    )
+    insert into exam_results_archive select moved.*, now() from moved;
+
+    with moved as (
+        delete from exams_streamlit where id = any (v_ids) returning *
+    )
+    insert into exams_streamlit_archive select moved.*, now() from moved;
+    get diagnostics v_count = row_count;
+    return v_count;
+end;
+$$;
@@ -0,0 +1,51 @@
+-- Exam timer: the first opening of an exam records started_at; the deadline shown
+-- by the countdown (exam_timer.py) is started_at + EXAM_DURATION_MINUTES, so it is
+-- the same on every replica and survives a new login.
+
+alter table exams_streamlit add column if not exists started_at timestamptz;
+alter table exams_streamlit_archive add column if not exists started_at timestamptz;
+
+-- The archive tables now end with archived_at, started_at while the hot tables end
+-- with started_at: copy rows by column name instead of by position.
+create or replace function archive_old_exams(
+    p_older_than interval default interval '180 days',
+    p_limit integer default 200
+) returns integer
+language plpgsql
+as $$
+declare
+    v_ids uuid[];
+    v_count integer;
+begin
+    perform set_config('lock_timeout', '2s', true);
+
+    select array_agg(id) into v_ids from (
+        select id from exams_streamlit
+         where created_at < now() - p_older_than
+         order by created_at
+         limit p_limit
+         for update skip locked
+    ) batch;
+    if v_ids is null then
+        return 0;
+    end if;
+
+    with moved as (
+        delete from exam_results where exam_id = any (v_ids) returning *
+    )
+    insert into exam_results_archive
+    select (jsonb_populate_record(null::exam_results_archive,
+                                  to_jsonb(moved) || jsonb_build_object('archived_at', now()))).*
+      from moved;
+
+    with moved as (
+        delete from exams_streamlit where id = any (v_ids) returning *
+    )
+    insert into exams_streamlit_archive
+    select (jsonb_populate_record(null::exams_streamlit_archive,
+                                  to_jsonb(moved) || jsonb_build_object('archived_at', now()))).*
+      from moved;
+    get diagnostics v_count = row_count;
+    return v_count;
+end;
+$$;
@@ -0,0 +1,19 @@
+-- Answer history: one row per save of an exam's answers (answer_history.py).
+-- `changes` maps each modified answer key to a text splice [start, removed, inserted]
+-- ({"value": v} for non-text values, null for a removed key); every
+-- ANSWER_CHECKPOINT_EVERY versions, kind = 'checkpoint' and `changes` holds all the
+-- answers. Rows are only ever inserted: undo and "restore version" append a new one.
+-- The primary key makes concurrent writers of the same version fail instead of forking.
+-- Archiving an exam (archive_old_exams) drops its history with it: archived exams are read-only.
+
+create table if not exists answer_log (
+    exam_id    uuid not null references exams_streamlit (id) on delete cascade,
+    seq        integer not null,
+    kind       text not null check (kind in ('delta', 'checkpoint')),
+    changes    jsonb not null,
+    created_at timestamptz not null default now(),
+    primary key (exam_id, seq)
+);
+
+-- Nearest checkpoint at or before a version
+create index if not exists answer_log_checkpoint_idx on answer_log (exam_id, seq desc) where kind = 'checkpoint';
@@ -0,0 +1,44 @@
+-- Deduplicate correction requests only while they are live.
+-- The unique constraint on dedup_key covered the whole life of the table: once a
+-- request was delivered or dead, the same answers could never be sent again and
+-- « 🔁 Relancer la correction » enqueued nothing. Now a double click or a retried
+-- call still collapses onto the pending / delivering record, and a new request is
+-- accepted as soon as the previous one is finished.
+
+alter table correction_outbox drop constraint if exists correction_outbox_dedup_key_key;
+
+create unique index if not exists correction_outbox_live_dedup_idx
+    on correction_outbox (dedup_key)
+    where status in ('pending', 'delivering');
+
+create or replace function submit_exam_for_correction(
+    p_exam_id uuid,
+    p_student_id text,
+    p_student_responses jsonb,
+    p_status text,
+    p_payload jsonb,
+    p_dedup_key text,
+    p_priority text default 'first_correction'
+) returns bigint
+language plpgsql
+as $$
+declare
+    v_id bigint;
+begin
+    update exams_streamlit
+       set student_responses = p_student_responses,
+           status = p_status
+     where id = p_exam_id;
+
+    insert into correction_outbox (exam_id, student_id, payload, dedup_key, priority)
+    values (p_exam_id, p_student_id, p_payload, p_dedup_key, p_priority)
+    on conflict (dedup_key) where status in ('pending', 'delivering') do nothing
+    returning id into v_id;
+
+    if v_id is null then
+        select id into v_id from correction_outbox
+         where dedup_key = p_dedup_key and status in ('pending', 'delivering');
+    end if;
+    return v_id;
+end;
+$$;
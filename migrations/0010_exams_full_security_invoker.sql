@@ -0,0 +1,7 @@
+-- exams_streamlit_full must not bypass row level security.
+-- A view runs with the privileges of its owner by default: on Supabase, any
+-- client holding the anon key could read every student's exam and answers
+-- through it, whatever the policies on exams_streamlit and exam_templates.
+-- With security_invoker (Postgres 15+), the caller's policies apply.
+
+alter view exams_streamlit_full set (security_invoker = true);
@@ -0,0 +1,47 @@
+-- When were the current answers sent for correction? The status stays 'submitted'
+-- after n8n writes the result, so batch_correct.py tells a corrected copy from a
+-- pending one by comparing its newest exam_results row with submitted_at.
+-- Rows submitted before this migration keep a null submitted_at: any result counts.
+
+alter table exams_streamlit add column if not exists submitted_at timestamptz;
+alter table exams_streamlit_archive add column if not exists submitted_at timestamptz;
+
+create or replace view exams_streamlit_full with (security_invoker = true) as
+select e.id, e.student_id, e.status, e.student_responses, e.created_at, e.template_hash,
+       coalesce(e.exam_content, t.content) as exam_content,
+       e.submitted_at
+  from exams_streamlit e
+  left join exam_templates t on t.hash = e.template_hash;
+
+create or replace function submit_exam_for_correction(
+    p_exam_id uuid,
+    p_student_id text,
+    p_student_responses jsonb,
+    p_status text,
+    p_payload jsonb,
+    p_dedup_key text,
+    p_priority text default 'first_correction'
+) returns bigint
+language plpgsql
+as $$
+declare
+    v_id bigint;
+begin
+    update exams_streamlit
+       set student_responses = p_student_responses,
+           status = p_status,
+           submitted_at = now()
+     where id = p_exam_id;
+
+    insert into correction_outbox (exam_id, student_id, payload, dedup_key, priority)
+    values (p_exam_id, p_student_id, p_payload, p_dedup_key, p_priority)
+    on conflict (dedup_key) where status in ('pending', 'delivering') do nothing
+    returning id into v_id;
+
+    if v_id is null then
+        select id into v_id from correction_outbox
+         where dedup_key = p_dedup_key and status in ('pending', 'delivering');
+    end if;
+    return v_id;
+end;
+$$;
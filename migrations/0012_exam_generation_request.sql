@@ -0,0 +1,13 @@
+-- One exam per generation request, whatever process saves it.
+-- The generation queue (work_queue.py) only deduplicates inside one process: two
+-- sessions sharing a ticket, or two replicas, could each insert the generated exam.
+-- Each "🚀 Générer" click now carries a generation_request_id; saving the exam is an
+-- insert ... on conflict (student_id, generation_request_id) do nothing, so every
+-- writer after the first gets the existing row back. Rows written before this
+-- migration (or by a workflow that does not send the id) keep null, never in conflict.
+
+alter table exams_streamlit add column if not exists generation_request_id uuid;
+alter table exams_streamlit_archive add column if not exists generation_request_id uuid;
+
+create unique index if not exists exams_streamlit_generation_request_idx
+    on exams_streamlit (student_id, generation_request_id);
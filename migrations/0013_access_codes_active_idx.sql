@@ -0,0 +1,9 @@
+-- Access codes are now loaded all at once (auth.py: select code where active), not
+-- looked up one by one: (code, active) no longer matches any query. A partial index
+-- on the active codes serves the load as an index-only scan.
+
+drop index if exists access_codes_code_active_idx;
+
+create index if not exists access_codes_active_idx
+    on access_codes (code)
+    where active;
@@ -0,0 +1,79 @@
+"""Lectures indépendantes d'une page lancées en parallèle.
+
+Ouvrir un examen ou une page de résultats demande plusieurs lectures Supabase qui ne
+dépendent pas les unes des autres (liste des examens, ligne de l'examen, dernier
+résultat, contenu de l'examen). Faites l'une après l'autre, la page attend la somme
+des allers-retours ; `fetch_all` les lance ensemble sur un pool de threads partagé
+par le processus et la page n'attend plus que la plus lente.
+
+Chaque lecture a son délai (`PAGE_QUERY_TIMEOUT` par défaut). Une lecture en erreur
+ou hors délai reçoit la valeur par défaut et est signalée dans `errors` : la page
+s'affiche avec le reste, et décide elle-même quoi montrer pour la partie manquante.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from metrics import REGISTRY, bind_rerun
+
+logger = logging.getLogger(__name__)
+
+PAGE_QUERY_TIMEOUT = float(os.getenv("PAGE_QUERY_TIMEOUT", "5"))
+PAGE_QUERY_WORKERS = int(os.getenv("PAGE_QUERY_WORKERS", "16"))
+
+
+class PageData(dict):
+    """Results by name; `errors` maps the reads that failed or timed out to their exception."""
+
+    def __init__(self):
+        super().__init__()
+        self.errors = {}
+
+    def raise_for(self, name):
+        """Re-raise the error of `name` in the script thread (to reuse an existing except branch)."""
+        if name in self.errors:
+            raise self.errors[name]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PAGE_QUERY_WORKERS, thread_name_prefix="page-query")
+        return _executor
+
+
+def fetch_all(calls, timeout=PAGE_QUERY_TIMEOUT, timeouts=None, default=None):
+    """Run `{name: callable}` concurrently and return a PageData once all are done or timed out.
+
+    The callables must not touch `st.*`: read ids from the session before, pass them in
+    (functools.partial). `timeouts` overrides `timeout` per name.
+    """
+    started = time.monotonic()
+    executor = get_executor()
+    futures = {name: executor.submit(bind_rerun(fn)) for name, fn in calls.items()}
+    page = PageData()
+    for name, future in futures.items():
+        limit = (timeouts or {}).get(name, timeout)
+        try:
+            page[name] = future.result(timeout=max(0.0, started + limit - time.monotonic()))
+        except FutureTimeout:
+            # The request keeps running in its thread; its result is dropped
+            future.cancel()
+            page[name] = default
+            page.errors[name] = TimeoutError(f"{name} : pas de réponse après {limit:g} s")
+            REGISTRY.inc("page_query_errors_total", query=name, reason="timeout")
+        except Exception as e:
+            page[name] = default
+            page.errors[name] = e
+            REGISTRY.inc("page_query_errors_total", query=name, reason="error")
+        if name in page.errors:
+            logger.warning("page_loader: %s: %s", name, page.errors[name])
+    return page
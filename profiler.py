@@ -0,0 +1,176 @@
+"""Profilage opt-in des reruns Streamlit (échantillonnage de la pile du script).
+
+Désactivé par défaut : le seul coût est un test par rerun. Activation :
+
+- pour une session : mode opérateur + `?profile=1` dans l'URL (`?profile=0` pour arrêter) ;
+- pour toutes les sessions (dev, test de charge) : `PROFILE_ALL=1`.
+
+Pendant un rerun profilé, un thread relève la pile du thread du script toutes
+les `PROFILE_INTERVAL_MS` millisecondes. Chaque rerun produit un fichier de piles
+repliées (`PROFILE_DIR/<session>-<horodatage>.folded`, format `a;b;c N`) lisible
+par flamegraph.pl, inferno ou speedscope, et les fonctions / lignes les plus
+coûteuses apparaissent dans le panneau opérateur.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from metrics import current_session_id, is_operator, on_rerun_end
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ALL = os.getenv("PROFILE_ALL", "").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "15"))
+# A rerun that never reports its end (e.g. Streamlit internals changed) stops being sampled after this
+PROFILE_MAX_SECONDS = 300
+
+_last_profiles = {}
+_last_profiles_lock = threading.Lock()
+
+
+def _label(frame):
+    code = frame.f_code
+    name = os.path.basename(code.co_filename)
+    if code.co_name == "<module>":
+        # The apps are mostly module-level code: the line number is the useful part
+        return f"{name}:{frame.f_lineno}"
+    return f"{name}:{code.co_name}"
+
+
+class RerunSampler(threading.Thread):
+    """Samples the stack of one script thread until `finish` is called."""
+
+    def __init__(self, thread_id, app, interval=PROFILE_INTERVAL):
+        super().__init__(name="rerun-profiler", daemon=True)
+        self.thread_id, self.app, self.interval = thread_id, app, interval
+        self.stacks = Counter()
+        self.leaves = Counter()
+        self.samples = 0
+        self.started = time.perf_counter()
+        self._stopping = threading.Event()
+
+    def run(self):
+        deadline = self.started + PROFILE_MAX_SECONDS
+        while not self._stopping.wait(self.interval) and time.perf_counter() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            self._sample(frame)
+
+    def _sample(self, frame):
+        leaf = f"{_label(frame)}:{frame.f_lineno}" if frame.f_code.co_name != "<module>" else _label(frame)
+        stack = []
+        while frame is not None:
+            stack.append(frame)
+            frame = frame.f_back
+        stack.reverse()
+        # Drop the Streamlit runner frames above the app script
+        start = next((i for i, f in enumerate(stack) if os.path.basename(f.f_code.co_filename) == self.app), 0)
+        self.stacks[";".join(_label(f) for f in stack[start:])] += 1
+        self.leaves[leaf] += 1
+        self.samples += 1
+
+    def finish(self, outcome):
+        self._stopping.set()
+        self.join(timeout=1)
+        return {
+            "app": self.app,
+            "outcome": outcome,
+            "duration": time.perf_counter() - self.started,
+            "samples": self.samples,
+            "interval": self.interval,
+            "stacks": self.stacks,
+            "leaves": self.leaves,
+        }
+
+
+def _wants_profile():
+    import streamlit as st
+
+    flag = st.query_params.get("profile")
+    if flag is not None and is_operator():
+        st.session_state.profiling = flag not in ("0", "false", "")
+    return PROFILE_ALL or st.session_state.get("profiling", False)
+
+
+def profile_rerun(app):
+    """Call at the top of the script, after metrics.track_rerun(): samples this run if profiling is on."""
+    if not _wants_profile():
+        return None
+    sampler = RerunSampler(threading.get_ident(), app)
+    session_id = current_session_id() or "local"
+    if not on_rerun_end(lambda outcome: _store(session_id, sampler.finish(outcome))):
+        return None
+    sampler.start()
+    return sampler
+
+
+def _store(session_id, profile):
+    with _last_profiles_lock:
+        _last_profiles[session_id] = profile
+        # Keep memory bounded: only the most recent sessions
+        while len(_last_profiles) > 100:
+            del _last_profiles[next(iter(_last_profiles))]
+    try:
+        write_folded(profile, session_id)
+    except OSError as e:
+        logger.warning("profiler: écriture impossible dans %s: %s", PROFILE_DIR, e)
+
+
+def write_folded(profile, session_id):
+    """Write the collapsed stacks of one rerun; returns the file path."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    prefix = "".join(c for c in session_id if c.isalnum())[:8] or "session"
+    path = os.path.join(PROFILE_DIR, f"{prefix}-{stamp}.folded")
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in profile["stacks"].most_common():
+            f.write(f"{stack} {count}\n")
+    profile["path"] = path
+    return path
+
+
+def hotspots(profile, top=PROFILE_TOP):
+    """Top self (innermost line) and inclusive (anywhere on the stack) frames, in milliseconds."""
+    # Samples are spread over the measured run time (the real period drifts above the interval)
+    ms = profile["duration"] * 1000 / max(profile["samples"], 1)
+    inclusive = Counter()
+    for stack, count in profile["stacks"].items():
+        for label in set(stack.split(";")):
+            inclusive[label] += count
+    return {
+        "self": [{"ligne": label, "ms": round(n * ms), "%": round(100 * n / profile["samples"], 1)}
+                 for label, n in profile["leaves"].most_common(top)],
+        "inclusive": [{"fonction": label, "ms": round(n * ms), "%": round(100 * n / profile["samples"], 1)}
+                      for label, n in inclusive.most_common(top)],
+    }
+
+
+def operator_profile_panel():
+    """Hotspots of this session's last profiled rerun, in the sidebar (operators only)."""
+    import streamlit as st
+
+    if not is_operator():
+        return
+    with st.sidebar.expander("🔬 Profilage", expanded=False):
+        if not (PROFILE_ALL or st.session_state.get("profiling")):
+            st.caption("Inactif. Ajoutez `?profile=1` à l'URL pour profiler cette session.")
+            return
+        with _last_profiles_lock:
+            profile = _last_profiles.get(current_session_id() or "local")
+        if not profile or not profile["samples"]:
+            st.caption("Aucun rerun profilé pour l'instant.")
+            return
+        st.caption(f"Dernier rerun : {profile['duration']:.2f} s, {profile['samples']} échantillons "
+                   f"({profile['outcome']}) • {profile.get('path', '')}")
+        spots = hotspots(profile)
+        st.markdown("**Lignes (temps propre)**")
+        st.dataframe(spots["self"], hide_index=True)
+        st.markdown("**Fonctions (temps inclus)**")
+        st.dataframe(spots["inclusive"], hide_index=True)
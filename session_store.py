@@ -0,0 +1,311 @@
+"""État de travail des sessions hors du processus Streamlit.
+
+`st.session_state` vit dans la mémoire d'un processus : sans stockage externe, il
+faut des sessions collantes et un redémarrage en plein examen perd les réponses.
+`sync_session` copie à chaque rerun le petit état de travail de l'étudiant
+(examen en cours, réponses saisies, attente de correction) dans un magasin
+clé/valeur, sous l'identifiant de session du jeton signé (auth.py). Une autre
+réplique, ou le même processus après un redémarrage, le restaure au premier rerun.
+
+La session ne garde que les ids de l'examen et du résultat affichés (`show_exam`,
+`show_result`) : les corps sont lus par `current_exam` / `current_result` dans le
+cache partagé de exam_repository.py, ou rechargés depuis Supabase s'il les a évincés.
+
+`SESSION_STORE` choisit le magasin :
+
+    memory                      (défaut) dans le processus, comme avant
+    sqlite:///chemin/sessions.db  un fichier partagé par les processus d'une machine (tests, dev)
+    redis://host:6379/0         Redis ou compatible (Valkey, KeyDB...), pour plusieurs répliques
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_STORE_TTL = float(os.getenv("SESSION_STORE_TTL_HOURS", "24")) * 3600
+KEY_PREFIX = "examaroc:session:"
+# Session ids revoked at logout (auth.py), kept until their token would have expired anyway
+REVOKED_PREFIX = "examaroc:revoked:"
+
+# Small per-student state; exam bodies and corrections are reloaded from Supabase by id
+PERSISTED_KEYS = ("current_exam_id", "current_user", "current_exam_archived", "exam_ref", "result_ref", "exam_deadline",
+                  "exam_expired", "answer_versions", "waiting_for_correction", "correction_trace", "submitted_answers",
+                  "generation_request_id")
+ANSWER_PREFIXES = ("ans_", "lang_", "writing_", "comp_")
+
+
+class MemoryStore:
+    """Dict with expiry, per process."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                del self._data[key]
+                return None
+            return json.loads(item[1])
+
+    def set(self, key, value, ttl=SESSION_STORE_TTL):
+        raw = json.dumps(value, default=str)
+        with self._lock:
+            self._data[key] = (time.time() + ttl, raw)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SQLiteStore:
+    """Key/value table in a SQLite file (WAL), shared by the processes of one host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        with self._lock:
+            self._conn.execute("pragma journal_mode=wal")
+            self._conn.execute("create table if not exists kv (key text primary key, value text not null, expires_at real not null)")
+            self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("select value, expires_at from kv where key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=SESSION_STORE_TTL):
+        raw = json.dumps(value, default=str)
+        with self._lock:
+            self._conn.execute("insert into kv (key, value, expires_at) values (?, ?, ?) "
+                               "on conflict (key) do update set value = excluded.value, expires_at = excluded.expires_at",
+                               (key, raw, time.time() + ttl))
+            # Opportunistic cleanup, no background thread needed
+            self._conn.execute("delete from kv where expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("delete from kv where key = ?", (key,))
+            self._conn.commit()
+
+
+class RedisStore:
+    """Redis-compatible server; requires the `redis` package."""
+
+    def __init__(self, url):
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=2)
+
+    def get(self, key):
+        raw = self._client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=SESSION_STORE_TTL):
+        self._client.set(key, json.dumps(value, default=str), ex=int(ttl))
+
+    def delete(self, key):
+        self._client.delete(key)
+
+
+def create_store(spec):
+    if spec.startswith("sqlite:///"):
+        return SQLiteStore(spec[len("sqlite:///"):])
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(spec)
+    if spec not in ("", "memory"):
+        logger.warning("session_store: SESSION_STORE=%r inconnu, magasin en mémoire", spec)
+    return MemoryStore()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """Process-wide store selected by SESSION_STORE."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = create_store(SESSION_STORE)
+        return _store
+
+
+# --- HELPER: état de travail d'une session ---
+def working_set(state):
+    """The part of session_state worth keeping across replicas and restarts."""
+    snapshot = {k: state.get(k) for k in PERSISTED_KEYS if state.get(k) is not None}
+    snapshot["answers"] = {k: state[k] for k in state.keys()
+                           if isinstance(k, str) and k.startswith(ANSWER_PREFIXES)}
+    return snapshot
+
+
+def _restore(state, snapshot):
+    # First run of this session on this process: state only holds the app defaults
+    for k in PERSISTED_KEYS:
+        if k in snapshot:
+            state[k] = snapshot[k]
+    for k, v in snapshot.get("answers", {}).items():
+        state[k] = v
+
+
+def sync_session():
+    """Call once per rerun after login: restore the working set on a new replica, save it when it changed."""
+    import streamlit as st
+
+    from metrics import on_rerun_end
+
+    sid = st.session_state.get("session_sid")
+    if not sid:
+        return
+    store, key = get_session_store(), KEY_PREFIX + sid
+    try:
+        if not st.session_state.get("_working_set_restored"):
+            st.session_state["_working_set_restored"] = True
+            snapshot = store.get(key)
+            if snapshot:
+                _restore(st.session_state, snapshot)
+        _save(store, key)
+        # Also at the end of the run, to catch state set during it (exam opened, submission sent)
+        on_rerun_end(lambda outcome: _save(store, key))
+    except Exception as e:
+        # The app keeps working on the in-process state when the store is unreachable
+        logger.warning("session_store: synchronisation impossible: %s", e)
+
+
+def _save(store, key):
+    import streamlit as st
+
+    try:
+        snapshot = working_set(st.session_state)
+        digest = hashlib.sha1(json.dumps(snapshot, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        if digest != st.session_state.get("_working_set_digest"):
+            store.set(key, snapshot)
+            st.session_state["_working_set_digest"] = digest
+    except Exception as e:
+        logger.warning("session_store: enregistrement impossible: %s", e)
+
+
+# --- HELPER: examen et résultat affichés (ids seulement) ---
+def show_exam(exam_id):
+    """Open `exam_id`; its body stays in the repository cache, the session keeps the id."""
+    import streamlit as st
+
+    st.session_state.exam_ref = exam_id
+    st.session_state.pop("exam_unsaved", None)
+    st.session_state.pop("exam_expired", None)
+    st.session_state.pop("answer_versions", None)
+
+
+def show_unsaved_exam(content):
+    """A generated exam that could not be saved has no id: the session keeps this one body."""
+    import streamlit as st
+
+    st.session_state.exam_ref = None
+    st.session_state.exam_unsaved = content
+
+
+def show_result(result):
+    import streamlit as st
+
+    st.session_state.result_ref = result["id"] if result else None
+
+
+def close_exam():
+    import streamlit as st
+
+    st.session_state.exam_ref = None
+    st.session_state.result_ref = None
+    st.session_state.pop("exam_unsaved", None)
+    st.session_state.pop("exam_deadline", None)
+    st.session_state.pop("exam_expired", None)
+    st.session_state.pop("answer_versions", None)
+
+
+def current_exam_shown():
+    import streamlit as st
+
+    return bool(st.session_state.get("exam_ref") or st.session_state.get("exam_unsaved"))
+
+
+def current_exam(repo):
+    """Body of the open exam (a fresh copy), or None."""
+    import streamlit as st
+
+    exam_id = st.session_state.get("exam_ref")
+    if not exam_id:
+        return st.session_state.get("exam_unsaved")
+    return repo.get_exam_content(exam_id, archived=bool(st.session_state.get("current_exam_archived")))
+
+
+def current_result(repo):
+    """Result row shown on the results page (a fresh copy), or None."""
+    import streamlit as st
+
+    result_id = st.session_state.get("result_ref")
+    if not result_id:
+        return None
+    return repo.get_result_details(result_id, archived=bool(st.session_state.get("current_exam_archived")))
+
+
+def preload_current(repo, **extra):
+    """Read the open exam, the shown result and `extra` reads concurrently (page_loader.py).
+
+    The bodies land in the repository cache, so the `current_exam` / `current_result`
+    calls of the page are served from memory. Returns the PageData (extras by name).
+    """
+    import streamlit as st
+
+    from page_loader import PageData, fetch_all
+
+    archived = bool(st.session_state.get("current_exam_archived"))
+    calls = dict(extra)
+    if st.session_state.get("exam_ref"):
+        calls["exam"] = partial(repo.get_exam_content, st.session_state.exam_ref, archived=archived)
+    if st.session_state.get("result_ref"):
+        calls["result"] = partial(repo.get_result_details, st.session_state.result_ref, archived=archived)
+    return fetch_all(calls) if calls else PageData()
+
+
+def revoke_sid(sid, ttl):
+    """Refuse the tokens of session `sid` from now on, on every replica sharing the store."""
+    try:
+        get_session_store().set(REVOKED_PREFIX + sid, True, ttl=ttl)
+        return True
+    except Exception as e:
+        logger.warning("session_store: révocation impossible: %s", e)
+        return False
+
+
+def sid_revoked(sid):
+    """True if `sid` was revoked, or if the store cannot tell (the student then logs in again)."""
+    if not sid:
+        return False
+    try:
+        return bool(get_session_store().get(REVOKED_PREFIX + sid))
+    except Exception as e:
+        logger.warning("session_store: vérification de révocation impossible: %s", e)
+        return True
+
+
+def drop_session(sid):
+    """Forget the working set (logout)."""
+    if sid:
+        try:
+            get_session_store().delete(KEY_PREFIX + sid)
+        except Exception as e:
+            logger.warning("session_store: suppression impossible: %s", e)
@@ -0,0 +1,189 @@
+"""Compression optionnelle des gros JSON stockés dans Supabase.
+
+`exam_content`, `student_responses` et `detailed_correction` contiennent le texte
+de compréhension, les rédactions et les explications du correcteur : ce sont les
+colonnes qui pèsent dans chaque requête. Avec `STORAGE_CODEC=zstd`, l'accès aux
+données (exam_repository.py) les écrit sous forme d'enveloppe JSON :
+
+    {"$zstd": "<base64>", "dict": 1234567}
+
+compressée avec zstd et, si présent, un dictionnaire entraîné sur des examens
+(`python storage_codec.py train`). La lecture accepte toujours les lignes non
+compressées (anciennes lignes, écritures de n8n ou de `submit_exam_for_correction`) :
+activer ou désactiver le codec ne demande aucune migration des données.
+
+Seules les colonnes de `STORAGE_CODEC_COLUMNS` sont écrites compressées (défaut :
+`student_responses`). N'y ajouter `exam_content` que si les workflows n8n ne lisent
+pas cette colonne directement dans Supabase, ou savent décoder l'enveloppe.
+
+Les dictionnaires de `STORAGE_CODEC_DICTS` ne doivent jamais être supprimés tant
+que des lignes les utilisent : on en ajoute un nouveau, le plus récent sert à l'écriture.
+"""
+import argparse
+import base64
+import json
+import logging
+import os
+import sys
+import threading
+
+try:
+    import zstandard
+except ImportError:  # the codec is optional: without zstandard values are stored as plain JSON
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+STORAGE_CODEC = os.getenv("STORAGE_CODEC", "").lower()
+STORAGE_CODEC_LEVEL = int(os.getenv("STORAGE_CODEC_LEVEL", "9"))
+STORAGE_CODEC_DICTS = os.getenv("STORAGE_CODEC_DICTS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "codec_dicts"))
+# Below this size the envelope and base64 cost more than compression saves
+MIN_SIZE = 512
+MARKER = "$zstd"
+# Columns decoded on read (any of them may hold an envelope) / written compressed
+CODEC_COLUMNS = ("exam_content", "student_responses", "detailed_correction", "results", "content")
+WRITE_COLUMNS = {c.strip() for c in os.getenv("STORAGE_CODEC_COLUMNS", "student_responses").split(",") if c.strip()}
+
+
+class CodecError(Exception):
+    """A compressed value cannot be decoded (zstandard missing, unknown dictionary)."""
+
+
+_local = threading.local()
+_dicts = None
+_dicts_lock = threading.Lock()
+
+
+def _load_dicts():
+    """{dict_id: ZstdCompressionDict} from STORAGE_CODEC_DICTS, plus the id of the newest one."""
+    global _dicts
+    with _dicts_lock:
+        if _dicts is None:
+            found, newest = {}, None
+            if zstandard is not None and os.path.isdir(STORAGE_CODEC_DICTS):
+                for filename in sorted(os.listdir(STORAGE_CODEC_DICTS)):
+                    if filename.endswith(".dict"):
+                        with open(os.path.join(STORAGE_CODEC_DICTS, filename), "rb") as f:
+                            d = zstandard.ZstdCompressionDict(f.read())
+                        found[d.dict_id()] = d
+                        newest = d.dict_id()
+            _dicts = (found, newest)
+        return _dicts
+
+
+def _compressor():
+    # zstd contexts are not thread-safe: one per Streamlit script thread
+    comp = getattr(_local, "compressor", None)
+    if comp is None:
+        dicts, newest = _load_dicts()
+        comp = _local.compressor = (zstandard.ZstdCompressor(level=STORAGE_CODEC_LEVEL, dict_data=dicts.get(newest)), newest or 0)
+    return comp
+
+
+def _decompressor(dict_id):
+    cache = getattr(_local, "decompressors", None)
+    if cache is None:
+        cache = _local.decompressors = {}
+    if dict_id not in cache:
+        dicts, _ = _load_dicts()
+        if dict_id and dict_id not in dicts:
+            raise CodecError(f"dictionnaire zstd {dict_id} introuvable dans {STORAGE_CODEC_DICTS}")
+        cache[dict_id] = zstandard.ZstdDecompressor(dict_data=dicts.get(dict_id))
+    return cache[dict_id]
+
+
+def enabled():
+    return STORAGE_CODEC == "zstd" and zstandard is not None
+
+
+if STORAGE_CODEC == "zstd" and zstandard is None:
+    logger.warning("storage_codec: STORAGE_CODEC=zstd mais zstandard n'est pas installé, stockage en JSON brut")
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode(value, column):
+    """Value to store in `column`: an envelope when the codec is on for it and it pays off."""
+    if not enabled() or column not in WRITE_COLUMNS or value is None or is_encoded(value):
+        return value
+    raw = _dumps(value)
+    if len(raw) < MIN_SIZE:
+        return value
+    comp, dict_id = _compressor()
+    return {MARKER: base64.b64encode(comp.compress(raw)).decode("ascii"), "dict": dict_id}
+
+
+def is_encoded(value):
+    return isinstance(value, dict) and MARKER in value
+
+
+def decode(value):
+    """Inverse of `encode`; anything that is not an envelope is returned unchanged."""
+    if not is_encoded(value):
+        return value
+    if zstandard is None:
+        raise CodecError("valeur compressée mais zstandard n'est pas installé (pip install zstandard)")
+    raw = _decompressor(value.get("dict") or 0).decompress(base64.b64decode(value[MARKER]))
+    return json.loads(raw)
+
+
+def decode_row(row, columns=CODEC_COLUMNS):
+    """Decode the codec columns of a Supabase row in place; returns the row."""
+    if row:
+        for column in columns:
+            if column in row:
+                row[column] = decode(row[column])
+    return row
+
+
+# --- Entraînement du dictionnaire ---
+def train(samples, size=64 * 1024):
+    """Train a dictionary on JSON values (exams, answers, corrections)."""
+    return zstandard.train_dictionary(size, [_dumps(s) for s in samples])
+
+
+def _fetch_samples(limit):
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    load_dotenv()
+    supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    samples = []
+    for table, columns in (("exam_templates", "content"),
+                           ("exams_streamlit", "student_responses"),
+                           ("exam_results", "detailed_correction")):
+        rows = supabase.table(table).select(columns).order("created_at", desc=True).limit(limit).execute().data or []
+        for row in rows:
+            samples += [v for v in decode_row(row).values() if v]
+    return samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Entraîner un dictionnaire zstd sur les examens de Supabase.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_train = sub.add_parser("train", help="entraîner et écrire un nouveau dictionnaire dans STORAGE_CODEC_DICTS")
+    p_train.add_argument("--limit", type=int, default=500, help="lignes lues par table (défaut: 500)")
+    p_train.add_argument("--size", type=int, default=64 * 1024, help="taille du dictionnaire en octets")
+    args = parser.parse_args(argv)
+
+    if zstandard is None:
+        print("❌ zstandard manquant : pip install zstandard", file=sys.stderr)
+        return 2
+    samples = _fetch_samples(args.limit)
+    if len(samples) < 10:
+        print(f"❌ {len(samples)} échantillons : pas assez de données pour entraîner un dictionnaire", file=sys.stderr)
+        return 1
+    d = train(samples, args.size)
+    os.makedirs(STORAGE_CODEC_DICTS, exist_ok=True)
+    existing = [f for f in os.listdir(STORAGE_CODEC_DICTS) if f.endswith(".dict")]
+    path = os.path.join(STORAGE_CODEC_DICTS, f"{len(existing) + 1:04d}-{d.dict_id()}.dict")
+    with open(path, "wb") as f:
+        f.write(d.as_bytes())
+    print(f"✅ {path} ({len(samples)} échantillons) — à versionner avec le code et à ne jamais supprimer")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live at the repository root, next to the Streamlit apps
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# auth.py refuses to import without a secret outside APP_ENV=dev
+os.environ.setdefault("SESSION_SECRET", "tests-session-secret")
@@ -0,0 +1,55 @@
+import pytest
+
+import answer_history
+from answer_history import AnswerHistory, apply_changes, apply_text_delta, diff_answers, text_delta
+from bench.fakes import FakeDatabase, FakeSupabase
+from exam_repository import ExamRepository
+
+
+@pytest.fixture
+def history(monkeypatch):
+    monkeypatch.setattr(answer_history, "ANSWER_CHECKPOINT_EVERY", 3)
+    answer_history._heads.clear()
+    db = FakeDatabase()
+    yield AnswerHistory(ExamRepository(FakeSupabase(db))), db
+    answer_history._heads.clear()
+
+
+@pytest.mark.parametrize("old,new", [("", "abc"), ("abc", ""), ("hello world", "hello brave world"),
+                                     ("aaaa", "aa"), ("same", "same"), ("abc", "xbz")])
+def test_text_delta_round_trip(old, new):
+    delta = text_delta(old, new)
+    if old == new:
+        assert delta is None
+    else:
+        assert apply_text_delta(old, delta) == new
+
+
+def test_diff_answers_round_trip():
+    old = {"comp_0_0": "le chat", "lang_1_0": "b", "writing_0": "texte"}
+    new = {"comp_0_0": "le petit chat", "lang_1_0": ["a", "c"], "comp_0_1": "nouveau"}
+    changes = diff_answers(old, new)
+    assert changes["writing_0"] is None
+    assert changes["lang_1_0"] == {"value": ["a", "c"]}
+    assert changes["comp_0_0"] == [3, 0, "petit "]
+    assert apply_changes(old, changes) == new
+
+
+def test_every_version_is_rebuilt_from_checkpoints_and_deltas(history):
+    history, db = history
+    versions = [{"comp_0_0": "a" * i, "writing_0": f"v{i}"} for i in range(1, 8)]
+    for i, answers in enumerate(versions, start=1):
+        assert history.record("e1", answers) == i
+    kinds = [row["kind"] for row in sorted(db.tables["answer_log"], key=lambda r: r["seq"])]
+    assert kinds == ["checkpoint", "delta", "delta", "checkpoint", "delta", "delta", "checkpoint"]
+    answer_history._heads.clear()  # another replica: no head in memory
+    for i, answers in enumerate(versions, start=1):
+        assert history.state_at("e1", i) == (i, answers)
+    assert history.head("e1") == (7, versions[-1])
+
+
+def test_unchanged_answers_add_no_version(history):
+    history, db = history
+    assert history.record("e1", {"comp_0_0": "x"}) == 1
+    assert history.record("e1", {"comp_0_0": "x"}) == 1
+    assert len(db.tables["answer_log"]) == 1
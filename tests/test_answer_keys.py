@@ -0,0 +1,56 @@
+from answer_keys import canonical_answers, canonical_key, has_legacy_keys, language_exercises, workflow_answers
+
+MATCHING = {"consigne": "Match", "matching": {"expressions": [], "fonctions": []}}
+
+
+def exam(*exercises):
+    return {"language": {"exercices": list(exercises)}}
+
+
+def test_positional_match_key_takes_the_exercise_id():
+    exercises = language_exercises(exam({"id": "a", "details": [{"question": "q"}]}, {"id": "m", **MATCHING}))
+    assert canonical_key("lang_match_1_0", exercises) == "lang_match_m"
+    assert canonical_key("lang_match_m", exercises) == "lang_match_m"
+
+
+def test_legacy_key_is_matched_on_exercise_id_not_position():
+    # app.py keys by id: "2" is the matching exercise even though it sits at position 0
+    exercises = language_exercises(exam({"id": "2", **MATCHING}, {"id": "1", "details": [{"id": "q1", "question": "q"}]}))
+    assert canonical_key("lang_2_0", exercises) == "lang_match_2"
+    # lang_1_0 is the first question of exercise "1" in app.py
+    assert canonical_key("lang_1_0", exercises) == "lang_1_0"
+
+
+def test_legacy_key_kept_when_an_id_less_question_may_own_it():
+    # In app_new.py, lang_1_0 is the first id-less question at position 1
+    exercises = language_exercises(exam({"id": "0", "details": [{"question": "q"}]}, {"id": "x", "details": [{"question": "q"}]},
+                                        {"id": "1", **MATCHING}))
+    assert canonical_key("lang_1_0", exercises) == "lang_1_0"
+
+
+def test_canonical_answers_prefers_the_newer_value():
+    data = exam({"id": "1", **MATCHING})
+    answers = {"lang_1_0": "1-a", "lang_match_1": "1-b", "comp_0_0": "x"}
+    assert canonical_answers(answers, data) == {"lang_match_1": "1-b", "comp_0_0": "x"}
+    assert canonical_answers({"lang_1_0": "1-a"}, lambda: data) == {"lang_match_1": "1-a"}
+
+
+def test_canonical_answers_skips_the_exam_without_legacy_keys():
+    answers = {"lang_match_1": "1-a", "comp_0_0": "x"}
+    assert not has_legacy_keys(answers)
+    assert canonical_answers(answers, lambda: 1 / 0) is answers
+
+
+def test_workflow_copy_round_trips():
+    data = exam({"id": "2", "details": [{"question": "q"}]}, {"id": "1", **MATCHING})
+    answers = {"lang_match_1": "1-a", "lang_2_0": "texte"}
+    sent = workflow_answers(answers, data)
+    assert sent == {"lang_match_1": "1-a", "lang_1_0": "1-a", "lang_2_0": "texte"}
+    assert canonical_answers(sent, data) == answers
+
+
+def test_no_workflow_copy_over_a_question_key():
+    data = exam({"id": "0", "details": [{"question": "q"}]}, {"id": "1", **MATCHING, "details": [{"question": "q"}]})
+    answers = {"lang_match_1": "1-a", "lang_1_0": "question"}
+    assert workflow_answers(answers, data) == answers
+    assert workflow_answers({"lang_match_1": "1-a"}, data) == {"lang_match_1": "1-a"}
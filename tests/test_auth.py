@@ -0,0 +1,59 @@
+import json
+
+import auth
+import session_store
+from auth import (AccessCodeCache, _b64, _unb64, issue_session_token, read_session_token, revoke_session_token)
+
+
+def test_token_round_trip():
+    token = issue_session_token("Amina", "amina@exam.local", sid="sid-1")
+    assert read_session_token(token) == {"user_name": "Amina", "user_email": "amina@exam.local", "sid": "sid-1"}
+
+
+def test_tampered_token_is_refused():
+    token = issue_session_token("Amina", "amina@exam.local", sid="sid-1")
+    body, signature = token.split(".")
+    claims = json.loads(_unb64(body))
+    claims["e"] = "someone.else@exam.local"
+    forged = _b64(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    assert read_session_token(f"{forged}.{signature}") is None
+    assert read_session_token(f"{body}.{signature[:-2]}AA") is None
+    for garbage in ("", "abc", "a.b.c", None):
+        assert read_session_token(garbage) is None
+
+
+def test_expired_token_is_refused():
+    assert read_session_token(issue_session_token("Amina", "amina@exam.local", ttl=-1)) is None
+
+
+def test_logout_revokes_the_token(monkeypatch):
+    store = session_store.MemoryStore()
+    monkeypatch.setattr(session_store, "get_session_store", lambda: store)
+    token = issue_session_token("Amina", "amina@exam.local", sid="sid-logout")
+    assert not session_store.sid_revoked("sid-logout")
+    assert revoke_session_token(token)
+    assert session_store.sid_revoked("sid-logout")
+    # A forged token cannot be used to revoke someone else's session
+    assert not revoke_session_token(token.split(".")[0] + ".bad")
+
+
+def test_unreachable_store_refuses_resume(monkeypatch):
+    class Down:
+        def get(self, key):
+            raise ConnectionError("store down")
+
+    monkeypatch.setattr(session_store, "get_session_store", lambda: Down())
+    assert session_store.sid_revoked("any")
+
+
+def test_access_codes_are_loaded_once_and_reloaded_on_unknown_code():
+    loads = []
+    codes = ["EXAM2024"]
+    cache = AccessCodeCache(lambda: loads.append(1) or list(codes), refresh_seconds=60, miss_refresh_seconds=0)
+    assert cache.is_active(" EXAM2024 ")
+    assert cache.is_active("EXAM2024")
+    assert len(loads) == 1
+    codes.append("NEW")
+    assert cache.is_active("NEW")
+    assert not cache.is_active("WRONG")
+    assert auth.code_hash("x") != "x"
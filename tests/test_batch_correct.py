@@ -0,0 +1,24 @@
+from batch_correct import corrected_exam_ids
+from bench.fakes import FakeDatabase, FakeSupabase
+
+
+def test_corrected_exams_are_told_apart_by_submission_time():
+    db = FakeDatabase()
+    db.tables["exam_results"] = [
+        {"id": "r1", "exam_id": "graded", "created_at": "2026-03-01T10:05:00+00:00"},
+        {"id": "r2", "exam_id": "resubmitted", "created_at": "2026-03-01T10:05:00.5+00:00"},
+        {"id": "r3", "exam_id": "legacy", "created_at": "2026-02-01T09:00:00+00:00"},
+    ]
+    rows = [
+        {"id": "graded", "submitted_at": "2026-03-01T10:00:00.123456+00:00"},
+        {"id": "resubmitted", "submitted_at": "2026-03-02T08:00:00+00:00"},
+        {"id": "legacy", "submitted_at": None},
+        {"id": "never", "submitted_at": "2026-03-01T10:00:00+00:00"},
+    ]
+    assert corrected_exam_ids(FakeSupabase(db), rows) == {"graded", "legacy"}
+
+
+def test_no_rows_no_query():
+    db = FakeDatabase()
+    assert corrected_exam_ids(FakeSupabase(db), []) == set()
+    assert not db.tables["exam_results"]
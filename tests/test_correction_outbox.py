@@ -0,0 +1,81 @@
+import pytest
+
+import correction_outbox
+from bench.fakes import FakeDatabase, FakeSupabase
+from correction_outbox import OutboxDispatcher, dedup_key, enqueue_correction, get_outbox_status
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+@pytest.fixture
+def db():
+    db = FakeDatabase()
+    db.tables["exams_streamlit"].append({"id": "e1", "student_id": "s1", "status": "in_progress", "student_responses": {}})
+    return db
+
+
+class Webhook:
+    """Stands in for metrics.webhook_post: records each call, answers with `status`."""
+
+    def __init__(self):
+        self.calls, self.status = [], 200
+
+    def __call__(self, endpoint, url, json=None, headers=None, timeout=None):
+        self.calls.append((json, headers))
+        return Response(self.status)
+
+
+@pytest.fixture
+def webhook(monkeypatch):
+    webhook = Webhook()
+    monkeypatch.setattr(correction_outbox, "webhook_post", webhook)
+    return webhook
+
+
+def test_dedup_key_ignores_key_order_but_not_status():
+    assert dedup_key("e1", "submitted", {"a": 1, "b": 2}) == dedup_key("e1", "submitted", {"b": 2, "a": 1})
+    assert dedup_key("e1", "submitted", {"a": 1}) != dedup_key("e1", "resubmitted", {"a": 1})
+
+
+def test_enqueue_saves_the_answers_and_collapses_double_clicks(db):
+    supabase = FakeSupabase(db)
+    first = enqueue_correction(supabase, "e1", "s1", {"comp_0_0": "x"}, payload={"to_grade": ["comp_0_0"]})
+    again = enqueue_correction(supabase, "e1", "s1", {"comp_0_0": "x"})
+    assert first == again
+    row = db.tables["exams_streamlit"][0]
+    assert row["status"] == "submitted" and row["student_responses"] == {"comp_0_0": "x"}
+    record, = db.tables["correction_outbox"]
+    assert record["payload"] == {"student_id": "s1", "exam_id": "e1", "action": "start_correction", "to_grade": ["comp_0_0"]}
+    assert get_outbox_status(supabase, "e1")["status"] == "pending"
+
+
+def test_delivered_record_is_marked_with_its_idempotency_key(db, webhook):
+    supabase = FakeSupabase(db)
+    enqueue_correction(supabase, "e1", "s1", {"comp_0_0": "x"})
+    dispatcher = OutboxDispatcher(supabase)
+    record, = supabase.rpc("claim_correction_outbox", {"p_limit": 10}).execute().data
+    dispatcher._post(record)
+    (body, headers), = webhook.calls
+    assert body["exam_id"] == "e1"
+    assert headers["Idempotency-Key"] == f"{record['dedup_key']}:{record['id']}"
+    assert db.tables["correction_outbox"][0]["status"] == "delivered"
+
+
+def test_failures_back_off_then_go_dead(db, webhook):
+    webhook.status = 500
+    supabase = FakeSupabase(db)
+    enqueue_correction(supabase, "e1", "s1", {"comp_0_0": "x"})
+    dispatcher = OutboxDispatcher(supabase, max_attempts=2)
+    stored = db.tables["correction_outbox"][0]
+    dispatcher._post(dict(stored, attempts=1))
+    assert stored["status"] == "pending" and stored["last_error"] == "HTTP 500"
+    assert stored["next_attempt_at"] > stored["created_at"]
+    dispatcher._post(dict(stored, attempts=2))
+    assert stored["status"] == "dead"
@@ -0,0 +1,36 @@
+from bench.fakes import FakeDatabase, FakeSupabase
+from exam_repository import ExamRepository
+
+EXAM = {"info": {"title": "Examen"}, "comprehension": {"texte": "t", "exercices": []}}
+
+
+def test_same_generation_request_is_saved_once():
+    db = FakeDatabase()
+    repo = ExamRepository(FakeSupabase(db))
+    first = repo.insert_exam("s1", EXAM, request_id="11111111-1111-1111-1111-111111111111")
+    again = repo.insert_exam("s1", EXAM, request_id="11111111-1111-1111-1111-111111111111")
+    other = repo.insert_exam("s1", EXAM, request_id="22222222-2222-2222-2222-222222222222")
+    assert first == again != other
+    assert len(db.tables["exams_streamlit"]) == 2
+
+
+def test_without_request_id_every_save_inserts():
+    db = FakeDatabase()
+    repo = ExamRepository(FakeSupabase(db))
+    assert repo.insert_exam("s1", EXAM) != repo.insert_exam("s1", EXAM)
+
+
+def test_payload_cache_lookups_are_counters():
+    from exam_repository import PayloadCache
+    from metrics import REGISTRY
+
+    cache = PayloadCache()
+    before = REGISTRY.read_counter("payload_cache_hits_total").get((("kind", "exam"),), 0)
+    cache.put("exam", "e1", EXAM)
+    assert cache.get("exam", "e1") == EXAM
+    assert cache.get("exam", "e2") is None
+    assert REGISTRY.read_counter("payload_cache_hits_total")[(("kind", "exam"),)] == before + 1
+    text = REGISTRY.render()
+    assert "# TYPE examaroc_payload_cache_hits_total counter" in text
+    assert "# TYPE examaroc_payload_cache_misses_total counter" in text
+    assert "examaroc_payload_cache_hits " not in text
@@ -0,0 +1,88 @@
+import pytest
+
+from exam_schema import ExamPayloadError, parse_payload, validate_exam
+
+
+def exam():
+    return {
+        "info": {"title": "Examen"},
+        "comprehension": {"texte": "Texte", "exercices": [
+            {"id": "1", "questions": [{"id": "comp_1", "question": "Qui ?", "points": 2}]},
+        ]},
+        "language": {"exercices": [
+            {"id": "1", "details": [{"question": "Passif", "points": 1}]},
+            {"id": "2", "matching": {"expressions": [{"id": "1", "text": "x"}], "fonctions": [{"id": "a", "text": "y"}]}},
+        ]},
+        "writing": {"sujets": [{"id": "writing_1", "sujet": "Racontez."}]},
+    }
+
+
+def test_valid_exam_gets_its_defaults():
+    data = validate_exam(exam())
+    assert data["language"]["exercices"][0]["consigne"] == ""
+    assert data["language"]["exercices"][1]["matching"]["points"] == 0
+    assert data["writing"]["sujets"][0]["type"] == "Writing"
+
+
+def test_numeric_ids_become_text():
+    data = exam()
+    data["language"]["exercices"][0]["id"] = 1
+    data["writing"]["sujets"][0]["id"] = 7
+    data = validate_exam(data)
+    assert data["language"]["exercices"][0]["id"] == "1"
+    assert data["writing"]["sujets"][0]["id"] == "7"
+
+
+def test_points_sent_as_text_become_numbers():
+    data = exam()
+    data["comprehension"]["exercices"][0]["questions"][0]["points"] = "12,5"
+    data["writing"]["sujets"][0]["points"] = " 4 "
+    data = validate_exam(data)
+    assert data["comprehension"]["exercices"][0]["questions"][0]["points"] == 12.5
+    assert data["writing"]["sujets"][0]["points"] == 4
+
+
+def test_null_matching_is_dropped():
+    data = exam()
+    data["language"]["exercices"][0]["matching"] = None
+    data = validate_exam(data)
+    assert "matching" not in data["language"]["exercices"][0]
+
+
+def test_errors_carry_their_path():
+    data = exam()
+    data["language"]["exercices"][0]["details"][0]["question"] = " "
+    data["comprehension"]["exercices"][0]["questions"][0]["points"] = "beaucoup"
+    data["writing"]["sujets"] = []
+    del data["comprehension"]["texte"]
+    with pytest.raises(ExamPayloadError) as err:
+        validate_exam(data)
+    assert set(err.value.errors) == {
+        "language.exercices[0].details[0].question : texte manquant",
+        "comprehension.exercices[0].questions[0].points : nombre attendu, reçu 'beaucoup'",
+        "writing.sujets : au moins 1 élément(s) attendu(s), 0 reçu(s)",
+        "comprehension.texte : champ obligatoire manquant",
+    }
+
+
+def test_wrong_types_are_rejected():
+    with pytest.raises(ExamPayloadError, match="examen : objet attendu, reçu list"):
+        validate_exam([])
+    data = exam()
+    data["language"]["exercices"][1] = {"id": "2", "matching": None}
+    with pytest.raises(ExamPayloadError, match=r"language.exercices\[1\] : il faut au moins un de"):
+        validate_exam(data)
+
+
+def test_stored_exams_are_read_leniently():
+    data = validate_exam({"info": {}, "writing": {"sujets": [{"id": "w", "sujet": "S"}]}}, strict=False)
+    assert data["comprehension"] == {"texte": "", "exercices": []}
+    assert data["language"] == {"exercices": []}
+    with pytest.raises(ExamPayloadError):
+        validate_exam({"comprehension": []}, strict=False)
+
+
+def test_parse_payload_unwraps_the_webhook_response():
+    assert parse_payload('```json\n[{"exam_content": "{\\"a\\": 1}"}]\n```') == {"a": 1}
+    with pytest.raises(ExamPayloadError, match="JSON illisible"):
+        parse_payload("pas du json")
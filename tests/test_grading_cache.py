@@ -0,0 +1,84 @@
+from grading_cache import KEYS_BY_ID, KEYS_BY_POSITION, GradingCache, index_questions, question_hash
+from metrics import REGISTRY
+
+
+def exam(**overrides):
+    data = {
+        "comprehension": {"texte": "Texte", "exercices": [
+            {"id": "1", "consigne": "A", "questions": [{"question": "Qui ?", "points": 1}]},
+            {"id": "2", "consigne": "B", "questions": [{"question": "Où ?", "points": 1}]},
+        ]},
+        "language": {"exercices": [
+            {"id": "1", "consigne": "C", "details": [{"question": "Passif", "points": 1}]},
+            {"id": "2", "consigne": "D", "matching": {"expressions": [{"id": "1", "text": "x"}], "fonctions": [{"id": "a", "text": "y"}], "points": 2}},
+        ]},
+    }
+    data.update(overrides)
+    return data
+
+
+def hash_of(question, consigne, texte=None):
+    content = {"consigne": consigne, "question": question, "points": 1, "options": None}
+    return question_hash({**content, "texte": texte} if texte else content)
+
+
+def test_ids_colliding_with_positions_resolve_per_app():
+    by_id = index_questions(exam(), KEYS_BY_ID)
+    by_position = index_questions(exam(), KEYS_BY_POSITION)
+    # app.py: comp_1_0 is the first question of exercise id "1"
+    assert by_id["comp_1_0"] == hash_of("Qui ?", "A", "Texte")
+    assert by_id["comp_2_0"] == hash_of("Où ?", "B", "Texte")
+    # app_new.py: comp_1_0 is the first question of the exercise in position 1
+    assert by_position["comp_0_0"] == hash_of("Qui ?", "A", "Texte")
+    assert by_position["comp_1_0"] == hash_of("Où ?", "B", "Texte")
+    assert by_id["lang_1_0"] == hash_of("Passif", "C")
+    assert "lang_match_2" in by_id and by_id["lang_match_2"] == by_position["lang_match_2"]
+
+
+def test_unknown_scheme_drops_ambiguous_keys():
+    index = index_questions(exam())
+    assert index["comp_1_0"] is None
+    assert index["comp_0_0"] == hash_of("Qui ?", "A", "Texte")
+    assert index["comp_2_0"] == hash_of("Où ?", "B", "Texte")
+    assert index["lang_match_2"] is not None
+
+
+def test_ambiguous_key_is_never_served_from_cache():
+    cache = GradingCache()
+    index = index_questions(exam())
+    cache.remember([{"id": "comp_1_0", "status": "correct", "points_earned": 1}], {"comp_1_0": "Ali"}, index)
+    hits, misses = cache.split({"comp_1_0": "Ali"}, index)
+    assert hits == [] and misses == {"comp_1_0": "Ali"}
+
+
+def test_hash_changes_with_points_and_matching_options():
+    base = index_questions(exam(), KEYS_BY_ID)
+    edited = exam()
+    edited["comprehension"]["exercices"][0]["questions"][0]["points"] = 2
+    edited["language"]["exercices"][1]["matching"]["fonctions"].append({"id": "b", "text": "z"})
+    changed = index_questions(edited, KEYS_BY_ID)
+    assert changed["comp_1_0"] != base["comp_1_0"]
+    assert changed["lang_match_2"] != base["lang_match_2"]
+    assert changed["comp_2_0"] == base["comp_2_0"]
+
+
+def test_split_reuses_verdict_and_payload_keeps_every_answer():
+    cache = GradingCache()
+    index = index_questions(exam(), KEYS_BY_POSITION)
+    verdict = {"id": "comp_0_0", "status": "correct", "points_earned": 1, "correct_answer": "Ali", "explanation": "ok"}
+    cache.remember([verdict], {"comp_0_0": "Ali."}, index)
+    answers = {"comp_0_0": "  ali ", "comp_1_0": "Rabat", "writing_1": "Essai"}
+    payload = cache.correction_payload(answers, index)
+    assert payload["answers"] == answers
+    assert payload["to_grade"] == ["comp_1_0", "writing_1"]
+    [cached] = payload["cached_corrections"]
+    assert cached["id"] == "comp_0_0" and cached["points_earned"] == 1 and cached["cached"] is True
+
+
+def test_lookups_are_exported_as_counters():
+    before = REGISTRY.read_counter("grading_cache_lookups_total")
+    cache = GradingCache()
+    cache.get("h", "réponse")
+    after = REGISTRY.read_counter("grading_cache_lookups_total")
+    assert after[(("outcome", "miss"),)] == before.get((("outcome", "miss"),), 0) + 1
+    assert "examaroc_grading_cache_lookups_total" in REGISTRY.render()
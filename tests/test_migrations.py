@@ -0,0 +1,31 @@
+"""Query plans of the hot queries against a real Postgres.
+
+Skipped unless DATABASE_URL points to a disposable database: the migrations are
+applied to it first.
+"""
+import os
+
+import pytest
+
+from migrate import HOT_QUERIES, list_migrations, migrate, plan_problem
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL non défini (Postgres local requis)")
+
+
+@pytest.fixture(scope="module")
+def conn():
+    psycopg = pytest.importorskip("psycopg")
+    with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+        migrate(conn)
+        yield conn
+
+
+def test_every_migration_is_recorded(conn):
+    applied = {version for (version,) in conn.execute("select version from schema_migrations")}
+    assert {version for version, _, _ in list_migrations()} <= applied
+
+
+@pytest.mark.parametrize("name, sql, indexes", HOT_QUERIES, ids=[name for name, _, _ in HOT_QUERIES])
+def test_hot_query_uses_its_index(conn, name, sql, indexes):
+    assert plan_problem(conn, name, sql, indexes) is None
@@ -0,0 +1,63 @@
+import pytest
+
+import session_store
+from session_store import MemoryStore, SQLiteStore, _restore, create_store, revoke_sid, sid_revoked, working_set
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    return MemoryStore() if request.param == "memory" else SQLiteStore(str(tmp_path / "sessions.db"))
+
+
+def test_get_set_delete_and_expiry(store):
+    assert store.get("k") is None
+    store.set("k", {"current_exam_id": "e1", "answers": {"comp_0_0": "x"}})
+    assert store.get("k") == {"current_exam_id": "e1", "answers": {"comp_0_0": "x"}}
+    store.set("k", {"current_exam_id": "e2"})
+    assert store.get("k") == {"current_exam_id": "e2"}
+    store.delete("k")
+    assert store.get("k") is None
+    store.set("old", 1, ttl=-1)
+    assert store.get("old") is None
+
+
+def test_sqlite_file_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    SQLiteStore(path).set("k", [1, 2])
+    assert SQLiteStore(path).get("k") == [1, 2]
+
+
+def test_create_store_from_spec(tmp_path):
+    assert isinstance(create_store("memory"), MemoryStore)
+    assert isinstance(create_store(f"sqlite:///{tmp_path}/s.db"), SQLiteStore)
+    assert isinstance(create_store("nonsense"), MemoryStore)
+
+
+def test_working_set_round_trip():
+    state = {"current_exam_id": "e1", "current_user": "s1", "waiting_for_correction": False, "result_ref": None,
+             "comp_0_0": "réponse", "lang_match_1": "1-a", "authenticated": True, "exam_cache": {"big": "body"}}
+    snapshot = working_set(state)
+    assert snapshot == {"current_exam_id": "e1", "current_user": "s1", "waiting_for_correction": False,
+                        "answers": {"comp_0_0": "réponse", "lang_match_1": "1-a"}}
+    restored = {"authenticated": True}
+    _restore(restored, snapshot)
+    assert restored == {"authenticated": True, "current_exam_id": "e1", "current_user": "s1",
+                        "waiting_for_correction": False, "comp_0_0": "réponse", "lang_match_1": "1-a"}
+
+
+class BrokenStore:
+    def get(self, key):
+        raise ConnectionError("store down")
+
+    def set(self, key, value, ttl=None):
+        raise ConnectionError("store down")
+
+
+def test_revocation_is_shared_and_fails_closed(monkeypatch):
+    monkeypatch.setattr(session_store, "_store", MemoryStore())
+    assert not sid_revoked("sid-1")
+    assert revoke_sid("sid-1", ttl=60)
+    assert sid_revoked("sid-1") and not sid_revoked("sid-2") and not sid_revoked(None)
+    monkeypatch.setattr(session_store, "_store", BrokenStore())
+    assert not revoke_sid("sid-2", ttl=60)
+    assert sid_revoked("sid-2")
@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+import storage_codec
+from storage_codec import CodecError, decode, decode_row, encode, is_encoded
+
+zstandard = pytest.importorskip("zstandard")
+
+ANSWERS = {f"comp_{i}_0": f"Réponse {i} : le texte dit que la ville change avec les saisons. " * 3 for i in range(20)}
+
+
+@pytest.fixture
+def codec(monkeypatch):
+    """Codec on for student_responses, no dictionary; returns a function installing dictionaries."""
+    monkeypatch.setattr(storage_codec, "STORAGE_CODEC", "zstd")
+    monkeypatch.setattr(storage_codec, "WRITE_COLUMNS", {"student_responses"})
+    monkeypatch.setattr(storage_codec, "_local", threading.local())
+    monkeypatch.setattr(storage_codec, "_dicts", ({}, None))
+
+    def use_dicts(*dicts):
+        storage_codec._local = threading.local()
+        storage_codec._dicts = ({d.dict_id(): d for d in dicts}, dicts[-1].dict_id() if dicts else None)
+    return use_dicts
+
+
+def test_disabled_codec_stores_plain_json(monkeypatch):
+    monkeypatch.setattr(storage_codec, "STORAGE_CODEC", "")
+    assert encode(ANSWERS, "student_responses") is ANSWERS
+
+
+def test_round_trip(codec):
+    stored = encode(ANSWERS, "student_responses")
+    assert is_encoded(stored) and stored["dict"] == 0
+    assert len(stored[storage_codec.MARKER]) < len(str(ANSWERS)) / 4
+    assert decode(stored) == ANSWERS
+    assert encode(stored, "student_responses") is stored
+
+
+def test_small_values_and_other_columns_stay_plain(codec):
+    small = {"comp_0_0": "oui"}
+    assert encode(small, "student_responses") is small
+    assert encode(ANSWERS, "exam_content") is ANSWERS
+    assert decode(small) is small
+
+
+def test_decode_row_reads_old_and_new_rows(codec):
+    row = {"id": "e1", "student_responses": encode(ANSWERS, "student_responses"), "exam_content": {"info": {}}}
+    assert decode_row(row) == {"id": "e1", "student_responses": ANSWERS, "exam_content": {"info": {}}}
+
+
+def test_dictionary_round_trip_and_missing_dictionary(codec):
+    samples = [{f"comp_{i}_{j}": f"Réponse {i} {j} sur le texte et la ville." * (j + 1) for j in range(5)} for i in range(300)]
+    dictionary = zstandard.train_dictionary(4096, [storage_codec._dumps(s) for s in samples])
+    codec(dictionary)
+    stored = encode(ANSWERS, "student_responses")
+    assert stored["dict"] == dictionary.dict_id()
+    assert decode(stored) == ANSWERS
+    codec()
+    with pytest.raises(CodecError):
+        decode(stored)
@@ -0,0 +1,61 @@
+import threading
+
+from metrics import REGISTRY
+from work_queue import QueueFull, WorkQueue
+
+
+def blocked_queue(**kwargs):
+    """Queue whose single worker is held until `release` is set, so submissions stay queued."""
+    release, started = threading.Event(), threading.Event()
+    queue = WorkQueue("test", max_in_flight=1, **kwargs)
+    queue.submit("holder", lambda: (started.set(), release.wait(5)))
+    started.wait(5)
+    return queue, release
+
+
+def test_final_submit_is_served_before_regrade_and_backfill():
+    queue, release = blocked_queue()
+    order = []
+    backfill = queue.submit("s1", order.append, "backfill", priority="backfill")
+    regrade = queue.submit("s2", order.append, "regrade", priority="regrade")
+    final = queue.submit("s3", order.append, "final", priority="final_submit")
+    assert [queue.position(t) for t in (final, regrade, backfill)] == [1, 2, 3]
+    release.set()
+    backfill.wait(5)
+    assert order == ["final", "regrade", "backfill"]
+
+
+def test_round_robin_between_students_of_a_class():
+    queue, release = blocked_queue()
+    first = [queue.submit("busy", lambda: None) for _ in range(3)]
+    other = queue.submit("calm", lambda: None)
+    assert queue.position(other) == 2
+    release.set()
+    assert all(t.wait(5) for t in first + [other])
+
+
+def test_reuse_returns_the_unfinished_ticket_and_full_queue_refuses():
+    queue, release = blocked_queue(max_queued=1)
+    ticket = queue.submit("s1", lambda: 1, key="generation:s1", reuse=True)
+    assert queue.submit("s1", lambda: 2, key="generation:s1", reuse=True) is ticket
+    assert queue.idle_slots() == 0
+    try:
+        queue.submit("s2", lambda: 3)
+        raise AssertionError("QueueFull attendu")
+    except QueueFull as e:
+        assert e.retry_after > 0
+    release.set()
+    ticket.wait(5)
+    assert ticket.result == 1
+
+
+def test_latency_and_depth_are_exported_per_class():
+    queue, release = blocked_queue()
+    waiting = queue.submit("s1", lambda: None, priority="regrade")
+    assert queue.depth()[("queued", "regrade")] == 1
+    assert queue.depth()[("running", "first_correction")] == 1
+    release.set()
+    waiting.wait(5)
+    text = REGISTRY.render()
+    assert 'examaroc_work_queue_wait_seconds_count{priority="regrade",queue="test"}' in text
+    assert "examaroc_work_queue_run_seconds" in text
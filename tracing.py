@@ -0,0 +1,163 @@
+"""Traces de bout en bout par examen : génération, soumission, relance.
+
+Chaque action crée une trace (`Trace`) dont le contexte voyage dans le payload
+des webhooks (`trace`) et dans l'en-tête `traceparent`. Chaque étape enregistre
+un span dans `exam_traces` (voir migrations/0003_exam_traces.sql) :
+
+    submit        clic → demande enregistrée dans l'outbox
+    outbox_wait   demande enregistrée → réclamée par le dispatcher
+    queue_wait    réclamée → prise par un worker de la file de correction
+    webhook_post  POST vers n8n (jusqu'à l'accusé de réception)
+    n8n_workflow  accusé de réception → ligne exam_results écrite par n8n
+    result_poll   ligne écrite → vue par la session de l'étudiant
+    total         clic → résultat affiché
+
+n8n peut ajouter ses propres spans (ex. `llm`) avec le même `trace_id`.
+Les durées alimentent aussi l'histogramme `trace_stage_duration_seconds` de metrics.py.
+"""
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+
+from metrics import REGISTRY, is_operator
+
+logger = logging.getLogger(__name__)
+
+TRACE_TABLE = "exam_traces"
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def parse_ts(value):
+    """Supabase timestamp (ISO 8601 string) -> epoch seconds, or None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class Trace:
+    """Spans of one user action, buffered in memory until `flush`."""
+
+    def __init__(self, action, exam_id=None, student_id=None, trace_id=None, started_at=None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.action = action
+        self.exam_id = exam_id
+        self.student_id = student_id
+        self.started_at = started_at if started_at is not None else time.time()
+        self.spans = []
+        self._last_mark = self.started_at
+
+    @classmethod
+    def from_context(cls, ctx):
+        if not ctx or not ctx.get("trace_id"):
+            return None
+        return cls(ctx.get("action") or "unknown", ctx.get("exam_id"), ctx.get("student_id"),
+                   ctx["trace_id"], parse_ts(ctx.get("started_at")))
+
+    def context(self):
+        """JSON-serializable context, for webhook payloads and session_state."""
+        return {
+            "trace_id": self.trace_id,
+            "action": self.action,
+            "exam_id": self.exam_id,
+            "student_id": self.student_id,
+            "started_at": _iso(self.started_at),
+        }
+
+    def headers(self):
+        # W3C trace context, with a fresh span id per outgoing call
+        return {"traceparent": f"00-{self.trace_id}-{uuid.uuid4().hex[:16]}-01"}
+
+    def add_span(self, stage, started, ended, **attrs):
+        ended = max(ended, started)
+        self.spans.append({"stage": stage, "started_at": _iso(started), "ended_at": _iso(ended), "attrs": attrs})
+        REGISTRY.observe("trace_stage_duration_seconds", ended - started, action=self.action, stage=stage)
+
+    def mark(self, stage, **attrs):
+        """Close a span running from the previous mark (or the trace start) until now."""
+        now = time.time()
+        self.add_span(stage, self._last_mark, now, **attrs)
+        self._last_mark = now
+
+    def flush(self, supabase, exam_id=None):
+        """Write the buffered spans. Tracing never breaks the user action: errors are only logged."""
+        if exam_id:
+            self.exam_id = exam_id
+        if not self.spans:
+            return
+        rows = [dict(span, trace_id=self.trace_id, exam_id=self.exam_id, action=self.action) for span in self.spans]
+        self.spans = []
+        try:
+            supabase.table(TRACE_TABLE).insert(rows).execute()
+        except Exception as e:
+            logger.warning("tracing: %d spans non enregistrés pour %s: %s", len(rows), self.exam_id, e)
+
+
+def finish_correction_trace(supabase, trace_ctx, result_row):
+    """The session just found the `exam_results` row: close the trace with the n8n and polling stages."""
+    trace = Trace.from_context(trace_ctx)
+    if trace is None:
+        return
+    now = time.time()
+    written = parse_ts(result_row.get('created_at')) or now
+    try:
+        res = supabase.table(TRACE_TABLE).select("ended_at") \
+            .eq("trace_id", trace.trace_id).eq("stage", "webhook_post") \
+            .order("ended_at", desc=True).limit(1).execute()
+        acked = parse_ts(res.data[0]['ended_at']) if res.data else None
+    except Exception:
+        acked = None
+    if acked:
+        trace.add_span("n8n_workflow", acked, written)
+    trace.add_span("result_poll", written, now)
+    trace.add_span("total", trace.started_at, now)
+    trace.flush(supabase)
+
+
+def exam_timeline(supabase, exam_id):
+    """Spans of the latest trace of an exam, as offsets in seconds from its first span."""
+    rows = supabase.table(TRACE_TABLE) \
+        .select("trace_id, action, stage, started_at, ended_at, attrs") \
+        .eq("exam_id", exam_id) \
+        .order("started_at", desc=True).limit(100).execute().data or []
+    if not rows:
+        return []
+    latest = rows[0]['trace_id']
+    spans = [r for r in rows if r['trace_id'] == latest]
+    origin = min(parse_ts(s['started_at']) for s in spans)
+    timeline = []
+    for s in spans:
+        start, end = parse_ts(s['started_at']), parse_ts(s['ended_at'])
+        timeline.append({
+            "étape": s['stage'],
+            "action": s['action'],
+            "début_s": round(start - origin, 3),
+            "durée_s": round(end - start, 3),
+            "détails": ", ".join(f"{k}={v}" for k, v in (s.get('attrs') or {}).items()),
+        })
+    return sorted(timeline, key=lambda t: (t["étape"] == "total", t["début_s"]))
+
+
+def show_timeline(supabase, exam_id):
+    """Operator-only timeline of the latest trace of an exam."""
+    import streamlit as st
+
+    if not exam_id or not is_operator():
+        return
+    try:
+        timeline = exam_timeline(supabase, exam_id)
+    except Exception as e:
+        st.caption(f"Chronologie indisponible : {e}")
+        return
+    if timeline:
+        with st.expander("⏱️ Chronologie (opérateur)"):
+            st.dataframe(timeline, hide_index=True)
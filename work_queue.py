@@ -0,0 +1,339 @@
+"""File de travail bornée devant les webhooks n8n (génération et correction).
+
+Chaque file limite le nombre d'appels simultanés (`max_in_flight`) et le nombre
+de demandes en attente (`max_queued`). Les demandes sont servies à tour de rôle
+entre étudiants, un étudiant qui envoie plusieurs demandes ne bloque pas les
+autres. Les sessions peuvent afficher leur position et une estimation du temps
+d'attente ; quand la file est pleine, `submit` lève `QueueFull` au lieu de laisser
+la demande s'empiler jusqu'au timeout.
+
+Les demandes ont une classe de priorité (`PRIORITY_CLASSES`). La classe servie
+est celle dont la prochaine demande a la plus petite échéance
+`soumission + avance de la classe` : une copie finale passe devant une relance,
+mais une relance qui attend depuis plus longtemps que l'écart entre les deux
+classes finit toujours par passer (pas de famine).
+
+`max_in_flight` borne les appels au webhook, pas le travail qu'ils déclenchent. La
+génération attend la réponse de n8n (l'examen), la limite porte donc sur les
+générations en cours. Le webhook de correction répond dès que le workflow a démarré
+(quelques secondes, 15 s au plus) et la correction par le modèle continue dans n8n :
+`CORRECTION_MAX_IN_FLIGHT` ne limite que les envois simultanés, pas le nombre de copies
+en cours de correction. Pour borner la charge du modèle, il faut limiter la concurrence
+du workflow n8n lui-même.
+
+Par file et par classe, `/metrics` exporte l'attente avant le départ
+(`work_queue_wait_seconds`), la durée de l'appel (`work_queue_run_seconds`), et à chaque
+lecture le nombre de demandes en attente et en cours (`work_queue_depth{state}`).
+"""
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metrics import REGISTRY
+
+# Class -> head start in seconds given to the other classes. Lower is more urgent.
+PRIORITY_CLASSES = OrderedDict([
+    ("final_submit", 0.0),       # "🏁 Terminer": the student is waiting for the grade
+    ("first_correction", 30.0),  # first correction not requested live (default)
+    ("regrade", 120.0),          # "🔁 Relancer la correction"
+    ("backfill", 300.0),         # batch_correct.py --via-outbox
+])
+DEFAULT_PRIORITY = "first_correction"
+
+_LATENCY_SAMPLES = 500
+
+
+class QueueFull(Exception):
+    """Raised when a queue refuses new work; `retry_after` is a hint in seconds."""
+
+    def __init__(self, queue_name, retry_after):
+        super().__init__(f"file '{queue_name}' saturée")
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """Handle on a submitted job: state, result and timing."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, student_id, key, priority, fn, args, kwargs):
+        self.id = next(Ticket._ids)
+        self.student_id = student_id
+        self.key = key
+        self.priority = priority
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+        self.state = "queued"  # queued, running, done, failed
+        self.result = None
+        self.error = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    @property
+    def deadline(self):
+        return self.submitted_at + PRIORITY_CLASSES[self.priority]
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+
+class WorkQueue:
+    """Bounded queue with a fixed pool of workers, priority classes and round-robin fairness per student."""
+
+    def __init__(self, name, max_in_flight=4, max_queued=100, default_service_time=20.0):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        # class -> (student_id -> deque of tickets, in round-robin order)
+        self._classes = OrderedDict((name, OrderedDict()) for name in PRIORITY_CLASSES)
+        self._latencies = {name: {"wait": deque(maxlen=_LATENCY_SAMPLES), "total": deque(maxlen=_LATENCY_SAMPLES)}
+                           for name in PRIORITY_CLASSES}
+        self._queued = 0
+        self._running = {}
+        self._tickets = {}
+        self._by_key = {}
+        self._cond = threading.Condition()
+        # Exponentially weighted moving average of the service time, for wait estimates
+        self._service_time = default_service_time
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        for i in range(max_in_flight):
+            threading.Thread(target=self._worker, name=f"{name}-worker-{i}", daemon=True).start()
+
+    # --- submission ---
+    def submit(self, student_id, fn, *args, key=None, reuse=False, priority=DEFAULT_PRIORITY, **kwargs):
+        """Queue `fn(*args, **kwargs)` for a student in a priority class.
+
+        `key` makes the ticket retrievable with `get(key=...)`; with `reuse=True`
+        an unfinished job with the same key is returned instead of queuing a new one.
+        """
+        if priority not in PRIORITY_CLASSES:
+            priority = DEFAULT_PRIORITY
+        with self._cond:
+            if key is not None and reuse:
+                existing = self._tickets.get(self._by_key.get(key))
+                if existing is not None and not existing.done():
+                    return existing
+            if self._queued >= self.max_queued:
+                self.rejected += 1
+                raise QueueFull(self.name, self._estimate(self._queued))
+            ticket = Ticket(student_id, key, priority, fn, args, kwargs)
+            self._classes[priority].setdefault(student_id, deque()).append(ticket)
+            self._queued += 1
+            self._tickets[ticket.id] = ticket
+            if key is not None:
+                self._by_key[key] = ticket.id
+            self._cond.notify()
+            return ticket
+
+    def get(self, ticket_id=None, key=None):
+        with self._cond:
+            if key is not None:
+                ticket_id = self._by_key.get(key)
+            return self._tickets.get(ticket_id)
+
+    def free_slots(self):
+        """How many more jobs can be queued before `submit` starts refusing."""
+        with self._cond:
+            return max(0, self.max_queued - self._queued)
+
+    def idle_slots(self):
+        """How many more jobs would start right away (workers neither busy nor spoken for)."""
+        with self._cond:
+            return max(0, self.max_in_flight - len(self._running) - self._queued)
+
+    # --- position / wait estimate ---
+    def position(self, ticket):
+        """0 when running or finished, otherwise 1-based rank in the round-robin order."""
+        with self._cond:
+            if ticket.state != "queued":
+                return 0
+            return self._rank(ticket)
+
+    def estimated_wait(self, ticket):
+        """Rough number of seconds before the job finishes."""
+        with self._cond:
+            if ticket.state == "running":
+                return max(0.0, self._service_time - (time.monotonic() - ticket.started_at))
+            if ticket.state != "queued":
+                return 0.0
+            return self._estimate(self._rank(ticket))
+
+    def _estimate(self, rank):
+        # Jobs ahead are served max_in_flight at a time, then ours runs
+        waves = (rank - 1) // self.max_in_flight + 1 if rank > 0 else 0
+        return waves * self._service_time
+
+    def _rank(self, ticket):
+        # Replay the scheduler on a copy of the queues until our ticket comes out
+        classes = {name: OrderedDict((sid, deque(q)) for sid, q in students.items())
+                   for name, students in self._classes.items()}
+        rank = 0
+        while True:
+            picked = self._pick(classes)
+            if picked is None:
+                return 0
+            rank += 1
+            if picked is ticket:
+                return rank
+
+    @staticmethod
+    def _pick(classes):
+        # Each class offers the head of its next student in rotation; the earliest deadline wins
+        best_class = None
+        for name, students in classes.items():
+            if students:
+                head = next(iter(students.values()))[0]
+                if best_class is None or head.deadline < best_head.deadline:
+                    best_class, best_head = name, head
+        if best_class is None:
+            return None
+        students = classes[best_class]
+        student_id, q = next(iter(students.items()))
+        ticket = q.popleft()
+        del students[student_id]
+        if q:
+            students[student_id] = q
+        return ticket
+
+    def _next(self):
+        ticket = self._pick(self._classes)
+        self._queued -= 1
+        return ticket
+
+    # --- workers ---
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queued:
+                    self._cond.wait()
+                ticket = self._next()
+                ticket.state = "running"
+                ticket.started_at = time.monotonic()
+                self._running[ticket.id] = ticket
+            try:
+                ticket.result = ticket.fn(*ticket.args, **ticket.kwargs)
+                ticket.state = "done"
+            except Exception as e:
+                ticket.error = e
+                ticket.state = "failed"
+            ticket.finished_at = time.monotonic()
+            with self._cond:
+                self._running.pop(ticket.id, None)
+                elapsed = ticket.finished_at - ticket.started_at
+                self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+                samples = self._latencies[ticket.priority]
+                samples["wait"].append(ticket.started_at - ticket.submitted_at)
+                samples["total"].append(ticket.finished_at - ticket.submitted_at)
+                REGISTRY.observe("work_queue_wait_seconds", ticket.started_at - ticket.submitted_at,
+                                 queue=self.name, priority=ticket.priority)
+                REGISTRY.observe("work_queue_run_seconds", elapsed, queue=self.name, priority=ticket.priority)
+                if ticket.state == "done":
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self._forget_old()
+            ticket._done.set()
+
+    def _forget_old(self, keep_seconds=600):
+        # Finished tickets stay readable for a while so sessions can pick up their result
+        now = time.monotonic()
+        for ticket_id, ticket in list(self._tickets.items()):
+            if ticket.finished_at and now - ticket.finished_at > keep_seconds:
+                del self._tickets[ticket_id]
+                if ticket.key is not None and self._by_key.get(ticket.key) == ticket_id:
+                    del self._by_key[ticket.key]
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": self._queued,
+                "in_flight": len(self._running),
+                "max_in_flight": self.max_in_flight,
+                "max_queued": self.max_queued,
+                "students_waiting": len({sid for students in self._classes.values() for sid in students}),
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_service_time": self._service_time,
+                "classes": {name: self._class_stats(name) for name in PRIORITY_CLASSES},
+            }
+
+    def depth(self):
+        """{(state, priority): tickets} for the depth gauge."""
+        with self._cond:
+            depth = {("queued", name): sum(len(q) for q in students.values()) for name, students in self._classes.items()}
+            for name in PRIORITY_CLASSES:
+                depth[("running", name)] = 0
+            for ticket in self._running.values():
+                depth[("running", ticket.priority)] += 1
+            return depth
+
+    def _class_stats(self, name):
+        samples = self._latencies[name]
+        return {
+            "queued": sum(len(q) for q in self._classes[name].values()),
+            "wait_p50": _percentile(samples["wait"], 50),
+            "wait_p95": _percentile(samples["wait"], 95),
+            "latency_p50": _percentile(samples["total"], 50),
+            "latency_p95": _percentile(samples["total"], 95),
+            "samples": len(samples["total"]),
+        }
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, -(-pct * len(ordered) // 100) - 1)]
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+_QUEUE_DEFAULTS = {
+    # name: (max_in_flight, max_queued, default service time in seconds)
+    "generation": (2, 50, 40.0),
+    "correction": (4, 200, 20.0),
+    "prefetch": (2, 50, 0.5),
+}
+
+
+def get_queue(name):
+    """Process-wide queue, sized from {NAME}_MAX_IN_FLIGHT / {NAME}_MAX_QUEUED."""
+    with _queues_lock:
+        if name not in _queues:
+            in_flight, queued, service_time = _QUEUE_DEFAULTS.get(name, (4, 100, 20.0))
+            prefix = name.upper()
+            _queues[name] = WorkQueue(
+                name,
+                max_in_flight=int(os.getenv(f"{prefix}_MAX_IN_FLIGHT", str(in_flight))),
+                max_queued=int(os.getenv(f"{prefix}_MAX_QUEUED", str(queued))),
+                default_service_time=service_time,
+            )
+        return _queues[name]
+
+
+def _depth_gauge():
+    with _queues_lock:
+        queues = list(_queues.values())
+    return {(("priority", priority), ("queue", queue.name), ("state", state)): count
+            for queue in queues for (state, priority), count in queue.depth().items()}
+
+
+REGISTRY.gauge("work_queue_depth", _depth_gauge, "Demandes en attente (queued) ou en cours (running) par file et classe de priorité")
+
+
+def format_wait(seconds):
+    """Human readable wait estimate for the waiting UI."""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"~{max(seconds, 1)} s"
+    return f"~{(seconds + 59) // 60} min"